@@ -1,13 +1,15 @@
 """Entry point to start change detection"""
 
 import logging
-from os.path import expanduser, join
+from os.path import dirname, expanduser, join
 from urllib.parse import urlsplit
 
 from . import __version__
+from .content_encoding import COMPRESSED_FORMATS
 from .dataset_processor import DatasetProcessor
 from .head_results import HeadResults
 from .head_retrieval import HeadRetrieval
+from .host_registry import HostRegistry
 from .results import Results
 from .retrieval import Retrieval
 from hdx.api.configuration import Configuration
@@ -72,6 +74,12 @@ def main(
         total_resource_status = {}
         task_manager = TaskManager()
         task_code = None
+        # The batch folder is removed after a successful run so by default the
+        # registry is kept in the folder above it
+        host_registry_path = configuration.get("host_registry_path")
+        if not host_registry_path:
+            host_registry_path = join(dirname(folder), f"{lookup}-hosts.sqlite")
+        host_registry = HostRegistry(host_registry_path)
         while not use_redis or (task_code := task_manager.sync_acquire_task()):
             netlocs_ignore = {
                 "data.humdata.org",
@@ -84,9 +92,24 @@ def main(
             datasets = dataset_processor.get_all_datasets()
             dataset_processor.process(datasets)
 
-            resources_to_check = dataset_processor.get_distributed_resources_to_check()
+            resources_to_check = dataset_processor.get_distributed_resources_to_check(
+                host_registry
+            )
             netlocs = dataset_processor.get_netlocs()
-            retrieval = HeadRetrieval(configuration.get_user_agent(), netlocs)
+            retrieval_configuration = configuration.get("retrieval", {})
+            retrieval = HeadRetrieval(
+                configuration.get_user_agent(),
+                netlocs,
+                retrieval_configuration.get("compressed_formats", COMPRESSED_FORMATS),
+                retrieval_configuration.get("conditional_requests", True),
+                ["xlsx"] + retrieval_configuration.get("zip_fingerprint_formats", []),
+                retrieval_configuration.get("max_workers", 100),
+                host_registry,
+                retrieval_configuration.get("host_limits"),
+                retrieval_configuration.get("retry_budget"),
+                retrieval_configuration.get("circuit_breaker"),
+                configuration.get("head_hedging"),
+            )
             results = retrieval.retrieve(resources_to_check)
 
             total_head_results.add_more_results(
@@ -96,10 +119,19 @@ def main(
             head_results = HeadResults(results, dataset_processor.get_resources())
             head_results.process(resource_status)
 
-            resources_to_get = head_results.get_distributed_resources_to_get()
+            resources_to_get = head_results.get_distributed_resources_to_get(
+                host_registry
+            )
             netlocs = head_results.get_netlocs()
-            retrieval = Retrieval(configuration.get_user_agent(), netlocs)
-            results = retrieval.retrieve(resources_to_get)
+            retrieval = Retrieval(
+                configuration.get_user_agent(),
+                netlocs,
+                spool_folder=folder,
+                host_registry=host_registry,
+                **retrieval_configuration,
+            )
+            results = retrieval.retrieve(resources_to_get, head_results.get_sizes())
+            host_registry.save()
 
             total_results.add_more_results(results, dataset_processor.get_resources())
             results = Results(today, results, dataset_processor.get_resources())
@@ -0,0 +1,183 @@
+"""Utility to stop sending requests to a host that is down."""
+
+import asyncio
+import logging
+from timeit import default_timer as timer
+from typing import Optional
+
+import aiohttp
+
+from .worker_pool import RetryLater
+
+logger = logging.getLogger(__name__)
+
+
+def is_connection_failure(exception: BaseException) -> bool:
+    """Check if an exception means that a host could not be reached or did
+    not respond in time
+
+    Args:
+        exception (BaseException): Exception raised by a request
+
+    Returns:
+        bool: True if connection failed or timed out
+    """
+    return isinstance(exception, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
+
+
+def is_connect_failure(exception: BaseException) -> bool:
+    """Check if an exception means that a connection to a host could not be
+    made as opposed to a request that failed or timed out after connecting
+
+    Args:
+        exception (BaseException): Exception raised by a request
+
+    Returns:
+        bool: True if connection could not be made
+    """
+    return isinstance(
+        exception, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+    )
+
+
+class CircuitBreaker:
+    """Circuit breaker for a host. The circuit opens after failure_threshold
+    consecutive connection failures or timeouts so that the remaining
+    resources of the host fail immediately instead of each waiting for a
+    timeout. After reset_timeout seconds, the circuit is half open and one
+    request is let through to test whether the host has recovered. If it
+    reaches the host, the circuit closes. Otherwise it opens again. Requests
+    refused while the circuit is open are held back by hold and released
+    together when the trial request succeeds or fails unless a trial has
+    already failed.
+
+    Args:
+        host (str): Host
+        failure_threshold (int): Consecutive failures that open circuit. Defaults to 5.
+        reset_timeout (float): Seconds before testing host again. Defaults to 60.
+    """
+
+    closed = "closed"
+    open = "open"
+    half_open = "half open"
+
+    def __init__(
+        self, host: str, failure_threshold: int = 5, reset_timeout: float = 60
+    ) -> None:
+        self._host = host
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at: Optional[float] = None
+        self._trial_failed = False
+        # Done when held requests are released
+        self._released: Optional[asyncio.Future] = None
+        self.state = self.closed
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        """Check if a request to the host may be made
+
+        Args:
+            now (Optional[float]): Current time. Defaults to None (timer()).
+
+        Returns:
+            bool: True if request may be made
+        """
+        if self.state == self.closed:
+            return True
+        if now is None:
+            now = timer()
+        if self.state == self.open:
+            if now - self._opened_at < self._reset_timeout:
+                return False
+            self.state = self.half_open
+            self._trial_started_at = None
+        # Only one trial request at a time unless it has not reported back
+        if (
+            self._trial_started_at is not None
+            and now - self._trial_started_at < self._reset_timeout
+        ):
+            return False
+        self._trial_started_at = now
+        return True
+
+    def is_open(self) -> bool:
+        """Check if the circuit is open without letting a trial request
+        through
+
+        Returns:
+            bool: True if circuit is open
+        """
+        return self.state == self.open
+
+    def hold(self, now: Optional[float] = None) -> None:
+        """Hold back a request refused by the circuit by raising RetryLater
+        until the trial request succeeds or fails unless a trial has failed
+        since the circuit opened in which case the host is taken to be down
+        and the request should fail. Before the trial is due, held requests
+        are retried once it is due so that one of them becomes the trial.
+
+        Args:
+            now (Optional[float]): Current time. Defaults to None (timer()).
+
+        Returns:
+            None
+        """
+        if self._trial_failed:
+            return
+        if now is None:
+            now = timer()
+        if self._released is None:
+            self._released = asyncio.get_running_loop().create_future()
+        if self.state == self.open:
+            delay = self._opened_at + self._reset_timeout - now
+        else:
+            # In case the trial does not report back
+            delay = self._reset_timeout
+        raise RetryLater(max(delay, 0), self._released)
+
+    def _release(self) -> None:
+        if self._released is not None:
+            self._released.set_result(None)
+            self._released = None
+
+    def record_success(self) -> None:
+        """Record a request that reached the host
+
+        Returns:
+            None
+        """
+        if self.state != self.closed:
+            logger.info(f"Circuit for {self._host} closed")
+        self._failures = 0
+        self._trial_started_at = None
+        self._trial_failed = False
+        self.state = self.closed
+        self._release()
+
+    def record_failure(self, now: Optional[float] = None) -> None:
+        """Record a request that failed to connect or timed out
+
+        Args:
+            now (Optional[float]): Current time. Defaults to None (timer()).
+
+        Returns:
+            None
+        """
+        if now is None:
+            now = timer()
+        self._failures += 1
+        if self.state == self.half_open or (
+            self.state == self.closed and self._failures >= self._failure_threshold
+        ):
+            if self.state == self.closed:
+                logger.warning(
+                    f"Circuit for {self._host} opened after {self._failures} failures"
+                )
+            else:
+                self._trial_failed = True
+            self.state = self.open
+            self._opened_at = now
+            self._trial_started_at = None
+            self._release()
@@ -0,0 +1,86 @@
+"""Utilities to get the md5 of a resource from digest headers published by
+the server so that it does not need to be downloaded."""
+
+import binascii
+import re
+from base64 import b64decode
+from typing import Iterable, Optional
+
+from multidict import CIMultiDictProxy
+
+# Entries of RFC 9530 Repr-Digest and Content-Digest eg. md5=:base64:
+STRUCTURED_DIGEST_RE = re.compile(r"([\w-]+)=:([A-Za-z0-9+/=]+):")
+MD5_HEX_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def decode_md5(value: str) -> Optional[str]:
+    """Convert a base64 encoded md5 to hex
+
+    Args:
+        value (str): Base64 encoded md5
+
+    Returns:
+        Optional[str]: MD5 hex digest or None if value is not a base64 md5
+    """
+    try:
+        digest = b64decode(value.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if len(digest) != 16:
+        return None
+    return digest.hex()
+
+
+def _get_values(headers: CIMultiDictProxy, name: str) -> Iterable[str]:
+    for value in headers.getall(name, ()):
+        yield from value.split(",")
+
+
+def get_md5_digest(headers: CIMultiDictProxy) -> Optional[str]:
+    """Get the md5 of a resource from headers. Supported headers are
+    Content-MD5, GCS x-goog-hash, RFC 9530 Repr-Digest and Content-Digest,
+    RFC 3230 Digest and S3 ETags of objects not uploaded in parts. The md5 is
+    of the bytes of the file so it is not used if the response has a
+    Content-Encoding. Digests that are not md5 eg. x-amz-checksum-sha256
+    cannot be compared with hashes calculated by downloading so are ignored.
+
+    Args:
+        headers (CIMultiDictProxy): Response headers
+
+    Returns:
+        Optional[str]: MD5 hex digest or None if not available
+    """
+    content_encoding = headers.get("Content-Encoding")
+    if content_encoding and content_encoding.strip().lower() != "identity":
+        return None
+    content_md5 = headers.get("Content-MD5")
+    if content_md5:
+        md5 = decode_md5(content_md5)
+        if md5:
+            return md5
+    for value in _get_values(headers, "x-goog-hash"):
+        algorithm, _, digest = value.strip().partition("=")
+        if algorithm.lower() == "md5":
+            md5 = decode_md5(digest)
+            if md5:
+                return md5
+    for name in ("Repr-Digest", "Content-Digest"):
+        for value in headers.getall(name, ()):
+            for algorithm, digest in STRUCTURED_DIGEST_RE.findall(value):
+                if algorithm.lower() == "md5":
+                    md5 = decode_md5(digest)
+                    if md5:
+                        return md5
+    for value in _get_values(headers, "Digest"):
+        algorithm, _, digest = value.strip().partition("=")
+        if algorithm.lower() == "md5":
+            md5 = decode_md5(digest)
+            if md5:
+                return md5
+    if "x-amz-request-id" in headers or headers.get("Server") == "AmazonS3":
+        # ETags of objects uploaded in parts have a suffix eg. -3 and are not
+        # the md5 of the file
+        etag = headers.get("ETag", "").strip('"').lower()
+        if MD5_HEX_RE.match(etag):
+            return etag
+    return None
@@ -0,0 +1,218 @@
+"""Utilities to decode response bodies sent with a Content-Encoding so that
+the bytes transferred and the decoded bytes can both be counted."""
+
+import zlib
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+import zstandard
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Text formats that compress well in transfer
+COMPRESSED_FORMATS = ("csv", "json", "geojson")
+
+
+class UnsupportedEncoding(Exception):
+    """Raised when a response has a Content-Encoding that cannot be decoded"""
+
+
+class _ZlibDecoder:
+    def __init__(self, wbits: Optional[int]) -> None:
+        # wbits of None means deflate which may or may not have a zlib header
+        self._wbits = wbits
+        self._decompressor = None
+
+    def decompress(self, data: bytes) -> bytes:
+        if self._decompressor is None:
+            if not data:
+                return b""
+            wbits = self._wbits
+            if wbits is None:
+                wbits = zlib.MAX_WBITS if data[0] & 0x0F == 8 else -zlib.MAX_WBITS
+            self._decompressor = zlib.decompressobj(wbits)
+        output = self._decompressor.decompress(data)
+        if (
+            self._wbits is not None
+            and self._decompressor.eof
+            and self._decompressor.unused_data
+        ):
+            # Concatenated gzip members
+            unused_data = self._decompressor.unused_data
+            self._decompressor = None
+            output += self.decompress(unused_data)
+        return output
+
+    def flush(self) -> bytes:
+        if self._decompressor is None:
+            return b""
+        return self._decompressor.flush()
+
+
+class _BrotliDecoder:
+    def __init__(self) -> None:
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.process(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _ZstdDecoder:
+    def __init__(self) -> None:
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        return self._decompressor.flush()
+
+
+def _get_decoder_factories() -> Dict[str, Callable]:
+    factories = {
+        "gzip": lambda: _ZlibDecoder(16 + zlib.MAX_WBITS),
+        "x-gzip": lambda: _ZlibDecoder(16 + zlib.MAX_WBITS),
+        "deflate": lambda: _ZlibDecoder(None),
+    }
+    if brotli is not None:
+        factories["br"] = _BrotliDecoder
+    factories["zstd"] = _ZstdDecoder
+    return factories
+
+
+decoder_factories = _get_decoder_factories()
+
+
+def get_accept_encoding() -> str:
+    """Get Accept-Encoding header value listing the encodings that can be
+    decoded. Brotli is included if its package is installed.
+
+    Returns:
+        str: Accept-Encoding header value
+    """
+    return ", ".join(x for x in decoder_factories if x != "x-gzip")
+
+
+def get_default_accept_encoding() -> str:
+    """Get Accept-Encoding header value that aiohttp sends by default. It is
+    kept for formats not requested with compressed transfer as servers that
+    vary ETags by encoding (eg. Apache's -gzip suffix) would otherwise change
+    every stored ETag.
+
+    Returns:
+        str: Accept-Encoding header value
+    """
+    return "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+
+
+def get_accept_encoding_for_format(
+    resource_format: str, compressed_formats: Iterable[str] = COMPRESSED_FORMATS
+) -> str:
+    """Get Accept-Encoding header value for a resource format. Every
+    encoding that can be decoded is requested for formats in
+    compressed_formats. Other formats are requested with aiohttp's default
+    Accept-Encoding so that ETags of resources checked before are unchanged.
+
+    Args:
+        resource_format (str): Resource format
+        compressed_formats (Iterable[str]): Formats to request compressed. Defaults to COMPRESSED_FORMATS.
+
+    Returns:
+        str: Accept-Encoding header value
+    """
+    if resource_format in compressed_formats:
+        return get_accept_encoding()
+    return get_default_accept_encoding()
+
+
+class ContentDecoder:
+    """Decoder for a response body sent with a Content-Encoding. Encodings
+    applied in turn eg. "gzip, br" are decoded in reverse order. The number of
+    bytes received before decoding is counted in encoded_size.
+
+    Args:
+        content_encoding (str): Value of Content-Encoding header
+    """
+
+    def __init__(self, content_encoding: str) -> None:
+        self._decoders: List = []
+        for encoding in reversed(content_encoding.split(",")):
+            encoding = encoding.strip().lower()
+            if encoding in ("", "identity"):
+                continue
+            factory = decoder_factories.get(encoding)
+            if factory is None:
+                raise UnsupportedEncoding(
+                    f"Unsupported Content-Encoding {content_encoding}!"
+                )
+            self._decoders.append(factory())
+        self.encoded_size = 0
+
+    def is_identity(self) -> bool:
+        return not self._decoders
+
+    def decompress(self, chunk: bytes) -> bytes:
+        """Decode a chunk of the response body
+
+        Args:
+            chunk (bytes): Chunk of encoded data
+
+        Returns:
+            bytes: Decoded data which may be empty
+        """
+        self.encoded_size += len(chunk)
+        for decoder in self._decoders:
+            chunk = decoder.decompress(chunk)
+        return chunk
+
+    def flush(self) -> bytes:
+        """Get any remaining decoded data at the end of the response body
+
+        Returns:
+            bytes: Decoded data which may be empty
+        """
+        output = b""
+        for decoder in self._decoders:
+            if output:
+                output = decoder.decompress(output)
+            output += decoder.flush()
+        return output
+
+    async def decode(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Decode a stream of chunks of the response body
+
+        Args:
+            chunks (AsyncIterator[bytes]): Chunks of encoded data
+
+        Returns:
+            AsyncIterator[bytes]: Non-empty chunks of decoded data
+        """
+        async for chunk in chunks:
+            output = self.decompress(chunk)
+            if output:
+                yield output
+        output = self.flush()
+        if output:
+            yield output
+
+
+def get_decoder(content_encoding: Optional[str]) -> Optional[ContentDecoder]:
+    """Get decoder for a Content-Encoding
+
+    Args:
+        content_encoding (Optional[str]): Value of Content-Encoding header
+
+    Returns:
+        Optional[ContentDecoder]: Decoder or None if body is not encoded
+    """
+    if not content_encoding:
+        return None
+    decoder = ContentDecoder(content_encoding)
+    if decoder.is_identity():
+        return None
+    return decoder
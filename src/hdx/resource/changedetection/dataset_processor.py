@@ -1,6 +1,7 @@
 from typing import Dict, Iterable, List, Optional, Set, Tuple
 from urllib.parse import urlsplit
 
+from .host_scheduler import HostTimings, order_by_host_time
 from hdx.api.configuration import Configuration
 from hdx.data.dataset import Dataset
 from hdx.scraper.framework.utilities.reader import Read
@@ -69,11 +70,16 @@ class DatasetProcessor:
     def get_resources(self) -> Dict[str, Tuple]:
         return self._resources
 
-    def get_distributed_resources_to_check(self) -> List[Tuple]:
+    def get_distributed_resources_to_check(
+        self, host_timings: Optional[HostTimings] = None
+    ) -> List[Tuple]:
         def get_netloc(x):
             return urlsplit(x[0]).netloc
 
-        return list_distribute_contents(list(self._resources.values()), get_netloc)
+        resources = list(self._resources.values())
+        if host_timings is None:
+            return list_distribute_contents(resources, get_netloc)
+        return order_by_host_time(resources, "head", host_timings, get_netloc)
 
     def get_netlocs(self) -> Set[str]:
         return self._netlocs
@@ -1,8 +1,9 @@
 import logging
 from http import HTTPStatus
-from typing import Dict, List, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 from urllib.parse import urlsplit
 
+from .host_scheduler import HostTimings, order_by_host_time
 from .utilities import get_blank_log_status, revise_resource, status_lookup
 from hdx.utilities.dateparse import parse_date
 from hdx.utilities.dictandlist import (
@@ -20,6 +21,7 @@ class HeadResults:
         self._results = results
         self._resources = resources
         self._resources_to_get = {}
+        self._sizes = {}
         self._datasets_to_revise = {}
         self._netlocs = set()
 
@@ -57,6 +59,14 @@ class HeadResults:
             size, last_modified, etag, status = result
             status_str = status_lookup[status]
             log_status["Head Status"] = status_str
+            if status == HTTPStatus.NOT_MODIFIED:
+                # Server confirmed stored ETag or last modified is current
+                resource_status[resource_id] = log_status
+                continue
+            if -100 <= status < -10:
+                # Not checked eg. host circuit open so leave resource as is
+                resource_status[resource_id] = log_status
+                continue
             if status != HTTPStatus.OK:
                 if status in (
                     HTTPStatus.FORBIDDEN,
@@ -137,6 +147,8 @@ class HeadResults:
 
             if get_resource:
                 self._resources_to_get[resource_id] = resource
+                if size:
+                    self._sizes[resource_id] = size
             if resource_info:
                 revise_resource(
                     self._datasets_to_revise,
@@ -147,15 +159,21 @@ class HeadResults:
                 log_status["Update"] = "Y"
             resource_status[resource_id] = log_status
 
-    def get_distributed_resources_to_get(self) -> List[Tuple]:
+    def get_distributed_resources_to_get(
+        self, host_timings: Optional[HostTimings] = None
+    ) -> List[Tuple]:
         def get_netloc(x):
             netloc = urlsplit(x[0]).netloc
             self._netlocs.add(netloc)
             return netloc
 
-        return list_distribute_contents(
-            list(self._resources_to_get.values()), get_netloc
-        )
+        resources = list(self._resources_to_get.values())
+        if host_timings is None:
+            return list_distribute_contents(resources, get_netloc)
+        return order_by_host_time(resources, "get", host_timings, get_netloc)
+
+    def get_sizes(self) -> Dict[str, int]:
+        return self._sizes
 
     def get_netlocs(self) -> Set[str]:
         return self._netlocs
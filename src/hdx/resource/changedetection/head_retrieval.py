@@ -2,22 +2,31 @@
 
 import asyncio
 import logging
+from http import HTTPStatus
+from random import random
 from timeit import default_timer as timer
-from typing import Dict, List, Set, Tuple
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
 from urllib.parse import urlsplit
 
 import aiohttp
 from aiohttp import ClientResponseError
-from aiolimiter import AsyncLimiter
-from tenacity import (
-    retry,
-    retry_if_exception,
-    stop_after_attempt,
-)
-from tqdm.asyncio import tqdm_asyncio
+from multidict import CIMultiDictProxy
+from tqdm import tqdm
 
+from .circuit_breaker import CircuitBreaker, is_connection_failure
+from .content_digest import get_md5_digest
+from .content_encoding import COMPRESSED_FORMATS, get_accept_encoding_for_format
+from .host_limiter import HostLimiter, is_overload_exception, is_overload_status
+from .host_registry import HostRegistry
+from .retry_tracker import RetryTracker
 from .tenacity_custom_wait import custom_wait
-from .utilities import is_server_error
+from .utilities import (
+    get_conditional_headers,
+    get_netloc,
+    get_percentile,
+    parse_content_range,
+)
+from .worker_pool import stream_results_by_key
 
 logger = logging.getLogger(__name__)
 
@@ -28,62 +37,387 @@ class HeadRetrieval:
     Args:
         user_agent (str): User agent string to use when downloading
         netlocs (Set[str]): Netlocs of resources to download
+        compressed_formats (Iterable[str]): Formats requested with compressed transfer. Defaults to COMPRESSED_FORMATS.
+        conditional_requests (bool): Send stored ETag and last modified so unchanged resources get 304. Defaults to True.
+        digest_formats_ignore (Iterable[str]): Formats not hashed by md5 of file so digest headers are not used. Defaults to ("xlsx",).
+        max_workers (int): Maximum resources checked at once. Defaults to 100.
+        host_registry (Optional[HostRegistry]): Registry of how hosts behaved in previous runs. Defaults to None.
+        host_limits (Optional[Dict]): Arguments for adaptive limiter of each host. Defaults to None (HostLimiter defaults).
+        retry_budget (Optional[Dict]): Arguments for retry budget of each host. Defaults to None (RetryBudget defaults).
+        circuit_breaker (Optional[Dict]): Arguments for circuit breaker of each host. Defaults to None (CircuitBreaker defaults).
+        hedging (Optional[Dict]): Percentile, min_delay and control_fraction for hedged requests. Defaults to None (no hedging).
     """
 
+    # Total timeout in seconds of requests to hosts not in the registry
+    total_timeout = 5 * 60
+    # Resources read ahead per worker so that other hosts can be served while
+    # the hosts of the next resources are busy
+    buffered_per_worker = 100
+    # HEAD responses that are retried as a GET request for the first byte
+    probe_statuses = (
+        HTTPStatus.FORBIDDEN,
+        HTTPStatus.METHOD_NOT_ALLOWED,
+        HTTPStatus.NOT_IMPLEMENTED,
+    )
+
     def __init__(
         self,
         user_agent: str,
         netlocs: Set[str],
+        compressed_formats: Iterable[str] = COMPRESSED_FORMATS,
+        conditional_requests: bool = True,
+        digest_formats_ignore: Iterable[str] = ("xlsx",),
+        max_workers: int = 100,
+        host_registry: Optional[HostRegistry] = None,
+        host_limits: Optional[Dict] = None,
+        retry_budget: Optional[Dict] = None,
+        circuit_breaker: Optional[Dict] = None,
+        hedging: Optional[Dict] = None,
     ) -> None:
         self._user_agent = user_agent
-        # Limit to 4 connections per second to a host
-        self._rate_limiters = {netloc: AsyncLimiter(4, 1) for netloc in netlocs}
-
-    @retry(
-        reraise=True,
-        retry=retry_if_exception(is_server_error),
-        stop=stop_after_attempt(3),
-        wait=custom_wait(multiplier=2, min=4),
-    )
+        self._compressed_formats = set(compressed_formats)
+        self._conditional_requests = conditional_requests
+        self._digest_formats_ignore = set(digest_formats_ignore)
+        self._max_workers = max_workers
+        self._host_registry = host_registry
+        # Transient failures are retried later from a queue so that they do
+        # not hold a slot while waiting
+        self._retry_tracker = RetryTracker(
+            custom_wait(multiplier=2, min=4, max=60), retry_budget=retry_budget
+        )
+        # Rate and concurrency of requests to each host adapt to its responses
+        host_limits = host_limits or {}
+        self._host_limiters = {}
+        for netloc in netlocs:
+            limits = dict(host_limits)
+            if host_registry:
+                # Start from the limits reached in previous runs
+                limits.update(host_registry.get_limits("head", netloc))
+            self._host_limiters[netloc] = HostLimiter(**limits)
+        self._max_connections_per_host = HostLimiter(**host_limits).max_concurrency
+        # Remaining resources of a host that is down fail immediately
+        circuit_breaker = circuit_breaker or {}
+        self._circuit_breakers = {
+            netloc: CircuitBreaker(netloc, **circuit_breaker) for netloc in netlocs
+        }
+        # A request outstanding longer than a latency percentile of its host
+        # is sent again and the first response is used
+        self._hedging = hedging
+        self.hedged = 0
+        self._completion_times: List[float] = []
+        # Latencies of resources that could be hedged and of those that were
+        # not, which with hedging are a random control group
+        self._latencies: Dict[str, List[float]] = {"hedged": [], "unhedged": []}
+
     async def fetch(
         self,
         url: str,
         resource_id: str,
+        resource_format: str,
         session: aiohttp.ClientSession,
+        conditional_headers: Optional[Dict[str, str]] = None,
+        existing_hash: Optional[str] = None,
     ) -> Tuple:
         """Asynchronous code to get http headers for a resource. Returns a
-        tuple with http headers including etag.
+        tuple with http headers including etag. If the server rejects HEAD
+        requests, the headers are probed with a GET request for the first byte.
 
         Args:
             url (str): Resource to get
             resource_id (str): Resource id
+            resource_format (str): Resource format
             session (Union[aiohttp.ClientSession, RateLimiter]): session to use for requests
+            conditional_headers (Optional[Dict[str, str]]): If-None-Match and If-Modified-Since headers. Defaults to None.
+            existing_hash (Optional[str]): Hash stored in HDX. Defaults to None.
 
         Returns:
             Tuple: Resource information including hash
         """
-        async with session.head(url, allow_redirects=True) as response:
+        # Same Accept-Encoding as the GET request so that the headers match
+        headers = {
+            "Accept-Encoding": get_accept_encoding_for_format(
+                resource_format, self._compressed_formats
+            )
+        }
+        if conditional_headers:
+            headers.update(conditional_headers)
+        netloc = urlsplit(url).netloc
+        timeout = self.get_timeout(netloc)
+        if (
+            self._host_registry
+            and self._host_registry.is_head_supported(netloc) is False
+        ):
+            # Host rejected HEAD requests in previous runs
+            result = await self.probe(
+                url,
+                resource_id,
+                resource_format,
+                session,
+                headers,
+                existing_hash,
+                timeout,
+            )
+            if result is not None:
+                return result
+        async with session.head(
+            url, allow_redirects=True, headers=headers, timeout=timeout
+        ) as response:
             status = response.status
+            if status in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED):
+                self.record_head_supported(netloc, True)
             if status == 200:
-                headers = response.headers
-                content_encoding = headers.get("Content-Encoding")
-                if content_encoding:
-                    http_size = None
-                else:
-                    http_size = headers.get("Content-Length")
-                    if http_size:
-                        http_size = int(http_size)
-                last_modified = headers.get("Last-Modified")
-                etag = headers.get("Etag")
-                return resource_id, http_size, last_modified, etag, 200
-            else:
-                exception = ClientResponseError(
-                    code=status,
-                    message=response.reason,
-                    request_info=response.request_info,
-                    history=response.history,
+                return self.get_result(
+                    resource_id, resource_format, response.headers, existing_hash
+                )
+            elif status == HTTPStatus.NOT_MODIFIED:
+                # Unchanged since the stored ETag or last modified date
+                last_modified = response.headers.get("Last-Modified")
+                return resource_id, None, last_modified, None, status
+            exception = ClientResponseError(
+                code=status,
+                message=response.reason,
+                request_info=response.request_info,
+                history=response.history,
+                headers=response.headers,
+            )
+        if status in self.probe_statuses:
+            # Server may reject HEAD but accept GET
+            result = await self.probe(
+                url,
+                resource_id,
+                resource_format,
+                session,
+                headers,
+                existing_hash,
+                timeout,
+            )
+            if result is not None:
+                self.record_head_supported(netloc, False)
+                return result
+        raise exception
+
+    def get_hedge_delay(self, netloc: str) -> Optional[float]:
+        """Get how long a request to host is outstanding before it is hedged
+        with a duplicate request. This is the configured latency percentile of
+        the host but at least min_delay.
+
+        Args:
+            netloc (str): Netloc of host
+
+        Returns:
+            Optional[float]: Delay in seconds or None if not hedged
+        """
+        if not self._hedging or not self._host_registry:
+            return None
+        latency = self._host_registry.get_latency(
+            "head", netloc, self._hedging.get("percentile", 90)
+        )
+        if latency is None:
+            return None
+        return max(latency, self._hedging.get("min_delay", 1))
+
+    async def hedged_fetch(self, limiter: HostLimiter, *args) -> Tuple:
+        """Fetch headers of a resource and, if there is no response within
+        the hedge delay of its host, fetch them again once. Whichever request
+        answers first is used and the other is cancelled. If one of them
+        fails, the other is awaited. The duplicate request takes a concurrency
+        slot of the host limiter and waits for its rate. It is not sent if
+        there is no free slot. A random control_fraction of resources is never
+        hedged so that the latencies of both groups can be compared.
+
+        Args:
+            limiter (HostLimiter): Limiter of host
+            *args: Arguments for fetch
+
+        Returns:
+            Tuple: Resource information including hash
+        """
+        start_time = timer()
+        delay = None
+        group = "unhedged"
+        if self._hedging and random() >= self._hedging.get("control_fraction", 0.1):
+            delay = self.get_hedge_delay(urlsplit(args[0]).netloc)
+            group = "hedged"
+        first = asyncio.ensure_future(self.fetch(*args))
+        pending = {first}
+        exception = None
+        acquired = False
+
+        async def hedge() -> Tuple:
+            await limiter.wait()
+            self.hedged += 1
+            return await self.fetch(*args)
+
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done or not limiter.try_acquire():
+                pending = set()
+                return await first
+            acquired = True
+            pending.add(asyncio.ensure_future(hedge()))
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
                 )
-                raise exception
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    if exception is None:
+                        exception = task.exception()
+            raise exception
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+            if acquired:
+                await limiter.release()
+            self._latencies[group].append(timer() - start_time)
+
+    def get_latency_percentile(
+        self, group: str = "hedged", percentile: int = 99
+    ) -> Optional[float]:
+        """Get percentile of the latencies of resources that could be hedged
+        (hedged) or that were not (unhedged)
+
+        Args:
+            group (str): hedged or unhedged. Defaults to hedged.
+            percentile (int): Percentile. Defaults to 99.
+
+        Returns:
+            Optional[float]: Latency in seconds or None if no resources in group
+        """
+        return get_percentile(self._latencies[group], percentile)
+
+    def get_completion_time(self, percentile: int = 99) -> Optional[float]:
+        """Get percentile of the times from the start of the phase at which
+        resources were completed
+
+        Args:
+            percentile (int): Percentile. Defaults to 99.
+
+        Returns:
+            Optional[float]: Time in seconds or None if no resources completed
+        """
+        return get_percentile(self._completion_times, percentile)
+
+    def get_timeout(self, netloc: str) -> aiohttp.ClientTimeout:
+        """Get timeout for requests to host. If the registry has the latency
+        of the host in previous runs, the total timeout is shortened so that
+        requests to a host that usually responds quickly fail sooner.
+
+        Args:
+            netloc (str): Netloc of host
+
+        Returns:
+            aiohttp.ClientTimeout: Timeout
+        """
+        total = self.total_timeout
+        if self._host_registry:
+            total = self._host_registry.get_timeout("head", netloc, total)
+        return aiohttp.ClientTimeout(total=total, sock_connect=30)
+
+    def record_head_supported(self, netloc: str, supported: bool) -> None:
+        """Record in registry whether host accepted a HEAD request
+
+        Args:
+            netloc (str): Netloc of host
+            supported (bool): Whether HEAD is supported
+
+        Returns:
+            None
+        """
+        if self._host_registry:
+            self._host_registry.record_head_supported(netloc, supported)
+
+    def get_result(
+        self,
+        resource_id: str,
+        resource_format: str,
+        headers: CIMultiDictProxy,
+        existing_hash: Optional[str],
+        partial: bool = False,
+    ) -> Tuple:
+        """Get tuple with size, last modified and etag from response headers.
+        If there is no etag or the md5 from digest headers equals the existing
+        hash, that md5 is returned in place of the etag.
+
+        Args:
+            resource_id (str): Resource id
+            resource_format (str): Resource format
+            headers (CIMultiDictProxy): Response headers
+            existing_hash (Optional[str]): Hash stored in HDX
+            partial (bool): Whether headers are of a 206 response. Defaults to False.
+
+        Returns:
+            Tuple: Resource information including hash
+        """
+        content_encoding = headers.get("Content-Encoding")
+        if content_encoding:
+            http_size = None
+        elif partial:
+            content_range = parse_content_range(headers.get("Content-Range"))
+            http_size = content_range[2] if content_range else None
+        else:
+            http_size = headers.get("Content-Length")
+            if http_size:
+                http_size = int(http_size)
+        last_modified = headers.get("Last-Modified")
+        etag = headers.get("Etag")
+        # Digest headers of a 206 response may be of the partial body
+        if not partial and resource_format not in self._digest_formats_ignore:
+            md5 = get_md5_digest(headers)
+            if md5 and (not etag or md5 == existing_hash):
+                etag = md5
+        return resource_id, http_size, last_modified, etag, 200
+
+    async def probe(
+        self,
+        url: str,
+        resource_id: str,
+        resource_format: str,
+        session: aiohttp.ClientSession,
+        headers: Dict[str, str],
+        existing_hash: Optional[str],
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+    ) -> Optional[Tuple]:
+        """Get http headers for a resource using a GET request for its first
+        byte for servers that reject HEAD requests. The total size is read
+        from Content-Range. The connection is closed without reading the body
+        in case the server ignores the range and sends the whole resource.
+
+        Args:
+            url (str): Resource to get
+            resource_id (str): Resource id
+            resource_format (str): Resource format
+            session (aiohttp.ClientSession): session to use for requests
+            headers (Dict[str, str]): Headers sent with the HEAD request
+            existing_hash (Optional[str]): Hash stored in HDX
+            timeout (Optional[aiohttp.ClientTimeout]): Timeout. Defaults to None (session timeout).
+
+        Returns:
+            Optional[Tuple]: Resource information including hash or None if probe failed
+        """
+        headers = {**headers, "Range": "bytes=0-0"}
+        timeout = timeout or session.timeout
+        async with session.get(
+            url, allow_redirects=True, headers=headers, timeout=timeout
+        ) as response:
+            status = response.status
+            if status == HTTPStatus.NOT_MODIFIED:
+                last_modified = response.headers.get("Last-Modified")
+                return resource_id, None, last_modified, None, status
+            if status not in (HTTPStatus.OK, HTTPStatus.PARTIAL_CONTENT):
+                return None
+            result = self.get_result(
+                resource_id,
+                resource_format,
+                response.headers,
+                existing_hash,
+                status == HTTPStatus.PARTIAL_CONTENT,
+            )
+            response.close()
+            return result
 
     async def process(
         self,
@@ -103,61 +437,136 @@ class HeadRetrieval:
         """
         url = metadata[0]
         resource_id = metadata[1]
+        resource_format = metadata[2]
 
         host = urlsplit(url).netloc
+        if self._conditional_requests:
+            conditional_headers = get_conditional_headers(metadata)
+        else:
+            conditional_headers = None
 
-        async with self._rate_limiters[host]:
+        circuit_breaker = self._circuit_breakers[host]
+        if not circuit_breaker.allow():
+            # Held back until the host is tried again or failed without
+            # waiting for a timeout if it is down
+            circuit_breaker.hold()
+            return resource_id, None, None, None, -12
+        limiter = self._host_limiters[host]
+        async with limiter:
+            if circuit_breaker.is_open():
+                # Circuit opened while waiting for the limiter
+                circuit_breaker.hold()
+                return resource_id, None, None, None, -12
+            start_time = timer()
             try:
-                return await self.fetch(url, resource_id, session)
+                result = await self.hedged_fetch(
+                    limiter,
+                    url,
+                    resource_id,
+                    resource_format,
+                    session,
+                    conditional_headers,
+                    metadata[6] if len(metadata) > 6 else None,
+                )
             except ClientResponseError as ex:
+                circuit_breaker.record_success()
+                if is_overload_status(ex.status):
+                    limiter.record_overload()
+                if self._host_registry:
+                    self._host_registry.record_error(
+                        "head", host, ex.status == HTTPStatus.TOO_MANY_REQUESTS
+                    )
+                self._retry_tracker.retry_later(resource_id, host, ex)
                 logger.error(f"{ex.status} {ex.message} {ex.request_info.url}")
                 return resource_id, None, None, None, ex.status
             except Exception as ex:
+                if is_connection_failure(ex):
+                    circuit_breaker.record_failure()
+                else:
+                    circuit_breaker.record_success()
+                if is_overload_exception(ex):
+                    limiter.record_overload()
+                if self._host_registry:
+                    self._host_registry.record_error("head", host)
+                self._retry_tracker.retry_later(resource_id, host, ex)
                 logger.error(ex)
                 return resource_id, None, None, None, -101
+            finally:
+                if self._host_registry:
+                    self._host_registry.record("head", host, timer() - start_time)
+                    self._host_registry.record_limits(
+                        "head", host, limiter.rate, limiter.concurrency
+                    )
+            circuit_breaker.record_success()
+            self._retry_tracker.record_success(host)
+            limiter.record_success(timer() - start_time)
+            return result
 
-    async def check_urls(self, resources_to_check: List[Tuple]) -> Dict[str, Tuple]:
-        """Asynchronous code to get HTTP headers of resources. Return
-        dictionary with resources information including etags, last modified
-        and size.
+    async def stream(self, resources_to_check: Iterable[Tuple]) -> AsyncIterator[Tuple]:
+        """Asynchronous code to get HTTP headers of resources. Resources are
+        taken lazily from the iterable by a bounded pool of workers and results
+        are yielded as they complete.
 
         Args:
-            resources_to_check (List[Tuple]): List of resources to be checked
+            resources_to_check (Iterable[Tuple]): Resources to be checked
 
         Returns:
-            Dict[str, Tuple]: Resources information
+            AsyncIterator[Tuple]: Resource information including etag
         """
-        tasks = []
-
-        # Maximum of 10 simultaneous connections to a host
-        conn = aiohttp.TCPConnector(limit_per_host=10)
+        # Connections to a host are limited to the highest concurrency of its limiter
+        conn = aiohttp.TCPConnector(limit_per_host=self._max_connections_per_host)
         # Can set some timeouts here if needed
-        timeout = aiohttp.ClientTimeout(total=5 * 60, sock_connect=30)
+        timeout = aiohttp.ClientTimeout(total=self.total_timeout, sock_connect=30)
         async with aiohttp.ClientSession(
             connector=conn,
             timeout=timeout,
             headers={"User-Agent": self._user_agent},
         ) as session:
-            for metadata in resources_to_check:
-                task = self.process(metadata, session)
-                tasks.append(task)
-            responses = {}
-            for f in tqdm_asyncio.as_completed(tasks, total=len(tasks)):
-                (
-                    resource_id,
-                    http_size,
-                    http_last_modified,
-                    etag,
-                    status,
-                ) = await f
 
+            async def process(metadata: Tuple) -> Tuple:
+                return await self.process(metadata, session)
+
+            # Resources wait in a queue per host rather than as coroutines
+            async for result in stream_results_by_key(
+                resources_to_check,
+                process,
+                get_netloc,
+                self._max_workers,
+                self._max_connections_per_host,
+                self._max_workers * self.buffered_per_worker,
+            ):
+                yield result
+
+    async def check_urls(self, resources_to_check: List[Tuple]) -> Dict[str, Tuple]:
+        """Asynchronous code to get HTTP headers of resources. Return
+        dictionary with resources information including etags, last modified
+        and size.
+
+        Args:
+            resources_to_check (List[Tuple]): List of resources to be checked
+
+        Returns:
+            Dict[str, Tuple]: Resources information
+        """
+        responses = {}
+        start_time = timer()
+        with tqdm(total=len(resources_to_check)) as progress:
+            async for (
+                resource_id,
+                http_size,
+                http_last_modified,
+                etag,
+                status,
+            ) in self.stream(resources_to_check):
                 responses[resource_id] = (
                     http_size,
                     http_last_modified,
                     etag,
                     status,
                 )
-            return responses
+                self._completion_times.append(timer() - start_time)
+                progress.update()
+        return responses
 
     def retrieve(self, resources_to_check: List[Tuple]) -> Dict[str, Tuple]:
         """Get HTTP headers of resources and hash them. Return dictionary with
@@ -173,4 +582,16 @@ class HeadRetrieval:
         start_time = timer()
         results = asyncio.run(self.check_urls(resources_to_check))
         logger.info(f"Execution time: {timer() - start_time} seconds")
+        hedging = "with" if self._hedging else "without"
+        logger.info(
+            f"p99 completion time {hedging} hedging: "
+            f"{self.get_completion_time(99)} seconds ({self.hedged} hedged)"
+        )
+        for group in ("hedged", "unhedged"):
+            latencies = self._latencies[group]
+            if latencies:
+                logger.info(
+                    f"p99 latency of {len(latencies)} {group} resources: "
+                    f"{self.get_latency_percentile(group)} seconds"
+                )
         return results
@@ -0,0 +1,191 @@
+"""Utility to limit the rate and concurrency of requests to a host, adapting
+the limits to how the host responds."""
+
+import asyncio
+from http import HTTPStatus
+from typing import Optional
+
+import aiohttp
+
+# Responses that mean a host is overloaded
+OVERLOAD_STATUSES = (
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+)
+
+
+def is_overload_status(status: Optional[int]) -> bool:
+    """Check if a status means that a host is overloaded
+
+    Args:
+        status (Optional[int]): HTTP status
+
+    Returns:
+        bool: True if host is overloaded
+    """
+    return status in OVERLOAD_STATUSES
+
+
+def is_overload_exception(exception: BaseException) -> bool:
+    """Check if an exception means that a host is overloaded ie. a timeout,
+    a connection error or an overload status
+
+    Args:
+        exception (BaseException): Exception raised by a request
+
+    Returns:
+        bool: True if host is overloaded
+    """
+    if isinstance(exception, aiohttp.ClientResponseError):
+        return is_overload_status(exception.status)
+    return isinstance(exception, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
+
+
+class HostLimiter:
+    """Additive increase, multiplicative decrease (AIMD) limit of requests to
+    a host. Entering the limiter waits for one of concurrency slots and then
+    for the next start allowed by rate. Each healthy response raises the rate
+    so that it grows by about rate_increase requests per second each second
+    and the concurrency so that it grows by one for each full set of
+    simultaneous requests that succeeds. A response is healthy if its latency
+    is within latency_tolerance times the average. Overload (429, 5xx or
+    timeout) cuts both by decrease_factor, at most once per decrease_interval
+    as requests in flight fail together.
+
+    Args:
+        rate (float): Initial requests per second. Defaults to 4.
+        concurrency (int): Initial simultaneous requests. Defaults to 10.
+        min_rate (float): Lowest requests per second. Defaults to 0.5.
+        max_rate (float): Highest requests per second. Defaults to 20.
+        min_concurrency (int): Lowest simultaneous requests. Defaults to 1.
+        max_concurrency (int): Highest simultaneous requests. Defaults to 20.
+        rate_increase (float): Increase in rate per second of healthy responses. Defaults to 1.
+        decrease_factor (float): Factor applied to limits on overload. Defaults to 0.5.
+        decrease_interval (float): Seconds after a decrease before another. Defaults to 1.
+        latency_tolerance (float): Multiple of average latency that is healthy. Defaults to 3.
+    """
+
+    # Weight of a new latency in the moving average
+    smoothing = 0.2
+
+    def __init__(
+        self,
+        rate: float = 4,
+        concurrency: int = 10,
+        min_rate: float = 0.5,
+        max_rate: float = 20,
+        min_concurrency: int = 1,
+        max_concurrency: int = 20,
+        rate_increase: float = 1,
+        decrease_factor: float = 0.5,
+        decrease_interval: float = 1,
+        latency_tolerance: float = 3,
+    ) -> None:
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.concurrency = min(max(concurrency, min_concurrency), max_concurrency)
+        self._rate_increase = rate_increase
+        self._decrease_factor = decrease_factor
+        self._decrease_interval = decrease_interval
+        self._latency_tolerance = latency_tolerance
+        self._latency: Optional[float] = None
+        self._last_decrease: Optional[float] = None
+        self._next_start = 0.0
+        self._active = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < int(self.concurrency))
+            self._active += 1
+        try:
+            await self.wait()
+        except BaseException:
+            await self.release()
+            raise
+
+    async def __aexit__(self, *args) -> None:
+        await self.release()
+
+    def try_acquire(self) -> bool:
+        """Take a concurrency slot if one is free without waiting. A slot
+        taken must be given back with release.
+
+        Returns:
+            bool: Whether a slot was taken
+        """
+        if self._active >= int(self.concurrency):
+            return False
+        self._active += 1
+        return True
+
+    async def release(self) -> None:
+        """Give back a concurrency slot
+
+        Returns:
+            None
+        """
+        async with self._condition:
+            self._active -= 1
+            self._condition.notify(max(int(self.concurrency) - self._active, 0))
+
+    async def wait(self) -> None:
+        """Wait for the next start allowed by the rate without taking a
+        concurrency slot eg. for requests made while already in the limiter
+
+        Returns:
+            None
+        """
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next_start)
+        self._next_start = start + 1 / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def record_success(self, latency: Optional[float] = None) -> None:
+        """Record a response from the host that is not an overload and raise
+        the limits if the latency is healthy
+
+        Args:
+            latency (Optional[float]): Latency of response. Defaults to None (not known).
+
+        Returns:
+            None
+        """
+        if latency is not None:
+            average = self._latency
+            if average is None:
+                self._latency = latency
+            else:
+                self._latency = average + self.smoothing * (latency - average)
+                if latency > average * self._latency_tolerance:
+                    return
+        self.rate = min(self.rate + self._rate_increase / self.rate, self.max_rate)
+        self.concurrency = min(
+            self.concurrency + 1 / self.concurrency, self.max_concurrency
+        )
+
+    def record_overload(self) -> None:
+        """Record an overload of the host (429, 5xx or timeout) and cut the
+        limits
+
+        Returns:
+            None
+        """
+        now = asyncio.get_running_loop().time()
+        if (
+            self._last_decrease is not None
+            and now - self._last_decrease < self._decrease_interval
+        ):
+            return
+        self._last_decrease = now
+        self.rate = max(self.rate * self._decrease_factor, self.min_rate)
+        self.concurrency = max(
+            self.concurrency * self._decrease_factor, self.min_concurrency
+        )
@@ -0,0 +1,324 @@
+"""Registry of how each host behaved in previous runs kept in SQLite so that
+a run starts with limits, timeouts and ordering tuned to each host."""
+
+import logging
+import sqlite3
+import time
+from collections import deque
+from statistics import quantiles
+from typing import Deque, Dict, Optional, Tuple
+
+from .host_scheduler import HostTimings
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    "duration",
+    "latency_p50",
+    "latency_p90",
+    "latency_p99",
+    "requests",
+    "errors",
+    "rate_limited",
+    "error_rate",
+    "head_supported",
+    "rate",
+    "concurrency",
+    "updated",
+)
+
+
+class _RunStats:
+    def __init__(self, max_samples: int) -> None:
+        self.latencies: Deque[float] = deque(maxlen=max_samples)
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.head_supported: Optional[bool] = None
+        self.rate: Optional[float] = None
+        self.concurrency: Optional[float] = None
+
+
+class HostRegistry(HostTimings):
+    """Request durations, latency percentiles, error rates, rate limiting,
+    HEAD support and learned rate and concurrency of each host for each phase
+    (eg. head or get). Stored values are loaded when the registry is created
+    and this run's values are merged into them when it is saved. If path is
+    None, nothing is kept between runs.
+
+    Args:
+        path (Optional[str]): Path to SQLite database. Defaults to None.
+        max_samples (int): Latencies per host kept for percentiles. Defaults to 1000.
+    """
+
+    # Weight of this run's percentiles and error rate against stored ones
+    run_smoothing = 0.5
+
+    def __init__(self, path: Optional[str] = None, max_samples: int = 1000) -> None:
+        super().__init__()
+        self._path = path
+        self._max_samples = max_samples
+        self._hosts: Dict[Tuple[str, str], Dict] = {}
+        self._run: Dict[Tuple[str, str], _RunStats] = {}
+        if path:
+            try:
+                self.load()
+            except sqlite3.Error as ex:
+                logger.warning(f"Could not load host registry: {ex}")
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._path)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS hosts (netloc TEXT NOT NULL, "
+            "phase TEXT NOT NULL, duration REAL, latency_p50 REAL, "
+            "latency_p90 REAL, latency_p99 REAL, requests INTEGER, "
+            "errors INTEGER, rate_limited INTEGER, error_rate REAL, "
+            "head_supported INTEGER, rate REAL, concurrency REAL, "
+            "updated REAL, PRIMARY KEY (netloc, phase))"
+        )
+        return connection
+
+    def load(self) -> None:
+        """Load stored values of hosts
+
+        Returns:
+            None
+        """
+        connection = self._connect()
+        try:
+            cursor = connection.execute(
+                f"SELECT netloc, phase, {', '.join(COLUMNS)} FROM hosts"
+            )
+            for row in cursor:
+                netloc, phase = row[:2]
+                host = dict(zip(COLUMNS, row[2:]))
+                self._hosts[(phase, netloc)] = host
+                if host["duration"] is not None:
+                    self._durations.setdefault(phase, {})[netloc] = host["duration"]
+        finally:
+            connection.close()
+
+    def _get_run(self, phase: str, netloc: str) -> _RunStats:
+        run = self._run.get((phase, netloc))
+        if run is None:
+            run = self._run[(phase, netloc)] = _RunStats(self._max_samples)
+        return run
+
+    def get_host(self, phase: str, netloc: str) -> Optional[Dict]:
+        """Get stored values of host
+
+        Args:
+            phase (str): Phase eg. head or get
+            netloc (str): Netloc of host
+
+        Returns:
+            Optional[Dict]: Stored values or None if host not known
+        """
+        return self._hosts.get((phase, netloc))
+
+    def get_limits(self, phase: str, netloc: str) -> Dict:
+        """Get rate and concurrency learned for host in previous runs to use
+        as initial limits
+
+        Args:
+            phase (str): Phase eg. head or get
+            netloc (str): Netloc of host
+
+        Returns:
+            Dict: Initial rate and concurrency if known
+        """
+        host = self.get_host(phase, netloc)
+        if not host:
+            return {}
+        return {
+            key: host[key] for key in ("rate", "concurrency") if host[key] is not None
+        }
+
+    def is_head_supported(self, netloc: str) -> Optional[bool]:
+        """Check if host accepted HEAD requests in previous runs
+
+        Args:
+            netloc (str): Netloc of host
+
+        Returns:
+            Optional[bool]: Whether HEAD is supported or None if not known
+        """
+        host = self.get_host("head", netloc)
+        if not host or host["head_supported"] is None:
+            return None
+        return bool(host["head_supported"])
+
+    def get_latency(
+        self, phase: str, netloc: str, percentile: int, min_samples: int = 20
+    ) -> Optional[float]:
+        """Get latency percentile of host from previous runs or, if the host
+        is not known, from this run once it has enough samples
+
+        Args:
+            phase (str): Phase eg. head or get
+            netloc (str): Netloc of host
+            percentile (int): Percentile (50, 90 or 99)
+            min_samples (int): Samples of this run needed. Defaults to 20.
+
+        Returns:
+            Optional[float]: Latency in seconds or None if not known
+        """
+        host = self.get_host(phase, netloc)
+        if host and host[f"latency_p{percentile}"] is not None:
+            return host[f"latency_p{percentile}"]
+        run = self._run.get((phase, netloc))
+        if not run or len(run.latencies) < min_samples:
+            return None
+        return quantiles(run.latencies, n=100, method="inclusive")[percentile - 1]
+
+    def get_timeout(
+        self,
+        phase: str,
+        netloc: str,
+        default: float,
+        minimum: float = 30,
+        factor: float = 10,
+    ) -> float:
+        """Get total timeout for requests to host from its 99th percentile
+        latency in previous runs so that requests to a host that usually
+        responds quickly do not wait for the default timeout
+
+        Args:
+            phase (str): Phase eg. head or get
+            netloc (str): Netloc of host
+            default (float): Timeout if host not known
+            minimum (float): Lowest timeout. Defaults to 30.
+            factor (float): Multiple of 99th percentile latency. Defaults to 10.
+
+        Returns:
+            float: Timeout in seconds
+        """
+        host = self.get_host(phase, netloc)
+        if not host or not host["latency_p99"]:
+            return default
+        return min(max(host["latency_p99"] * factor, minimum), default)
+
+    def record(self, phase: str, netloc: str, duration: float) -> None:
+        """Record duration of a request to host
+
+        Args:
+            phase (str): Phase eg. head or get
+            netloc (str): Netloc of host
+            duration (float): Duration in seconds
+
+        Returns:
+            None
+        """
+        super().record(phase, netloc, duration)
+        run = self._get_run(phase, netloc)
+        run.latencies.append(duration)
+        run.requests += 1
+
+    def record_error(self, phase: str, netloc: str, rate_limited: bool = False) -> None:
+        """Record a failed request to host
+
+        Args:
+            phase (str): Phase eg. head or get
+            netloc (str): Netloc of host
+            rate_limited (bool): Whether host rate limited request. Defaults to False.
+
+        Returns:
+            None
+        """
+        run = self._get_run(phase, netloc)
+        run.errors += 1
+        if rate_limited:
+            run.rate_limited += 1
+
+    def record_head_supported(self, netloc: str, supported: bool) -> None:
+        """Record whether host accepted a HEAD request
+
+        Args:
+            netloc (str): Netloc of host
+            supported (bool): Whether HEAD is supported
+
+        Returns:
+            None
+        """
+        self._get_run("head", netloc).head_supported = supported
+
+    def record_limits(
+        self, phase: str, netloc: str, rate: float, concurrency: float
+    ) -> None:
+        """Record rate and concurrency reached for host
+
+        Args:
+            phase (str): Phase eg. head or get
+            netloc (str): Netloc of host
+            rate (float): Requests per second
+            concurrency (float): Simultaneous requests
+
+        Returns:
+            None
+        """
+        run = self._get_run(phase, netloc)
+        run.rate = rate
+        run.concurrency = concurrency
+
+    def _smooth(
+        self, stored: Optional[float], value: Optional[float]
+    ) -> Optional[float]:
+        if value is None:
+            return stored
+        if stored is None:
+            return value
+        return stored + self.run_smoothing * (value - stored)
+
+    def _merge(self, phase: str, netloc: str, run: _RunStats) -> Dict:
+        host = self._hosts.get((phase, netloc)) or dict.fromkeys(COLUMNS)
+        host = dict(host)
+        host["duration"] = self.get_duration(phase, netloc)
+        if len(run.latencies) > 1:
+            percentiles = quantiles(run.latencies, n=100, method="inclusive")
+            for percentile in (50, 90, 99):
+                key = f"latency_p{percentile}"
+                host[key] = self._smooth(host[key], percentiles[percentile - 1])
+        elif run.latencies:
+            for key in ("latency_p50", "latency_p90", "latency_p99"):
+                host[key] = self._smooth(host[key], run.latencies[0])
+        host["requests"] = (host["requests"] or 0) + run.requests
+        host["errors"] = (host["errors"] or 0) + run.errors
+        host["rate_limited"] = (host["rate_limited"] or 0) + run.rate_limited
+        if run.requests:
+            host["error_rate"] = self._smooth(
+                host["error_rate"], run.errors / run.requests
+            )
+        if run.head_supported is not None:
+            host["head_supported"] = int(run.head_supported)
+        if run.rate is not None:
+            host["rate"] = run.rate
+            host["concurrency"] = run.concurrency
+        host["updated"] = time.time()
+        return host
+
+    def save(self) -> None:
+        """Merge this run's values into stored values and save them if there
+        is a path
+
+        Returns:
+            None
+        """
+        for (phase, netloc), run in self._run.items():
+            self._hosts[(phase, netloc)] = self._merge(phase, netloc, run)
+        self._run = {}
+        if not self._path:
+            return
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO hosts (netloc, phase, "
+                    f"{', '.join(COLUMNS)}) VALUES "
+                    f"({', '.join('?' * (len(COLUMNS) + 2))})",
+                    [
+                        (netloc, phase, *(host[key] for key in COLUMNS))
+                        for (phase, netloc), host in self._hosts.items()
+                    ],
+                )
+        finally:
+            connection.close()
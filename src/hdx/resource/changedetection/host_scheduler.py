@@ -0,0 +1,159 @@
+"""Utilities to order resources so that the hosts expected to take longest
+are started first and kept busy, which brings the total run time close to
+the time taken by the slowest host."""
+
+import heapq
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .utilities import get_netloc
+
+
+class HostTimings:
+    """Average duration of requests to each host for each phase (eg. head or
+    get). HostRegistry extends this to keep timings between runs.
+    """
+
+    # Weight of a new duration in the moving average
+    smoothing = 0.2
+
+    def __init__(self) -> None:
+        self._durations: Dict[str, Dict[str, float]] = {}
+
+    def get_duration(self, phase: str, netloc: str) -> Optional[float]:
+        """Get average duration of requests to host
+
+        Args:
+            phase (str): Phase eg. head or get
+            netloc (str): Netloc of host
+
+        Returns:
+            Optional[float]: Duration in seconds or None if not known
+        """
+        return self._durations.get(phase, {}).get(netloc)
+
+    def get_limits(self, phase: str, netloc: str) -> Dict:
+        """Get rate and concurrency known for host. Only HostRegistry learns
+        these from previous runs.
+
+        Args:
+            phase (str): Phase eg. head or get
+            netloc (str): Netloc of host
+
+        Returns:
+            Dict: Rate and concurrency if known
+        """
+        return {}
+
+    def record(self, phase: str, netloc: str, duration: float) -> None:
+        """Add duration of a request to host to the average
+
+        Args:
+            phase (str): Phase eg. head or get
+            netloc (str): Netloc of host
+            duration (float): Duration in seconds
+
+        Returns:
+            None
+        """
+        durations = self._durations.setdefault(phase, {})
+        average = durations.get(netloc)
+        if average is None:
+            durations[netloc] = duration
+        else:
+            durations[netloc] = average + self.smoothing * (duration - average)
+
+
+def estimate_host_time(
+    count: int,
+    duration: Optional[float],
+    rate: float = 4,
+    concurrency: int = 10,
+) -> float:
+    """Estimate time to process resources from a host. Requests to a host are
+    limited by both its rate limit and its number of connections.
+
+    Args:
+        count (int): Number of resources
+        duration (Optional[float]): Average duration of requests or None if not known
+        rate (float): Requests per second allowed to a host. Defaults to 4.
+        concurrency (int): Connections allowed to a host. Defaults to 10.
+
+    Returns:
+        float: Estimated time in seconds
+    """
+    time = count / rate
+    if duration:
+        time = max(time, count * duration / concurrency) + duration
+    return time
+
+
+def order_by_host_time(
+    resources: List[Tuple],
+    phase: str,
+    host_timings: Optional[HostTimings] = None,
+    get_key: Callable[[Tuple], str] = get_netloc,
+    rate: float = 4,
+    concurrency: int = 10,
+) -> List[Tuple]:
+    """Order resources so that each host is fed at the pace it can be
+    processed. Hosts are processed in parallel, so each resource is placed at
+    the time it is estimated to start given the rate and concurrency of its
+    host, with the host with the most estimated time first when these are
+    equal. Hosts that will take longest start first, but any window of the
+    ordered resources holds resources of every host with work at that time so
+    that a bounded read ahead is not filled by one host. The rate and
+    concurrency of each host are taken from host_timings where known with
+    rate and concurrency used for other hosts.
+
+    Args:
+        resources (List[Tuple]): Resources to order
+        phase (str): Phase eg. head or get
+        host_timings (Optional[HostTimings]): Durations from previous runs. Defaults to None.
+        get_key (Callable[[Tuple], str]): Function to get host of resource. Defaults to get_netloc.
+        rate (float): Requests per second allowed to a host if not known. Defaults to 4.
+        concurrency (int): Connections allowed to a host if not known. Defaults to 10.
+
+    Returns:
+        List[Tuple]: Ordered resources
+    """
+    hosts: Dict[str, List[Tuple]] = {}
+    for resource in resources:
+        hosts.setdefault(get_key(resource), []).append(resource)
+    heap = []
+    for index, (netloc, host_resources) in enumerate(hosts.items()):
+        duration = None
+        limits = {}
+        if host_timings:
+            duration = host_timings.get_duration(phase, netloc)
+            limits = host_timings.get_limits(phase, netloc)
+        host_rate = limits.get("rate", rate)
+        host_concurrency = limits.get("concurrency", concurrency)
+        time = estimate_host_time(
+            len(host_resources), duration, host_rate, host_concurrency
+        )
+        # Resources of a host start at most at its rate and, once its
+        # connections are in use, as requests finish
+        interval = max(1 / host_rate, (duration or 0) / host_concurrency)
+        # Heap is of start time, total time, position of host, interval
+        # between starts and position of resource
+        heap.append((0.0, -time, index, interval, netloc, 0))
+    heapq.heapify(heap)
+    ordered = []
+    while heap:
+        start, time, index, interval, netloc, position = heapq.heappop(heap)
+        host_resources = hosts[netloc]
+        ordered.append(host_resources[position])
+        position += 1
+        if position < len(host_resources):
+            heapq.heappush(
+                heap,
+                (
+                    start + interval,
+                    time,
+                    index,
+                    interval,
+                    netloc,
+                    position,
+                ),
+            )
+    return ordered
@@ -0,0 +1,135 @@
+"""Admission control for downloads that are buffered in memory."""
+
+import asyncio
+from collections import deque
+from os import sysconf
+from typing import Deque, Optional, Tuple
+
+CGROUP_LIMIT_FILES = (
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+)
+# cgroup v1 reports a huge number rather than max when there is no limit
+UNLIMITED = 1 << 60
+
+
+def read_cgroup_memory_limit() -> Optional[int]:
+    """Read container memory limit from cgroup v2 or v1
+
+    Returns:
+        Optional[int]: Memory limit in bytes or None if there is no limit
+    """
+    for path in CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as file:
+                value = file.read().strip()
+        except OSError:
+            continue
+        if value == "max":
+            return None
+        try:
+            limit = int(value)
+        except ValueError:
+            continue
+        if limit >= UNLIMITED:
+            return None
+        return limit
+    return None
+
+
+def get_default_memory_budget(fraction: float = 0.25) -> int:
+    """Get default budget for buffered downloads as a fraction of the
+    container memory limit or physical memory if there is no limit
+
+    Args:
+        fraction (float): Fraction of memory to use. Defaults to 0.25.
+
+    Returns:
+        int: Budget in bytes
+    """
+    limit = read_cgroup_memory_limit()
+    if limit is None:
+        limit = sysconf("SC_PAGE_SIZE") * sysconf("SC_PHYS_PAGES")
+    return int(limit * fraction)
+
+
+class MemoryBudget:
+    """Global budget for bytes of downloads buffered in memory. acquire waits
+    until enough of the budget is free, admitting waiters in order. A request
+    larger than the whole budget is admitted when nothing else is using the
+    budget so that it cannot wait forever.
+
+    Args:
+        budget (int): Budget in bytes
+    """
+
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+        self.in_use = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    def _fits(self, size: int) -> bool:
+        return self.in_use + size <= self.budget or self.in_use == 0
+
+    def _wake_waiters(self) -> None:
+        while self._waiters:
+            size, future = self._waiters[0]
+            if future.cancelled():
+                self._waiters.popleft()
+                continue
+            if not self._fits(size):
+                break
+            self._waiters.popleft()
+            self.in_use += size
+            future.set_result(None)
+
+    async def acquire(self, size: int) -> None:
+        """Reserve bytes from the budget, waiting until they are available
+
+        Args:
+            size (int): Number of bytes
+
+        Returns:
+            None
+        """
+        if not self._waiters and self._fits(size):
+            self.in_use += size
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((size, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Bytes were reserved just before cancellation
+                self.release(size)
+            else:
+                # Waiters behind this one may now fit
+                self._wake_waiters()
+            raise
+
+    def try_acquire(self, size: int) -> bool:
+        """Reserve bytes from the budget if they are available without waiting
+
+        Args:
+            size (int): Number of bytes
+
+        Returns:
+            bool: True if bytes were reserved
+        """
+        if self.in_use + size > self.budget:
+            return False
+        self.in_use += size
+        return True
+
+    def release(self, size: int) -> None:
+        """Return bytes to the budget
+
+        Args:
+            size (int): Number of bytes
+
+        Returns:
+            None
+        """
+        self.in_use -= size
+        self._wake_waiters()
@@ -0,0 +1,28 @@
+"""Utility to fingerprint large resources from their size and the bytes at
+their start and end so that changes can be detected without downloading the
+whole file."""
+
+import hashlib
+
+# Distinguishes fingerprints from md5 hashes of the whole file
+FINGERPRINT_PREFIX = "range:"
+
+
+def fingerprint_ranges(size: int, head: bytes, tail: bytes) -> str:
+    """Fingerprint a resource from its size and the bytes at its start and
+    end. Changes to the middle of a file that do not change its size are not
+    detected.
+
+    Args:
+        size (int): Size of resource
+        head (bytes): Bytes at start of resource
+        tail (bytes): Bytes at end of resource
+
+    Returns:
+        str: Fingerprint
+    """
+    md5hash = hashlib.md5()
+    md5hash.update(f"{size}:{len(head)}:{len(tail)}:".encode())
+    md5hash.update(head)
+    md5hash.update(tail)
+    return f"{FINGERPRINT_PREFIX}{md5hash.hexdigest()}"
@@ -1,14 +1,56 @@
 import logging
 from datetime import datetime
 from http import HTTPStatus
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 
+from .range_fingerprint import FINGERPRINT_PREFIX as RANGE_FINGERPRINT_PREFIX
 from .utilities import revise_resource, status_lookup
+from .zip_fingerprint import FINGERPRINT_PREFIX as ZIP_FINGERPRINT_PREFIX
 from hdx.utilities.dateparse import parse_date
 from hdx.utilities.typehint import ListTuple
 
 logger = logging.getLogger(__name__)
 
+# Prefixes of hashes that are fingerprints rather than md5s or ETags
+FINGERPRINT_PREFIXES = (ZIP_FINGERPRINT_PREFIX, RANGE_FINGERPRINT_PREFIX)
+
+
+def get_fingerprint_prefix(hash: Optional[str]) -> str:
+    """Get fingerprint prefix of hash or empty string if it is not a
+    fingerprint
+
+    Args:
+        hash (Optional[str]): Hash
+
+    Returns:
+        str: Fingerprint prefix or empty string
+    """
+    if hash:
+        for prefix in FINGERPRINT_PREFIXES:
+            if hash.startswith(prefix):
+                return prefix
+    return ""
+
+
+def is_new_baseline(hash: str, existing_hash: Optional[str]) -> bool:
+    """Check if a hash is of a different kind of fingerprint to the stored
+    hash eg. the first zip or range fingerprint of a resource with an md5 or
+    an md5 of a resource that has fallen below the range fingerprint
+    threshold. It cannot
+    be compared with the stored hash so is a new baseline rather than a
+    change.
+
+    Args:
+        hash (str): New hash
+        existing_hash (Optional[str]): Hash stored in HDX
+
+    Returns:
+        bool: True if new hash is a new baseline
+    """
+    if not existing_hash:
+        return False
+    return get_fingerprint_prefix(hash) != get_fingerprint_prefix(existing_hash)
+
 
 class Results:
     def __init__(
@@ -36,6 +78,9 @@ class Results:
             size, last_modified, hash, status = result
             status_str = status_lookup[status]
             log_status["Get Status"] = status_str
+            if status == HTTPStatus.NOT_MODIFIED:
+                # Server confirmed stored ETag or last modified is current
+                continue
             if status != 0 and status != HTTPStatus.OK:
                 if status < 0:
                     if status < -10:
@@ -66,7 +111,12 @@ class Results:
 
             if hash:
                 log_status[f"New {etag_str}"] = "Y"
-                if hash != resource[6]:
+                if is_new_baseline(hash, resource[6]):
+                    # Store fingerprint without treating it as a change
+                    resource_info["hash"] = hash
+                    update = True
+                    log_status[f"{etag_str} Changed"] = "N"
+                elif hash != resource[6]:
                     resource_info["hash"] = hash
                     hash_changed = True
                     update = True
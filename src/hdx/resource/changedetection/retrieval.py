@@ -1,26 +1,61 @@
 """Utility to download and hash resources. Uses asyncio."""
 
 import asyncio
-import hashlib
 import logging
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from http import HTTPStatus
 from timeit import default_timer as timer
-from typing import Dict, List, Optional, Set, Tuple
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 from urllib.parse import urlsplit
 
 import aiohttp
 from aiohttp import ClientResponseError
-from aiolimiter import AsyncLimiter
-from openpyxl import load_workbook
-from tenacity import (
-    retry,
-    retry_if_exception,
-    stop_after_attempt,
-)
-from tqdm.asyncio import tqdm_asyncio
+from multidict import CIMultiDictProxy
+from tqdm import tqdm
 
+from .circuit_breaker import (
+    CircuitBreaker,
+    is_connect_failure,
+    is_connection_failure,
+)
+from .content_encoding import (
+    COMPRESSED_FORMATS,
+    UnsupportedEncoding,
+    get_accept_encoding_for_format,
+    get_decoder,
+)
+from .host_limiter import HostLimiter, is_overload_exception, is_overload_status
+from .host_registry import HostRegistry
+from .memory_budget import MemoryBudget, get_default_memory_budget
+from .range_fingerprint import fingerprint_ranges
+from .retry_tracker import RetryTracker
+from .segmented_download import SegmentFile, get_segments, hash_file
+from .stream_hash import StreamHasher
 from .tenacity_custom_wait import custom_wait
-from .utilities import is_server_error
+from .throughput import SlowTransfer, enforce_throughput
+from .utilities import (
+    get_conditional_headers,
+    get_netloc,
+    parse_content_range,
+)
+from .worker_pool import WorkerLane, stream_results_by_key
+from .xlsx_hash import XlsxBuffer, XlsxHashPool
+from .zip_fingerprint import (
+    TAIL_SIZE,
+    InvalidZip,
+    find_central_directory,
+    fingerprint_central_directory,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -32,8 +67,43 @@ class Retrieval:
         user_agent (str): User agent string to use when downloading
         netlocs (Set[str]): Netlocs of resources to download
         xlsx_url_ignore (Optional[str]): Parts of url to ignore for special xlsx handling
+        xlsx_spool_threshold (int): Size above which xlsx downloads are written to disk. Defaults to 16777216.
+        spool_folder (Optional[str]): Folder for spooled xlsx downloads. Defaults to None (system temp).
+        xlsx_hash_workers (Optional[int]): Processes for hashing xlsx. Defaults to None (number of CPUs).
+        xlsx_hash_worker_tasks (int): Xlsx files hashed per process before it is replaced. Defaults to 20.
+        xlsx_hash_engine (str): Engine for hashing xlsx: xml or openpyxl. Defaults to "xml".
+        hash_threads (int): Threads for hashing downloads. Defaults to 4.
+        hash_block_size (int): Size of blocks hashed in threads. Defaults to 1048576.
+        read_bufsize (int): Size of read buffer for each download. Defaults to 262144.
+        zip_fingerprint_formats (Iterable[str]): Zip formats to fingerprint from central directory. Defaults to ().
+        range_fingerprint_threshold (Optional[int]): Size above which to fingerprint from start and end. Defaults to None (disabled).
+        range_fingerprint_window (int): Bytes from start and end to fingerprint. Defaults to 65536.
+        segmented_threshold (Optional[int]): Size above which to download in parallel byte ranges. Defaults to None (disabled).
+        segments (int): Number of byte ranges to download in parallel. Defaults to 4.
+        max_size (int): Size above which resources are not hashed. Defaults to 419430400.
+        large_file_threshold (Optional[int]): Size above which to use large file lane. Defaults to None (disabled).
+        large_file_concurrency (int): Large files downloaded at once, each with up to segments connections. Defaults to 2.
+        large_file_timeout (int): Total timeout in seconds for large files. Defaults to 3600.
+        large_file_max_size (int): Size above which large files are not hashed. Defaults to 2147483648.
+        memory_budget (Optional[int]): Bytes of downloads to buffer in memory at once. Defaults to None (quarter of container memory limit).
+        compressed_formats (Iterable[str]): Formats to request with compressed transfer. Defaults to COMPRESSED_FORMATS.
+        conditional_requests (bool): Send stored ETag and last modified so unchanged resources get 304. Defaults to True.
+        max_workers (int): Maximum resources downloaded at once. Defaults to 100.
+        host_registry (Optional[HostRegistry]): Registry of how hosts behaved in previous runs. Defaults to None.
+        host_limits (Optional[Dict]): Arguments for adaptive limiter of each host. Defaults to None (HostLimiter defaults).
+        retry_budget (Optional[Dict]): Arguments for retry budget of each host. Defaults to None (RetryBudget defaults).
+        circuit_breaker (Optional[Dict]): Arguments for circuit breaker of each host. Defaults to None (CircuitBreaker defaults).
+        min_throughput (Optional[int]): Bytes per second below which downloads are aborted. Defaults to None (no minimum).
+        throughput_grace_period (float): Seconds from start of download before enforcing minimum throughput. Defaults to 10.
+        throughput_window (float): Seconds over which throughput is measured. Defaults to 10.
+        sock_read_timeout (Optional[float]): Seconds to wait for data from server. Defaults to 60.
     """
 
+    # Resources read ahead per worker so that other hosts can be served while
+    # the hosts of the next resources are busy
+    buffered_per_worker = 100
+    # Granularity of reservations from the memory budget
+    memory_increment = 1048576
     ignore_mimetypes = ["application/octet-stream", "application/binary"]
     mimetypes = {
         "json": ["application/json"],
@@ -56,121 +126,660 @@ class Retrieval:
         user_agent: str,
         netlocs: Set[str],
         xlsx_url_ignore: Optional[str] = None,
+        xlsx_spool_threshold: int = 16777216,
+        spool_folder: Optional[str] = None,
+        xlsx_hash_workers: Optional[int] = None,
+        xlsx_hash_worker_tasks: int = 20,
+        xlsx_hash_engine: str = "xml",
+        hash_threads: int = 4,
+        hash_block_size: int = 1048576,
+        read_bufsize: int = 262144,
+        zip_fingerprint_formats: Iterable[str] = (),
+        range_fingerprint_threshold: Optional[int] = None,
+        range_fingerprint_window: int = 65536,
+        segmented_threshold: Optional[int] = None,
+        segments: int = 4,
+        max_size: int = 419430400,
+        large_file_threshold: Optional[int] = None,
+        large_file_concurrency: int = 2,
+        large_file_timeout: int = 60 * 60,
+        large_file_max_size: int = 2147483648,
+        memory_budget: Optional[int] = None,
+        compressed_formats: Iterable[str] = COMPRESSED_FORMATS,
+        conditional_requests: bool = True,
+        max_workers: int = 100,
+        host_registry: Optional[HostRegistry] = None,
+        host_limits: Optional[Dict] = None,
+        retry_budget: Optional[Dict] = None,
+        circuit_breaker: Optional[Dict] = None,
+        min_throughput: Optional[int] = None,
+        throughput_grace_period: float = 10,
+        throughput_window: float = 10,
+        sock_read_timeout: Optional[float] = 60,
     ) -> None:
         self._user_agent = user_agent
         self._xlsx_url_ignore: Optional[str] = xlsx_url_ignore
-        # Limit to 4 connections per second to a host
-        self._rate_limiters = {netloc: AsyncLimiter(4, 1) for netloc in netlocs}
-
-    @retry(
-        reraise=True,
-        retry=retry_if_exception(is_server_error),
-        stop=stop_after_attempt(3),
-        wait=custom_wait(multiplier=2, min=4),
-    )
+        self._xlsx_spool_threshold = xlsx_spool_threshold
+        self._spool_folder = spool_folder
+        self._xlsx_hash_workers = xlsx_hash_workers
+        self._xlsx_hash_worker_tasks = xlsx_hash_worker_tasks
+        self._xlsx_hash_engine = xlsx_hash_engine
+        self._xlsx_hash_pool: Optional[XlsxHashPool] = None
+        self._hash_threads = hash_threads
+        self._hash_block_size = hash_block_size
+        self._hash_executor: Optional[ThreadPoolExecutor] = None
+        self._read_bufsize = read_bufsize
+        self._zip_fingerprint_formats = set(zip_fingerprint_formats)
+        self._range_fingerprint_threshold = range_fingerprint_threshold
+        self._range_fingerprint_window = range_fingerprint_window
+        self._segmented_threshold = segmented_threshold
+        self._segments = segments
+        self._max_size = max_size
+        self._large_file_threshold = large_file_threshold
+        self._large_file_concurrency = large_file_concurrency
+        self._large_file_timeout = large_file_timeout
+        self._large_file_max_size = large_file_max_size
+        if memory_budget is None:
+            memory_budget = get_default_memory_budget()
+        self._memory_budget = MemoryBudget(memory_budget)
+        self._compressed_formats = set(compressed_formats)
+        self._conditional_requests = conditional_requests
+        self._max_workers = max_workers
+        self._host_registry = host_registry
+        # Transient failures are retried later from a queue so that they do
+        # not hold a slot while waiting
+        self._retry_tracker = RetryTracker(
+            custom_wait(multiplier=2, min=4, max=60), retry_budget=retry_budget
+        )
+        self._bytes_downloaded = 0
+        self._bytes_transferred = 0
+        # Rate and concurrency of requests to each host adapt to its responses
+        host_limits = host_limits or {}
+        self._host_limiters = {}
+        for netloc in netlocs:
+            limits = dict(host_limits)
+            if host_registry:
+                # Start from the limits reached in previous runs
+                limits.update(host_registry.get_limits("get", netloc))
+            self._host_limiters[netloc] = HostLimiter(**limits)
+        self._max_connections_per_host = HostLimiter(**host_limits).max_concurrency
+        # Remaining resources of a host that is down fail immediately
+        circuit_breaker = circuit_breaker or {}
+        self._circuit_breakers = {
+            netloc: CircuitBreaker(netloc, **circuit_breaker) for netloc in netlocs
+        }
+        # Downloads that trickle bytes are aborted to free their slots
+        self._min_throughput = min_throughput
+        self._throughput_grace_period = throughput_grace_period
+        self._throughput_window = throughput_window
+        self._sock_read_timeout = sock_read_timeout
+        # Headers of resources found to be too large for the small file lane
+        self._too_large_headers: Dict[str, CIMultiDictProxy] = {}
+
+    def is_expected_mimetype(self, resource_format: str, mimetype: str) -> bool:
+        """Check if mimetype is consistent with resource format
+
+        Args:
+            resource_format (str): Resource format
+            mimetype (str): Mimetype from Content-Type header
+
+        Returns:
+            bool: True if mimetype is expected or cannot be checked
+        """
+        if mimetype in self.ignore_mimetypes:
+            return True
+        expected_mimetypes = self.mimetypes.get(resource_format)
+        if expected_mimetypes is None:
+            return True
+        return any(x in mimetype for x in expected_mimetypes)
+
+    def is_xlsx(
+        self, url: str, resource_format: str, mimetype: str, signature: bytes
+    ) -> bool:
+        """Check if resource should be hashed as xlsx ie. by cell values
+
+        Args:
+            url (str): Resource url
+            resource_format (str): Resource format
+            mimetype (str): Mimetype from Content-Type header
+            signature (bytes): First 4 bytes of resource
+
+        Returns:
+            bool: True if resource should be hashed as xlsx
+        """
+        return (
+            resource_format == "xlsx"
+            and (
+                mimetype == self.mimetypes["xlsx"][0]
+                or mimetype in self.ignore_mimetypes
+            )
+            and signature == self.signatures["xlsx"][0]
+            and (self._xlsx_url_ignore not in url if self._xlsx_url_ignore else True)
+        )
+
+    def get_status(
+        self,
+        resource_format: str,
+        mimetype: str,
+        signature: bytes,
+        size: int,
+        http_size: Optional[int],
+    ) -> int:
+        """Get status of downloaded resource from checks of mimetype,
+        signature and size
+
+        Args:
+            resource_format (str): Resource format
+            mimetype (str): Mimetype from Content-Type header
+            signature (bytes): First 4 bytes of resource
+            size (int): Downloaded size
+            http_size (Optional[int]): Size from Content-Length header
+
+        Returns:
+            int: Status
+        """
+        if not self.is_expected_mimetype(resource_format, mimetype):
+            return -1
+        expected_signatures = self.signatures.get(resource_format)
+        if expected_signatures is not None:
+            if not any(signature[: len(x)] == x for x in expected_signatures):
+                return -2
+        if http_size and size != http_size:
+            return -3
+        return 0
+
+    async def get_range(
+        self,
+        url: str,
+        byte_range: str,
+        session: aiohttp.ClientSession,
+    ) -> Optional[Tuple[bytes, Tuple[int, int, int], CIMultiDictProxy]]:
+        """Download a byte range of a resource. Returns None if the server does
+        not honour the range request.
+
+        Args:
+            url (str): Resource to get
+            byte_range (str): Range eg. 0-99 or -100
+            session (aiohttp.ClientSession): session to use for requests
+
+        Returns:
+            Optional[Tuple[bytes, Tuple[int, int, int], CIMultiDictProxy]]: Data, content range and headers
+        """
+        headers = {"Range": f"bytes={byte_range}", "Accept-Encoding": "identity"}
+        async with session.get(url, allow_redirects=True, headers=headers) as response:
+            status = response.status
+            if status in (200, 416):
+                return None
+            if status != 206:
+                raise ClientResponseError(
+                    code=status,
+                    message=response.reason,
+                    request_info=response.request_info,
+                    history=response.history,
+                    headers=response.headers,
+                )
+            content_range = parse_content_range(response.headers.get("Content-Range"))
+            if content_range is None:
+                return None
+            data = await response.read()
+            self._bytes_downloaded += len(data)
+            self._bytes_transferred += len(data)
+            if len(data) != content_range[1] - content_range[0] + 1:
+                return None
+            return data, content_range, response.headers
+
+    async def fetch_zip_fingerprint(
+        self,
+        url: str,
+        resource_id: str,
+        resource_format: str,
+        session: aiohttp.ClientSession,
+    ) -> Optional[Tuple]:
+        """Fingerprint a zip file from its central directory using range
+        requests rather than downloading the whole file. Returns None if the
+        server does not honour range requests or the file is not a zip.
+
+        Args:
+            url (str): Resource to get
+            resource_id (str): Resource id
+            resource_format (str): Resource format
+            session (aiohttp.ClientSession): session to use for requests
+
+        Returns:
+            Optional[Tuple]: Resource information including fingerprint
+        """
+        result = await self.get_range(url, f"-{TAIL_SIZE}", session)
+        if result is None:
+            return None
+        tail, (tail_start, _, size), headers = result
+        last_modified = headers.get("Last-Modified")
+        etag = headers.get("Etag")
+        if etag:
+            return resource_id, size, last_modified, etag, 200
+        try:
+            start, cd_size, entries = find_central_directory(tail, tail_start)
+            if start >= tail_start:
+                offset = start - tail_start
+                central_directory = tail[offset : offset + cd_size]
+            else:
+                result = await self.get_range(
+                    url, f"{start}-{start + cd_size - 1}", session
+                )
+                if result is None:
+                    return None
+                central_directory = result[0]
+            fingerprint = fingerprint_central_directory(central_directory, entries)
+        except InvalidZip as ex:
+            logger.debug(f"Falling back to full download of {url}: {ex}")
+            return None
+        if not self.is_expected_mimetype(resource_format, headers.get("Content-Type")):
+            return resource_id, size, last_modified, fingerprint, -1
+        return resource_id, size, last_modified, fingerprint, -4
+
+    async def fetch_range_fingerprint(
+        self,
+        url: str,
+        resource_id: str,
+        resource_format: str,
+        session: aiohttp.ClientSession,
+    ) -> Optional[Tuple]:
+        """Fingerprint a resource from its size and the bytes at its start and
+        end using range requests. Returns None if the server does not honour
+        range requests.
+
+        Args:
+            url (str): Resource to get
+            resource_id (str): Resource id
+            resource_format (str): Resource format
+            session (aiohttp.ClientSession): session to use for requests
+
+        Returns:
+            Optional[Tuple]: Resource information including fingerprint
+        """
+        window = self._range_fingerprint_window
+        result = await self.get_range(url, f"0-{window - 1}", session)
+        if result is None:
+            return None
+        head, (_, _, size), headers = result
+        tail = b""
+        if size > window:
+            result = await self.get_range(
+                url, f"{max(size - window, window)}-{size - 1}", session
+            )
+            if result is None or result[1][2] != size:
+                return None
+            tail = result[0]
+        fingerprint = fingerprint_ranges(size, head, tail)
+        last_modified = headers.get("Last-Modified")
+        if not self.is_expected_mimetype(resource_format, headers.get("Content-Type")):
+            return resource_id, size, last_modified, fingerprint, -1
+        expected_signatures = self.signatures.get(resource_format)
+        if expected_signatures is not None:
+            if not any(head[: len(x)] == x for x in expected_signatures):
+                return resource_id, size, last_modified, fingerprint, -2
+        return resource_id, size, last_modified, fingerprint, -5
+
+    async def download_segment(
+        self,
+        url: str,
+        start: int,
+        end: int,
+        segment_file: SegmentFile,
+        session: aiohttp.ClientSession,
+    ) -> bool:
+        """Download a byte range of a resource into a segment file. Returns
+        False if the server does not honour the range request.
+
+        Args:
+            url (str): Resource to get
+            start (int): Start of range
+            end (int): End of range (inclusive)
+            segment_file (SegmentFile): File into which to write segment
+            session (aiohttp.ClientSession): session to use for requests
+
+        Returns:
+            bool: True if segment downloaded
+        """
+        headers = {"Range": f"bytes={start}-{end}", "Accept-Encoding": "identity"}
+        # Segments are requested with concurrency slots taken by
+        # fetch_segmented so only wait for the rate
+        await self._host_limiters[urlsplit(url).netloc].wait()
+        async with session.get(url, allow_redirects=True, headers=headers) as response:
+            status = response.status
+            if status in (200, 416):
+                return False
+            if status != 206:
+                raise ClientResponseError(
+                    code=status,
+                    message=response.reason,
+                    request_info=response.request_info,
+                    history=response.history,
+                    headers=response.headers,
+                )
+            content_range = parse_content_range(response.headers.get("Content-Range"))
+            if content_range is None or content_range[:2] != (start, end):
+                return False
+            offset = start
+            async for chunk in self.enforce_throughput(response.content.iter_any()):
+                segment_file.write(offset, chunk)
+                offset += len(chunk)
+            self._bytes_downloaded += offset - start
+            self._bytes_transferred += offset - start
+            return offset == end + 1
+
+    def get_segmented_size(self, headers: CIMultiDictProxy) -> Optional[int]:
+        """Get size of resource from headers of a GET response if it should
+        be downloaded as byte ranges in parallel
+
+        Args:
+            headers (CIMultiDictProxy): Headers from GET response
+
+        Returns:
+            Optional[int]: Size if resource is to be downloaded in byte ranges
+        """
+        if not self._segmented_threshold or headers.get("Content-Encoding"):
+            return None
+        if headers.get("Accept-Ranges", "").lower() != "bytes":
+            return None
+        content_length = headers.get("Content-Length")
+        if not content_length:
+            return None
+        http_size = int(content_length)
+        if http_size <= self._segmented_threshold:
+            return None
+        return http_size
+
+    async def fetch_segmented(
+        self,
+        url: str,
+        resource_id: str,
+        resource_format: str,
+        http_size: int,
+        headers: CIMultiDictProxy,
+        session: aiohttp.ClientSession,
+    ) -> Optional[Tuple]:
+        """Download a resource as byte ranges in parallel and hash it. Returns
+        None if the server does not honour range requests. The resource holds
+        one concurrency slot of the host limiter and a slot is taken for each
+        other segment. Fewer segments are used if there are not enough free
+        slots.
+
+        Args:
+            url (str): Resource to get
+            resource_id (str): Resource id
+            resource_format (str): Resource format
+            http_size (int): Size from Content-Length header
+            headers (CIMultiDictProxy): Headers from GET response
+            session (aiohttp.ClientSession): session to use for requests
+
+        Returns:
+            Optional[Tuple]: Resource information including hash
+        """
+        # openpyxl needs the extension to open xlsx files
+        suffix = ".xlsx" if resource_format == "xlsx" else None
+        limiter = self._host_limiters[urlsplit(url).netloc]
+        extra_slots = 0
+        while extra_slots < self._segments - 1 and limiter.try_acquire():
+            extra_slots += 1
+        segment_file = SegmentFile(http_size, self._spool_folder, suffix)
+        try:
+            tasks = [
+                asyncio.ensure_future(
+                    self.download_segment(url, start, end, segment_file, session)
+                )
+                for start, end in get_segments(http_size, extra_slots + 1)
+            ]
+            try:
+                downloaded = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            if not all(downloaded):
+                return None
+            mimetype = headers.get("Content-Type")
+            signature = segment_file.read(4)
+            if self.is_xlsx(url, resource_format, mimetype, signature):
+                hash = await self._xlsx_hash_pool.hash(segment_file.path)
+            else:
+                loop = asyncio.get_running_loop()
+                hash = await loop.run_in_executor(
+                    self._hash_executor,
+                    hash_file,
+                    segment_file.path,
+                    self._hash_block_size,
+                )
+        finally:
+            segment_file.close()
+            for _ in range(extra_slots):
+                await limiter.release()
+        status = self.get_status(
+            resource_format, mimetype, signature, http_size, http_size
+        )
+        last_modified = headers.get("Last-Modified")
+        return resource_id, http_size, last_modified, hash, status
+
     async def fetch(
         self,
         url: str,
         resource_id: str,
         resource_format: str,
         session: aiohttp.ClientSession,
+        ranges: bool = True,
+        max_size: Optional[int] = None,
+        conditional_headers: Optional[Dict[str, str]] = None,
+        known_headers: Optional[CIMultiDictProxy] = None,
     ) -> Tuple:
         """Asynchronous code to download a resource and hash it with rate
         limiting and exception handling. Returns a tuple with resource
-        information including hashes.
+        information including hashes. If headers of a GET request for the
+        resource are already known eg. from the small file lane, fingerprints
+        are not tried again and a segmented download starts without another
+        request for the headers.
 
         Args:
             url (str): Resource to get
             resource_id (str): Resource id
             resource_format (str): Resource format
             session (Union[aiohttp.ClientSession, RateLimiter]): session to use for requests
+            ranges (bool): Whether to use range requests where possible. Defaults to True.
+            max_size (Optional[int]): Size above which not to hash. Defaults to None (use max_size).
+            conditional_headers (Optional[Dict[str, str]]): If-None-Match and If-Modified-Since headers. Defaults to None.
+            known_headers (Optional[CIMultiDictProxy]): Headers of an earlier GET request for resource. Defaults to None.
 
         Returns:
             Tuple: Resource information including hash
         """
-        async with session.get(url, allow_redirects=True, chunked=True) as response:
+        if max_size is None:
+            max_size = self._max_size
+        if known_headers is not None:
+            # Fingerprints were tried with the earlier request
+            if ranges:
+                http_size = self.get_segmented_size(known_headers)
+                if http_size and http_size <= max_size:
+                    result = await self.fetch_segmented(
+                        url,
+                        resource_id,
+                        resource_format,
+                        http_size,
+                        known_headers,
+                        session,
+                    )
+                    if result is not None:
+                        return result
+            ranges = False
+        if ranges and resource_format in self._zip_fingerprint_formats:
+            result = await self.fetch_zip_fingerprint(
+                url, resource_id, resource_format, session
+            )
+            if result is not None:
+                return result
+        accept_encoding = get_accept_encoding_for_format(
+            resource_format, self._compressed_formats
+        )
+        # Bodies are decoded here rather than by aiohttp to count the bytes
+        # transferred as well as the decoded bytes that are hashed
+        headers = {"Accept-Encoding": accept_encoding}
+        if conditional_headers:
+            headers.update(conditional_headers)
+        async with session.get(
+            url,
+            allow_redirects=True,
+            chunked=True,
+            headers=headers,
+            auto_decompress=False,
+        ) as response:
             status = response.status
+            if status == HTTPStatus.NOT_MODIFIED:
+                # Unchanged since the stored ETag or last modified date
+                last_modified = response.headers.get("Last-Modified")
+                return resource_id, None, last_modified, None, status
             if status != 200:
                 exception = ClientResponseError(
                     code=status,
                     message=response.reason,
                     request_info=response.request_info,
                     history=response.history,
+                    headers=response.headers,
                 )
                 raise exception
             headers = response.headers
+            content_length = headers.get("Content-Length")
+            if content_length:
+                content_length = int(content_length)
             content_encoding = headers.get("Content-Encoding")
+            try:
+                decoder = get_decoder(content_encoding)
+            except UnsupportedEncoding as ex:
+                logger.warning(f"{ex} Hashing body as received from {url}")
+                decoder = None
             if content_encoding:
+                # Content-Length is the size of the encoded body
                 http_size = None
             else:
-                http_size = headers.get("Content-Length")
-                if http_size:
-                    http_size = int(http_size)
+                http_size = content_length
             last_modified = headers.get("Last-Modified")
             etag = headers.get("Etag")
             if etag:
                 return resource_id, http_size, last_modified, etag, 200
-            if http_size and int(http_size) > 419430400:
+            if (
+                ranges
+                and self._range_fingerprint_threshold
+                and http_size
+                and http_size > self._range_fingerprint_threshold
+            ):
+                # Close rather than holding the connection during range requests
+                response.close()
+                result = await self.fetch_range_fingerprint(
+                    url, resource_id, resource_format, session
+                )
+                if result is not None:
+                    return result
+                if http_size <= max_size:
+                    return await self.fetch(
+                        url,
+                        resource_id,
+                        resource_format,
+                        session,
+                        ranges=False,
+                        max_size=max_size,
+                        conditional_headers=conditional_headers,
+                    )
+            if content_length and content_length > max_size:
+                if self._large_file_threshold:
+                    # Kept so that the large file lane need not request them
+                    self._too_large_headers[resource_id] = headers
                 return resource_id, http_size, last_modified, None, -11
+            if ranges and self.get_segmented_size(headers):
+                response.close()
+                result = await self.fetch_segmented(
+                    url, resource_id, resource_format, http_size, headers, session
+                )
+                if result is not None:
+                    return result
+                return await self.fetch(
+                    url,
+                    resource_id,
+                    resource_format,
+                    session,
+                    ranges=False,
+                    max_size=max_size,
+                    conditional_headers=conditional_headers,
+                )
 
             mimetype = headers.get("Content-Type")
-            iterator = response.content.iter_any()
+            iterator = self.enforce_throughput(response.content.iter_any())
+            if decoder:
+                iterator = decoder.decode(iterator)
             first_chunk = await anext(iterator)
             size = len(first_chunk)
             signature = first_chunk[:4]
-            if (
-                resource_format == "xlsx"
-                and (
-                    mimetype == self.mimetypes["xlsx"][0]
-                    or mimetype in self.ignore_mimetypes
+            if self.is_xlsx(url, resource_format, mimetype, signature):
+                # Bytes buffered in memory are reserved from a global budget
+                reserved = min(
+                    http_size or self.memory_increment, self._xlsx_spool_threshold
                 )
-                and signature == self.signatures["xlsx"][0]
-                and (
-                    self._xlsx_url_ignore not in url if self._xlsx_url_ignore else True
+                await self._memory_budget.acquire(reserved)
+                # Large files are spooled to disk to limit memory use
+                xlsxbuffer = XlsxBuffer(
+                    self._xlsx_spool_threshold, self._spool_folder, http_size
                 )
-            ):
-                xlsxbuffer = bytearray(first_chunk)
-                async for chunk in iterator:
-                    size += len(chunk)
-                    xlsxbuffer.extend(chunk)
-                workbook = load_workbook(filename=BytesIO(xlsxbuffer), read_only=True)
-                md5hash = hashlib.md5()
-                for sheet_name in workbook.sheetnames:
-                    sheet = workbook[sheet_name]
-                    for cols in sheet.iter_rows(values_only=True):
-                        md5hash.update(bytes(str(cols), "utf-8"))
-                workbook.close()
-                xlsxbuffer = None
+                try:
+                    await xlsxbuffer.write_async(first_chunk, self._hash_executor)
+                    async for chunk in iterator:
+                        await xlsxbuffer.write_async(chunk, self._hash_executor)
+                        if xlsxbuffer.is_spooled():
+                            if reserved:
+                                self._memory_budget.release(reserved)
+                                reserved = 0
+                        elif xlsxbuffer.size > reserved:
+                            increment = max(
+                                xlsxbuffer.size - reserved, self.memory_increment
+                            )
+                            if self._memory_budget.try_acquire(increment):
+                                reserved += increment
+                            else:
+                                # Budget exhausted so use disk rather than wait
+                                await xlsxbuffer.spool_async(self._hash_executor)
+                                self._memory_budget.release(reserved)
+                                reserved = 0
+                    size = xlsxbuffer.size
+                    if not xlsxbuffer.is_spooled():
+                        # Buffer is pickled to send it to the hashing process
+                        # so the copy is reserved too or the buffer spooled
+                        if self._memory_budget.try_acquire(size):
+                            reserved += size
+                        else:
+                            await xlsxbuffer.spool_async(self._hash_executor)
+                            self._memory_budget.release(reserved)
+                            reserved = 0
+                    hash = await self._xlsx_hash_pool.hash(xlsxbuffer.get_source())
+                finally:
+                    xlsxbuffer.close()
+                    self._memory_budget.release(reserved)
             else:
-                md5hash = hashlib.md5(first_chunk)
+                md5hash = StreamHasher(self._hash_executor, self._hash_block_size)
+                await md5hash.update(first_chunk)
                 async for chunk in iterator:
                     size += len(chunk)
-                    md5hash.update(chunk)
-            hash = md5hash.hexdigest()
-            if mimetype not in self.ignore_mimetypes:
-                expected_mimetypes = self.mimetypes.get(resource_format)
-                if expected_mimetypes is not None:
-                    if not any(x in mimetype for x in expected_mimetypes):
-                        return (
-                            resource_id,
-                            size,
-                            last_modified,
-                            hash,
-                            -1,
-                        )
-            expected_signatures = self.signatures.get(resource_format)
-            if expected_signatures is not None:
-                if not any(signature[: len(x)] == x for x in expected_signatures):
-                    return resource_id, size, last_modified, hash, -2
-            if http_size and size != http_size:
-                return resource_id, size, last_modified, hash, -3
-
-            return resource_id, size, last_modified, hash, 0
+                    await md5hash.update(chunk)
+                hash = await md5hash.hexdigest()
+            # Size check is of bytes received against Content-Length
+            transferred = decoder.encoded_size if decoder else size
+            self._bytes_downloaded += size
+            self._bytes_transferred += transferred
+            status = self.get_status(
+                resource_format, mimetype, signature, transferred, content_length
+            )
+            return resource_id, size, last_modified, hash, status
 
     async def process(
         self,
         metadata: Tuple,
         session: aiohttp.ClientSession,
+        max_size: Optional[int] = None,
+        known_headers: Optional[CIMultiDictProxy] = None,
+        large_file: bool = False,
     ) -> Tuple:
         """Asynchronous code to download a resource and hash it. Returns a tuple with
         resource information including hashes.
@@ -178,6 +787,9 @@ class Retrieval:
         Args:
             metadata (Tuple): Resource to be checked
             session (Union[aiohttp.ClientSession, RateLimiter]): session to use for requests
+            max_size (Optional[int]): Size above which not to hash. Defaults to None (use max_size).
+            known_headers (Optional[CIMultiDictProxy]): Headers of an earlier GET request for resource. Defaults to None.
+            large_file (bool): Whether resource is in the large file lane. Defaults to False.
 
         Returns:
             Tuple: Resource information including hash
@@ -187,71 +799,301 @@ class Retrieval:
         resource_format = metadata[2]
 
         host = urlsplit(url).netloc
+        if self._conditional_requests:
+            conditional_headers = get_conditional_headers(metadata)
+        else:
+            conditional_headers = None
 
-        async with self._rate_limiters[host]:
+        circuit_breaker = self._circuit_breakers[host]
+        if not circuit_breaker.allow():
+            # Held back until the host is tried again or failed without
+            # waiting for a timeout if it is down
+            circuit_breaker.hold()
+            return resource_id, None, None, None, -12
+        limiter = self._host_limiters[host]
+        async with limiter:
+            if circuit_breaker.is_open():
+                # Circuit opened while waiting for the limiter
+                circuit_breaker.hold()
+                return resource_id, None, None, None, -12
+            start_time = timer()
             try:
-                return await self.fetch(url, resource_id, resource_format, session)
+                result = await self.fetch(
+                    url,
+                    resource_id,
+                    resource_format,
+                    session,
+                    max_size=max_size,
+                    conditional_headers=conditional_headers,
+                    known_headers=known_headers,
+                )
             except ClientResponseError as ex:
+                circuit_breaker.record_success()
+                if is_overload_status(ex.status):
+                    limiter.record_overload()
+                if self._host_registry:
+                    self._host_registry.record_error(
+                        "get", host, ex.status == HTTPStatus.TOO_MANY_REQUESTS
+                    )
+                self._retry_tracker.retry_later(resource_id, host, ex)
                 logger.error(f"{ex.status} {ex.message} {ex.request_info.url}")
                 return resource_id, None, None, None, ex.status
+            except SlowTransfer as ex:
+                # Not retried as it would hold a slot again
+                circuit_breaker.record_success()
+                if self._host_registry:
+                    self._host_registry.record_error("get", host)
+                logger.error(f"{ex} {url}")
+                return resource_id, None, None, None, -13
             except Exception as ex:
+                # Large files that time out after connecting do not count as
+                # the host may be healthy but slow for huge files
+                if is_connect_failure(ex) or (
+                    not large_file and is_connection_failure(ex)
+                ):
+                    circuit_breaker.record_failure()
+                else:
+                    circuit_breaker.record_success()
+                if is_overload_exception(ex):
+                    limiter.record_overload()
+                if self._host_registry:
+                    self._host_registry.record_error("get", host)
+                self._retry_tracker.retry_later(resource_id, host, ex)
                 logger.error(ex)
                 return resource_id, None, None, None, -101
+            finally:
+                if self._host_registry:
+                    self._host_registry.record("get", host, timer() - start_time)
+                    self._host_registry.record_limits(
+                        "get", host, limiter.rate, limiter.concurrency
+                    )
+            circuit_breaker.record_success()
+            self._retry_tracker.record_success(host)
+            limiter.record_success()
+            return result
+
+    def enforce_throughput(
+        self, iterator: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        """Wrap chunks of a download so that SlowTransfer is raised if its
+        throughput drops below the minimum after the grace period
+
+        Args:
+            iterator (AsyncIterator[bytes]): Chunks of download
+
+        Returns:
+            AsyncIterator[bytes]: Chunks of download
+        """
+        return enforce_throughput(
+            iterator,
+            self._min_throughput,
+            self._throughput_grace_period,
+            self._throughput_window,
+        )
+
+    def get_known_size(
+        self, metadata: Tuple, sizes: Optional[Dict[str, int]]
+    ) -> Optional[int]:
+        """Get size of resource known before downloading it, either from a HEAD
+        request or from HDX metadata
+
+        Args:
+            metadata (Tuple): Resource to be checked
+            sizes (Optional[Dict[str, int]]): Resource id to size from HEAD requests
+
+        Returns:
+            Optional[int]: Size if known
+        """
+        size = sizes.get(metadata[1]) if sizes else None
+        if not size and len(metadata) > 4:
+            size = metadata[4]
+        if not size:
+            return None
+        try:
+            return int(size)
+        except (TypeError, ValueError):
+            return None
+
+    async def stream(
+        self,
+        resources_to_get: Iterable[Tuple],
+        sizes: Optional[Dict[str, int]] = None,
+    ) -> AsyncIterator[Tuple]:
+        """Asynchronous code to download resources and hash them. Resources
+        are taken lazily from the iterable by a bounded pool of workers and
+        results are yielded as they complete.
+
+        Args:
+            resources_to_get (Iterable[Tuple]): Resources to get
+            sizes (Optional[Dict[str, int]]): Resource id to size from HEAD requests. Defaults to None.
+
+        Returns:
+            AsyncIterator[Tuple]: Resource information including hash
+        """
+        # Xlsx files are hashed in separate processes so as not to block
+        self._xlsx_hash_pool = XlsxHashPool(
+            self._xlsx_hash_workers,
+            self._xlsx_hash_worker_tasks,
+            self._xlsx_hash_engine,
+        )
+        # Other files are hashed in threads as hashlib releases the GIL
+        self._hash_executor = ThreadPoolExecutor(max_workers=self._hash_threads)
+        # Connections to a host are limited to the highest concurrency of its limiter
+        conn = aiohttp.TCPConnector(limit_per_host=self._max_connections_per_host)
+        # Can set some timeouts here if needed
+        timeout = aiohttp.ClientTimeout(
+            total=5 * 60, sock_connect=30, sock_read=self._sock_read_timeout
+        )
+        try:
+            async with AsyncExitStack() as stack:
+                session = await stack.enter_async_context(
+                    aiohttp.ClientSession(
+                        connector=conn,
+                        timeout=timeout,
+                        headers={"User-Agent": self._user_agent},
+                        read_bufsize=self._read_bufsize,
+                    )
+                )
+                large_file_lane = None
+                if self._large_file_threshold:
+                    # Large files have their own connections and timeouts so
+                    # that a few of them cannot hold up many small files. Each
+                    # may use a connection per segment
+                    large_file_session = await stack.enter_async_context(
+                        aiohttp.ClientSession(
+                            connector=aiohttp.TCPConnector(
+                                limit=self._large_file_concurrency * self._segments,
+                                limit_per_host=self._max_connections_per_host,
+                            ),
+                            timeout=aiohttp.ClientTimeout(
+                                total=self._large_file_timeout,
+                                sock_connect=30,
+                                sock_read=self._sock_read_timeout,
+                            ),
+                            headers={"User-Agent": self._user_agent},
+                            read_bufsize=self._read_bufsize,
+                        )
+                    )
+
+                    async def process_large_file(item: Tuple) -> Tuple:
+                        metadata, known_headers = item
+                        result = await self.process(
+                            metadata,
+                            large_file_session,
+                            self._large_file_max_size,
+                            known_headers,
+                            large_file=True,
+                        )
+                        self._too_large_headers.pop(metadata[1], None)
+                        return result
+
+                    # Large files wait in their own queue and workers so they
+                    # do not hold the workers of small files
+                    large_file_lane = await stack.enter_async_context(
+                        WorkerLane(process_large_file, self._large_file_concurrency)
+                    )
+
+                def get_small_files() -> Iterator[Tuple]:
+                    for metadata in resources_to_get:
+                        if large_file_lane:
+                            size = self.get_known_size(metadata, sizes)
+                            if size and size > self._large_file_threshold:
+                                large_file_lane.submit((metadata, None))
+                                continue
+                        yield metadata
 
-    async def check_urls(self, resources_to_get: List[Tuple]) -> Dict[str, Tuple]:
+                async def process_file(metadata: Tuple) -> Optional[Tuple]:
+                    if not large_file_lane:
+                        return await self.process(metadata, session)
+                    result = await self.process(
+                        metadata, session, self._large_file_threshold
+                    )
+                    if result[4] == -11:
+                        # Size was not known in advance so hand over with the
+                        # headers already received
+                        known_headers = self._too_large_headers.pop(metadata[1], None)
+                        large_file_lane.submit((metadata, known_headers))
+                        return None
+                    return result
+
+                # Resources wait in a queue per host rather than as coroutines
+                async for result in stream_results_by_key(
+                    get_small_files(),
+                    process_file,
+                    get_netloc,
+                    self._max_workers,
+                    self._max_connections_per_host,
+                    self._max_workers * self.buffered_per_worker,
+                ):
+                    if result is not None:
+                        yield result
+                    if large_file_lane:
+                        for result in large_file_lane.get_completed():
+                            yield result
+                if large_file_lane:
+                    async for result in large_file_lane.drain():
+                        yield result
+        finally:
+            self._xlsx_hash_pool.shutdown()
+            self._hash_executor.shutdown()
+
+    async def check_urls(
+        self, resources_to_get: List[Tuple], sizes: Optional[Dict[str, int]] = None
+    ) -> Dict[str, Tuple]:
         """Asynchronous code to download resources and hash them. Return dictionary with
         resources information including hashes.
 
         Args:
             resources_to_get (List[Tuple]): List of resources to get
+            sizes (Optional[Dict[str, int]]): Resource id to size from HEAD requests. Defaults to None.
 
         Returns:
             Dict[str, Tuple]: Resources information including hashes
         """
-        tasks = []
-
-        # Maximum of 10 simultaneous connections to a host
-        conn = aiohttp.TCPConnector(limit_per_host=10)
-        # Can set some timeouts here if needed
-        timeout = aiohttp.ClientTimeout(total=5 * 60, sock_connect=30)
-        async with aiohttp.ClientSession(
-            connector=conn,
-            timeout=timeout,
-            headers={"User-Agent": self._user_agent},
-        ) as session:
-            for metadata in resources_to_get:
-                task = self.process(metadata, session)
-                tasks.append(task)
-            responses = {}
-            for f in tqdm_asyncio.as_completed(tasks, total=len(tasks)):
-                (
-                    resource_id,
-                    http_size,
-                    http_last_modified,
-                    hash,
-                    status,
-                ) = await f
-
+        responses = {}
+        with tqdm(total=len(resources_to_get)) as progress:
+            async for (
+                resource_id,
+                http_size,
+                http_last_modified,
+                hash,
+                status,
+            ) in self.stream(resources_to_get, sizes):
                 responses[resource_id] = (
                     http_size,
                     http_last_modified,
                     hash,
                     status,
                 )
-            return responses
+                progress.update()
+        return responses
 
-    def retrieve(self, resources_to_get: List[Tuple]) -> Dict[str, Tuple]:
+    def retrieve(
+        self, resources_to_get: List[Tuple], sizes: Optional[Dict[str, int]] = None
+    ) -> Dict[str, Tuple]:
         """Download resources and hash them. Return dictionary with resources information
         including hashes.
 
         Args:
             resources_to_get (List[Tuple]): List of resources to get
+            sizes (Optional[Dict[str, int]]): Resource id to size from HEAD requests. Defaults to None.
 
         Returns:
             Dict[str, Tuple]: Resources information including hashes
         """
 
+        logger.info(
+            f"Memory budget for buffered downloads: {self._memory_budget.budget / 1048576:.0f} MB"
+        )
         start_time = timer()
-        results = asyncio.run(self.check_urls(resources_to_get))
-        logger.info(f"Execution time: {timer() - start_time} seconds")
+        results = asyncio.run(self.check_urls(resources_to_get, sizes))
+        execution_time = timer() - start_time
+        logger.info(f"Execution time: {execution_time} seconds")
+        megabytes = self._bytes_downloaded / 1048576
+        logger.info(
+            f"Downloaded and hashed {megabytes:.1f} MB at {megabytes / execution_time:.2f} MB/s"
+        )
+        logger.info(
+            f"Transferred {self._bytes_transferred / 1048576:.1f} MB with compression"
+        )
         return results
@@ -0,0 +1,164 @@
+"""Utility to decide whether failed requests are retried later and after
+what delay."""
+
+import logging
+from collections import deque
+from timeit import default_timer as timer
+from typing import Deque, Dict, Hashable, Optional
+
+from .tenacity_custom_wait import custom_wait
+from .utilities import is_server_error
+from .worker_pool import RetryLater
+
+logger = logging.getLogger(__name__)
+
+
+class RetryBudget:
+    """Limit on retries to a host so that they are at most a fraction of its
+    recent successful requests, plus a small allowance so that a few
+    failures can be retried before anything has succeeded. When a host has
+    an outage, failures beyond the budget are not retried rather than
+    multiplying the load on it.
+
+    Args:
+        ratio (float): Retries allowed per successful request. Defaults to 0.2.
+        min_retries (int): Retries allowed regardless of successes. Defaults to 10.
+        window (float): Seconds over which requests are counted. Defaults to 60.
+    """
+
+    def __init__(
+        self, ratio: float = 0.2, min_retries: int = 10, window: float = 60
+    ) -> None:
+        self._ratio = ratio
+        self._min_retries = min_retries
+        self._window = window
+        self._successes: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self._window
+        for times in (self._successes, self._retries):
+            while times and times[0] < cutoff:
+                times.popleft()
+
+    def record_success(self, now: Optional[float] = None) -> None:
+        """Record a successful request
+
+        Args:
+            now (Optional[float]): Current time. Defaults to None (timer()).
+
+        Returns:
+            None
+        """
+        if now is None:
+            now = timer()
+        self._expire(now)
+        self._successes.append(now)
+
+    def try_retry(self, now: Optional[float] = None) -> bool:
+        """Take a retry from the budget if there is one
+
+        Args:
+            now (Optional[float]): Current time. Defaults to None (timer()).
+
+        Returns:
+            bool: True if retry is allowed
+        """
+        if now is None:
+            now = timer()
+        self._expire(now)
+        allowed = self._min_retries + self._ratio * len(self._successes)
+        if len(self._retries) >= allowed:
+            return False
+        self._retries.append(now)
+        return True
+
+
+class RetryTracker:
+    """Tracks attempts of each resource so that transient failures can be
+    retried from a delayed queue rather than by sleeping while holding a
+    connection slot. Each retry is a fresh attempt through the host limiter
+    and must fit in the retry budget of the host.
+
+    Args:
+        wait (custom_wait): Wait strategy giving delay before each retry
+        max_attempts (int): Maximum attempts for a resource. Defaults to 3.
+        retry_budget (Optional[Dict]): Arguments for retry budget of each host. Defaults to None (RetryBudget defaults).
+    """
+
+    def __init__(
+        self,
+        wait: custom_wait,
+        max_attempts: int = 3,
+        retry_budget: Optional[Dict] = None,
+    ) -> None:
+        self._wait = wait
+        self._max_attempts = max_attempts
+        self._retry_budget = retry_budget or {}
+        self._budgets: Dict[str, RetryBudget] = {}
+        self._attempts: Dict[Hashable, int] = {}
+        self._waits: Dict[Hashable, float] = {}
+
+    def get_budget(self, host: str) -> RetryBudget:
+        """Get retry budget of a host
+
+        Args:
+            host (str): Host
+
+        Returns:
+            RetryBudget: Retry budget of host
+        """
+        budget = self._budgets.get(host)
+        if budget is None:
+            budget = self._budgets[host] = RetryBudget(**self._retry_budget)
+        return budget
+
+    def get_attempts(self, key: Hashable) -> int:
+        """Get number of attempts made for a resource including the current
+        one
+
+        Args:
+            key (Hashable): Key of resource eg. resource id
+
+        Returns:
+            int: Number of attempts
+        """
+        return self._attempts.get(key, 1)
+
+    def record_success(self, host: str) -> None:
+        """Record a successful request to a host which adds to its retry
+        budget
+
+        Args:
+            host (str): Host
+
+        Returns:
+            None
+        """
+        self.get_budget(host).record_success()
+
+    def retry_later(self, key: Hashable, host: str, exception: BaseException) -> None:
+        """Raise RetryLater with a delay if the exception is transient,
+        attempts remain and the host has retry budget. Otherwise return so
+        the failure can be handled.
+
+        Args:
+            key (Hashable): Key of resource eg. resource id
+            host (str): Host of resource
+            exception (BaseException): Exception raised by attempt
+
+        Returns:
+            None
+        """
+        attempt_number = self.get_attempts(key)
+        if attempt_number >= self._max_attempts or not is_server_error(exception):
+            return
+        if not self.get_budget(host).try_retry():
+            logger.debug(f"Retry budget of {host} exhausted")
+            return
+        delay = self._wait.get_wait(
+            exception, attempt_number, self._waits.get(key, 0.0)
+        )
+        self._attempts[key] = attempt_number + 1
+        self._waits[key] = delay
+        raise RetryLater(delay)
@@ -0,0 +1,100 @@
+"""Utilities to download a resource as byte ranges in parallel and hash the
+reassembled file."""
+
+import hashlib
+from os import pwrite, remove
+from tempfile import NamedTemporaryFile
+from typing import List, Optional, Tuple
+
+
+def get_segments(size: int, segments: int) -> List[Tuple[int, int]]:
+    """Split a resource into contiguous byte ranges of similar size
+
+    Args:
+        size (int): Size of resource
+        segments (int): Number of segments
+
+    Returns:
+        List[Tuple[int, int]]: Start and end (inclusive) of each segment
+    """
+    segment_size = -(-size // segments)
+    return [
+        (start, min(start + segment_size, size) - 1)
+        for start in range(0, size, segment_size)
+    ]
+
+
+def hash_file(path: str, block_size: int = 1048576) -> str:
+    """Hash a file
+
+    Args:
+        path (str): Path to file
+        block_size (int): Size of blocks to read. Defaults to 1048576.
+
+    Returns:
+        str: MD5 hex digest
+    """
+    md5hash = hashlib.md5()
+    # Read into one reusable buffer rather than allocating per block
+    view = memoryview(bytearray(block_size))
+    with open(path, "rb", buffering=0) as file:
+        while size := file.readinto(view):
+            md5hash.update(view[:size])
+    return md5hash.hexdigest()
+
+
+class SegmentFile:
+    """Temporary file into which segments are written at their offsets as
+    they arrive so that they are reassembled in order.
+
+    Args:
+        size (int): Size of resource
+        folder (Optional[str]): Folder for temporary file. Defaults to None (system temp).
+        suffix (Optional[str]): Suffix of temporary file. Defaults to None.
+    """
+
+    def __init__(
+        self, size: int, folder: Optional[str] = None, suffix: Optional[str] = None
+    ) -> None:
+        self._file = NamedTemporaryFile(dir=folder, suffix=suffix, delete=False)
+        self.path = self._file.name
+        self._file.truncate(size)
+        self._fd = self._file.fileno()
+
+    def write(self, offset: int, chunk: bytes) -> None:
+        """Write chunk at offset
+
+        Args:
+            offset (int): Offset in file
+            chunk (bytes): Chunk of data
+
+        Returns:
+            None
+        """
+        pwrite(self._fd, chunk, offset)
+
+    def read(self, size: int) -> bytes:
+        """Read from start of file
+
+        Args:
+            size (int): Number of bytes to read
+
+        Returns:
+            bytes: Data
+        """
+        self._file.seek(0)
+        return self._file.read(size)
+
+    def close(self) -> None:
+        """Close and delete the temporary file
+
+        Returns:
+            None
+        """
+        if self._file:
+            self._file.close()
+            self._file = None
+            try:
+                remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,94 @@
+"""Utility to hash a stream of downloaded chunks on a thread pool."""
+
+import asyncio
+import hashlib
+from concurrent.futures import Executor
+from typing import Optional
+
+
+class StreamHasher:
+    """MD5 hasher for a stream of chunks. Chunks are copied into one of two
+    preallocated blocks of block_size bytes which are hashed on the supplied
+    executor, so no memory is allocated per chunk. Chunks of at least a block
+    arriving on a block boundary are hashed without copying. hashlib releases
+    the GIL for large buffers so blocks from different downloads can be hashed
+    in parallel. Blocks from one stream are hashed in order and only one block
+    per stream is hashed at a time, so update waits if hashing falls behind
+    the download. Chunks must not be modified after they are passed to update.
+
+    Args:
+        executor (Executor): Thread pool on which to hash blocks
+        block_size (int): Size of blocks to hash. Defaults to 1048576.
+    """
+
+    # Below this size it is cheaper to hash in the event loop than a thread
+    min_offload_size = 65536
+
+    def __init__(self, executor: Executor, block_size: int = 1048576) -> None:
+        self._executor = executor
+        self._block_size = block_size
+        self._md5hash = hashlib.md5()
+        # One block is filled while the other is hashed
+        self._blocks = (
+            memoryview(bytearray(block_size)),
+            memoryview(bytearray(block_size)),
+        )
+        self._current = 0
+        self._filled = 0
+        self._pending: Optional[asyncio.Future] = None
+
+    async def _submit(self, block: memoryview) -> None:
+        if self._pending is not None:
+            await self._pending
+            self._pending = None
+        if len(block) < self.min_offload_size:
+            self._md5hash.update(block)
+            return
+        loop = asyncio.get_running_loop()
+        self._pending = loop.run_in_executor(
+            self._executor, self._md5hash.update, block
+        )
+
+    async def _submit_current(self) -> None:
+        block = self._blocks[self._current][: self._filled]
+        self._current = 1 - self._current
+        self._filled = 0
+        # Hashing of the other block finishes here before it is refilled
+        await self._submit(block)
+
+    async def update(self, chunk: bytes) -> None:
+        """Add chunk to the hash
+
+        Args:
+            chunk (bytes): Chunk of data
+
+        Returns:
+            None
+        """
+        view = memoryview(chunk)
+        while len(view):
+            if not self._filled and len(view) >= self._block_size:
+                end = len(view) - len(view) % self._block_size
+                await self._submit(view[:end])
+                view = view[end:]
+                continue
+            count = min(self._block_size - self._filled, len(view))
+            end = self._filled + count
+            self._blocks[self._current][self._filled : end] = view[:count]
+            self._filled = end
+            view = view[count:]
+            if self._filled == self._block_size:
+                await self._submit_current()
+
+    async def hexdigest(self) -> str:
+        """Finish hashing and return hex digest
+
+        Returns:
+            str: MD5 hex digest
+        """
+        if self._filled:
+            await self._submit_current()
+        if self._pending is not None:
+            await self._pending
+            self._pending = None
+        return self._md5hash.hexdigest()
@@ -1,5 +1,8 @@
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from http import HTTPStatus
-from typing import TYPE_CHECKING, Union
+from typing import TYPE_CHECKING, Optional, Union
 
 from aiohttp import ClientResponseError
 from tenacity import RetryCallState, _utils
@@ -9,6 +12,30 @@ if TYPE_CHECKING:
     from tenacity import RetryCallState
 
 
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header which is either a number of seconds or an
+    HTTP-date
+
+    Args:
+        value (Optional[str]): Retry-After header value
+
+    Returns:
+        Optional[float]: Seconds to wait or None if missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
 class custom_wait(wait_base):
     """Wait strategy that applies exponential backoff.
 
@@ -19,11 +46,15 @@ class custom_wait(wait_base):
     8) for certain multiply_codes corresponding to http error codes (defaults
     to 429 too many requests).
 
-    The intervals are fixed (i.e. there is no jitter), so this strategy is
-    suitable for balancing retries against latency when a required resource is
-    unavailable for an unknown duration, but *not* suitable for resolving
-    contention between multiple processes for a shared resource. Use
-    wait_random_exponential for the latter case.
+    If the server sends a Retry-After header with one of retry_after_codes
+    (defaults to 429 and 503), the wait is what it asks for up to
+    max_retry_after.
+
+    Otherwise if jitter is True (the default), the wait is decorrelated
+    jitter: random between the minimum and three times the previous wait (or
+    the multiplier for the first wait), up to the maximum. This stops
+    coroutines and instances that failed together from retrying in lockstep
+    against the same host. If jitter is False, the intervals are fixed.
     """
 
     def __init__(
@@ -34,6 +65,12 @@ class custom_wait(wait_base):
         min: _utils.time_unit_type = 0,  # noqa
         min_multiplier: int = 8,
         multiply_codes: tuple = (HTTPStatus.TOO_MANY_REQUESTS,),
+        retry_after_codes: tuple = (
+            HTTPStatus.TOO_MANY_REQUESTS,
+            HTTPStatus.SERVICE_UNAVAILABLE,
+        ),
+        max_retry_after: _utils.time_unit_type = 120,
+        jitter: bool = True,
     ) -> None:
         self.multiplier = multiplier
         self.min = _utils.to_seconds(min)
@@ -41,16 +78,57 @@ class custom_wait(wait_base):
         self.exp_base = exp_base
         self.min_multiplier = min_multiplier
         self.multiply_codes = multiply_codes
+        self.retry_after_codes = retry_after_codes
+        self.max_retry_after = _utils.to_seconds(max_retry_after)
+        self.jitter = jitter
 
-    def __call__(self, retry_state: "RetryCallState") -> float:
+    def get_wait(
+        self,
+        exception: Optional[BaseException],
+        attempt_number: int,
+        previous_wait: float = 0.0,
+    ) -> float:
+        """Get wait before next attempt. This allows the strategy to be used
+        for retries that are not made by tenacity eg. ones deferred to a queue.
+
+        Args:
+            exception (Optional[BaseException]): Exception raised by attempt
+            attempt_number (int): Number of attempt that failed
+            previous_wait (float): Previous wait. Defaults to 0.0.
+
+        Returns:
+            float: Wait in seconds
+        """
+        if (
+            isinstance(exception, ClientResponseError)
+            and exception.status in self.retry_after_codes
+        ):
+            headers = exception.headers or {}
+            retry_after = parse_retry_after(headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.max_retry_after)
+        minimum = self.min
+        # Multiply min wait for certain HTTP error codes
+        if (
+            isinstance(exception, ClientResponseError)
+            and exception.status in self.multiply_codes
+        ):
+            minimum *= self.min_multiplier
+        minimum = max(0, minimum)
+        if self.jitter:
+            previous = max(minimum, self.multiplier, previous_wait)
+            return min(random.uniform(minimum, previous * 3), self.max)
         try:
-            exp = self.exp_base ** (retry_state.attempt_number - 1)
+            exp = self.exp_base ** (attempt_number - 1)
             result = self.multiplier * exp
         except OverflowError:
             return self.max
-        minimum = self.min
-        ex = retry_state.outcome.exception()
-        # Multiply min wait for certain HTTP error codes
-        if isinstance(ex, ClientResponseError) and ex.status in self.multiply_codes:
-            minimum *= self.min_multiplier
-        return max(max(0, minimum), min(result, self.max))
+        return max(minimum, min(result, self.max))
+
+    def __call__(self, retry_state: "RetryCallState") -> float:
+        # upcoming_sleep still holds the previous wait
+        return self.get_wait(
+            retry_state.outcome.exception(),
+            retry_state.attempt_number,
+            retry_state.upcoming_sleep,
+        )
@@ -0,0 +1,102 @@
+"""Enforcement of a minimum throughput for downloads."""
+
+from collections import deque
+from timeit import default_timer as timer
+from typing import AsyncIterator, Deque, Optional, Tuple
+
+
+class SlowTransfer(Exception):
+    """Raised when the throughput of a download drops below the minimum
+
+    Args:
+        throughput (float): Bytes per second over the window
+    """
+
+    def __init__(self, throughput: float) -> None:
+        super().__init__(f"Throughput of {throughput:.0f} bytes per second too slow")
+        self.throughput = throughput
+
+
+class ThroughputMonitor:
+    """Rolling throughput of a download. After grace_period seconds from the
+    start, the bytes received in the last window seconds are compared with
+    min_throughput so that a server that trickles bytes does not hold a
+    connection until the total timeout.
+
+    Args:
+        min_throughput (float): Lowest bytes per second
+        grace_period (float): Seconds from start before enforcing. Defaults to 10.
+        window (float): Seconds over which throughput is measured. Defaults to 10.
+        now (Optional[float]): Start time. Defaults to None (timer()).
+    """
+
+    def __init__(
+        self,
+        min_throughput: float,
+        grace_period: float = 10,
+        window: float = 10,
+        now: Optional[float] = None,
+    ) -> None:
+        if now is None:
+            now = timer()
+        self._min_throughput = min_throughput
+        self._window = window
+        self._enforce_from = now + grace_period
+        self._total = 0
+        # Times and running totals of bytes received within the window
+        self._samples: Deque[Tuple[float, int]] = deque([(now, 0)])
+
+    def record(self, size: int, now: Optional[float] = None) -> None:
+        """Record bytes received and raise SlowTransfer if throughput is below
+        the minimum
+
+        Args:
+            size (int): Bytes received
+            now (Optional[float]): Current time. Defaults to None (timer()).
+
+        Returns:
+            None
+        """
+        if now is None:
+            now = timer()
+        self._total += size
+        self._samples.append((now, self._total))
+        start = now - self._window
+        # Keep the last sample before the window as its baseline
+        while len(self._samples) > 1 and self._samples[1][0] <= start:
+            self._samples.popleft()
+        if now < self._enforce_from:
+            return
+        baseline_time, baseline_total = self._samples[0]
+        elapsed = max(now - baseline_time, self._window)
+        throughput = (self._total - baseline_total) / elapsed
+        if throughput < self._min_throughput:
+            raise SlowTransfer(throughput)
+
+
+async def enforce_throughput(
+    iterator: AsyncIterator[bytes],
+    min_throughput: Optional[float],
+    grace_period: float = 10,
+    window: float = 10,
+) -> AsyncIterator[bytes]:
+    """Yield chunks from iterator raising SlowTransfer if throughput drops
+    below min_throughput
+
+    Args:
+        iterator (AsyncIterator[bytes]): Chunks of download
+        min_throughput (Optional[float]): Lowest bytes per second. None is no minimum.
+        grace_period (float): Seconds from start before enforcing. Defaults to 10.
+        window (float): Seconds over which throughput is measured. Defaults to 10.
+
+    Returns:
+        AsyncIterator[bytes]: Chunks of download
+    """
+    if not min_throughput:
+        async for chunk in iterator:
+            yield chunk
+        return
+    monitor = ThroughputMonitor(min_throughput, grace_period, window)
+    async for chunk in iterator:
+        monitor.record(len(chunk))
+        yield chunk
@@ -1,6 +1,10 @@
 import logging
+from datetime import timezone
+from email.utils import format_datetime
 from http import HTTPStatus
-from typing import Dict
+from statistics import quantiles
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 import aiohttp
 from prettytable import PrettyTable
@@ -16,7 +20,11 @@ status_lookup.update(
         -1: "MIMETYPE != HDX FORMAT",
         -2: "SIGNATURE != HDX FORMAT",
         -3: "SIZE != HTTP SIZE",
+        -4: "ZIP FINGERPRINT",
+        -5: "RANGE FINGERPRINT",
         -11: "TOO LARGE TO HASH",
+        -12: "HOST CIRCUIT OPEN",
+        -13: "TRANSFER TOO SLOW",
         -101: "UNSPECIFIED SERVER ERROR",
     }
 )
@@ -89,6 +97,86 @@ def is_server_error(ex: BaseException) -> bool:
     return False
 
 
+def get_netloc(metadata: Tuple) -> str:
+    """Get netloc of the url of a resource
+
+    Args:
+        metadata (Tuple): Resource whose first element is its url
+
+    Returns:
+        str: Netloc
+    """
+    return urlsplit(metadata[0]).netloc
+
+
+def get_percentile(values: List[float], percentile: int) -> Optional[float]:
+    """Get percentile of values
+
+    Args:
+        values (List[float]): Values
+        percentile (int): Percentile
+
+    Returns:
+        Optional[float]: Percentile or None if no values
+    """
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return quantiles(values, n=100, method="inclusive")[percentile - 1]
+
+
+def parse_content_range(content_range: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """Parse Content-Range header of the form bytes start-end/total
+
+    Args:
+        content_range (Optional[str]): Content-Range header
+
+    Returns:
+        Optional[Tuple[int, int, int]]: Start, end and total size or None if not parsable
+    """
+    if not content_range:
+        return None
+    unit, _, byte_range = content_range.strip().partition(" ")
+    if unit.lower() != "bytes":
+        return None
+    byte_range, _, total = byte_range.partition("/")
+    start, _, end = byte_range.partition("-")
+    try:
+        return int(start), int(end), int(total)
+    except ValueError:
+        return None
+
+
+def get_conditional_headers(metadata: Tuple) -> Dict[str, str]:
+    """Get headers for a conditional request from the hash and last modified
+    date stored in HDX so that the server can reply 304 Not Modified. The
+    stored hash is only sent as If-None-Match if it is an ETag rather than a
+    hash calculated by downloading. Nothing is sent if there is no stored hash
+    as there would be nothing to compare against.
+
+    Args:
+        metadata (Tuple): Resource to be checked
+
+    Returns:
+        Dict[str, str]: Conditional request headers
+    """
+    headers = {}
+    if len(metadata) < 7 or not metadata[6]:
+        return headers
+    hash = metadata[6]
+    if hash.startswith('"') or hash.startswith('W/"'):
+        headers["If-None-Match"] = hash
+    last_modified = metadata[5]
+    if last_modified:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        headers["If-Modified-Since"] = format_datetime(
+            last_modified.astimezone(timezone.utc), usegmt=True
+        )
+    return headers
+
+
 def revise_resource(
     datasets_to_revise: Dict,
     dataset_id: str,
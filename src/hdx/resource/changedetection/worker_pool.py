@@ -0,0 +1,345 @@
+"""Utility to process items with a bounded number of asyncio tasks."""
+
+import asyncio
+from collections import deque
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class RetryLater(Exception):
+    """Raised by a worker so that its item is processed again after a delay
+    instead of the worker sleeping. If until is given, the item is parked
+    with others raised with the same future and they are all processed again
+    once when it is done or, failing that, after the delay.
+
+    Args:
+        delay (float): Seconds to wait before item is processed again
+        until (Optional[asyncio.Future]): Future after which item is processed again. Defaults to None.
+    """
+
+    def __init__(self, delay: float, until: Optional[asyncio.Future] = None) -> None:
+        super().__init__(delay)
+        self.delay = delay
+        self.until = until
+
+
+class _WorkerError:
+    def __init__(self, exception: BaseException) -> None:
+        self.exception = exception
+
+
+class _Deferred:
+    def __init__(
+        self,
+        item,
+        delay: Optional[float] = None,
+        until: Optional[asyncio.Future] = None,
+    ) -> None:
+        self.item = item
+        self.delay = delay
+        self.until = until
+
+
+async def stream_results_by_key(
+    items: Iterable[T],
+    worker: Callable[[T], Awaitable[R]],
+    get_key: Callable[[T], Hashable],
+    max_workers: int,
+    max_workers_per_key: int,
+    max_buffered: Optional[int] = None,
+) -> AsyncIterator[R]:
+    """Process items with at most max_workers tasks at a time and at most
+    max_workers_per_key tasks for items with the same key eg. host, yielding
+    results in the order they complete. Items are pulled lazily from the
+    iterable into a queue per key, holding at most max_buffered items. Keys
+    are served in turn as tasks finish, so tasks exist only for items being
+    processed and a key with many items cannot hold up the others. If a
+    worker raises RetryLater, its item is queued again after the delay
+    without holding a task meanwhile. Items raised with the same future are
+    parked together and queued again at once when it is done, with a single
+    timer for the delay. If a task raises any other exception,
+    the other tasks are cancelled and the exception is raised.
+
+    Args:
+        items (Iterable[T]): Items to process
+        worker (Callable[[T], Awaitable[R]]): Coroutine function to process an item
+        get_key (Callable[[T], Hashable]): Function to get key of an item
+        max_workers (int): Maximum number of items processed at once
+        max_workers_per_key (int): Maximum number of items with the same key processed at once
+        max_buffered (Optional[int]): Maximum items waiting in queues. Defaults to None (max_workers).
+
+    Returns:
+        AsyncIterator[R]: Results
+    """
+    iterator = iter(items)
+    max_buffered = max_buffered or max_workers
+    queues: Dict[Hashable, Deque[T]] = {}
+    active: Dict[Hashable, int] = {}
+    # Keys with queued items in the order they are served
+    ready: Deque[Hashable] = deque()
+    buffered = 0
+    in_flight = 0
+    # Items waiting to be retried
+    deferred = 0
+    exhausted = False
+    results = asyncio.Queue()
+    tasks = set()
+    timers = []
+    # Items waiting for a future to be done
+    parked: Dict[asyncio.Future, List[Tuple[Hashable, T]]] = {}
+    loop = asyncio.get_running_loop()
+
+    async def run(key: Hashable, item: T) -> None:
+        try:
+            await results.put((key, await worker(item)))
+        except RetryLater as ex:
+            await results.put((key, _Deferred(item, ex.delay, ex.until)))
+        except Exception as ex:
+            await results.put((key, _WorkerError(ex)))
+
+    def enqueue(key: Hashable, item: T) -> None:
+        nonlocal buffered
+        queue = queues.get(key)
+        if queue is None:
+            queue = queues[key] = deque()
+            active.setdefault(key, 0)
+        if not queue:
+            ready.append(key)
+        queue.append(item)
+        buffered += 1
+
+    def release(until: asyncio.Future) -> None:
+        for key, item in parked.pop(until, ()):
+            results.put_nowait((key, _Deferred(item)))
+
+    def park(key: Hashable, deferred_item: _Deferred) -> None:
+        until = deferred_item.until
+        items = parked.get(until)
+        if items is None:
+            items = parked[until] = []
+            until.add_done_callback(release)
+            timers.append(loop.call_later(deferred_item.delay, release, until))
+        items.append((key, deferred_item.item))
+
+    def fill() -> None:
+        nonlocal exhausted
+        while not exhausted and buffered < max_buffered:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                exhausted = True
+                return
+            enqueue(get_key(item), item)
+
+    def dispatch() -> None:
+        nonlocal buffered, in_flight
+        fill()
+        started = True
+        while started and in_flight < max_workers:
+            started = False
+            for _ in range(len(ready)):
+                if in_flight >= max_workers:
+                    break
+                key = ready.popleft()
+                queue = queues[key]
+                if active[key] < max_workers_per_key:
+                    item = queue.popleft()
+                    buffered -= 1
+                    active[key] += 1
+                    in_flight += 1
+                    task = asyncio.create_task(run(key, item))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    started = True
+                if queue:
+                    ready.append(key)
+                else:
+                    del queues[key]
+            fill()
+
+    try:
+        dispatch()
+        while in_flight or deferred:
+            key, result = await results.get()
+            if isinstance(result, _Deferred) and result.delay is None:
+                # Delay has passed
+                deferred -= 1
+                enqueue(key, result.item)
+                dispatch()
+                continue
+            active[key] -= 1
+            in_flight -= 1
+            if isinstance(result, _WorkerError):
+                raise result.exception
+            if isinstance(result, _Deferred):
+                deferred += 1
+                if result.until is not None:
+                    park(key, result)
+                    dispatch()
+                    continue
+                timers.append(
+                    loop.call_later(
+                        result.delay,
+                        results.put_nowait,
+                        (key, _Deferred(result.item)),
+                    )
+                )
+                dispatch()
+                continue
+            dispatch()
+            yield result
+    finally:
+        for timer in timers:
+            timer.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def stream_results(
+    items: Iterable[T],
+    worker: Callable[[T], Awaitable[R]],
+    max_workers: int,
+) -> AsyncIterator[R]:
+    """Process items with at most max_workers tasks at a time, yielding
+    results in the order they complete. Items are pulled lazily from the
+    iterable as tasks finish. If a task raises an exception, the other tasks
+    are cancelled and the exception is raised.
+
+    Args:
+        items (Iterable[T]): Items to process
+        worker (Callable[[T], Awaitable[R]]): Coroutine function to process an item
+        max_workers (int): Maximum number of items processed at once
+
+    Returns:
+        AsyncIterator[R]: Results
+    """
+    async for result in stream_results_by_key(
+        items, worker, lambda _: None, max_workers, max_workers
+    ):
+        yield result
+
+
+class WorkerLane:
+    """Separate pool of at most max_workers tasks for items submitted while
+    other items are being processed eg. large files found by the workers of
+    stream_results_by_key. Items waiting for the lane are held in its queue
+    so they do not hold a task of another pool. If a worker raises
+    RetryLater, its item is queued again after the delay or when its future
+    is done if sooner. If it raises any
+    other exception, the exception is raised by get_completed or drain.
+    Use as an async context manager so that tasks are cancelled on exit.
+
+    Args:
+        worker (Callable[[T], Awaitable[R]]): Coroutine function to process an item
+        max_workers (int): Maximum number of items processed at once
+    """
+
+    def __init__(self, worker: Callable[[T], Awaitable[R]], max_workers: int) -> None:
+        self._worker = worker
+        self._max_workers = max_workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._results: Deque[R] = deque()
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self._pending = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._timers: List[asyncio.TimerHandle] = []
+
+    async def __aenter__(self) -> "WorkerLane":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        for timer in self._timers:
+            timer.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            try:
+                result = await self._worker(item)
+            except RetryLater as ex:
+                self._retry(loop, item, ex)
+                continue
+            except Exception as ex:
+                self._error = ex
+                self._changed.set()
+                return
+            self._pending -= 1
+            self._results.append(result)
+            self._changed.set()
+
+    def _retry(self, loop: asyncio.AbstractEventLoop, item: T, ex: RetryLater) -> None:
+        queued = False
+
+        def queue(*args) -> None:
+            nonlocal queued
+            if not queued:
+                queued = True
+                self._queue.put_nowait(item)
+
+        if ex.until is not None:
+            ex.until.add_done_callback(queue)
+        self._timers.append(loop.call_later(ex.delay, queue))
+
+    def submit(self, item: T) -> None:
+        """Queue item to be processed by the lane
+
+        Args:
+            item (T): Item to process
+
+        Returns:
+            None
+        """
+        self._pending += 1
+        self._queue.put_nowait(item)
+        if len(self._tasks) < self._max_workers:
+            task = asyncio.create_task(self._run())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def get_completed(self) -> List[R]:
+        """Get results completed so far without waiting
+
+        Returns:
+            List[R]: Results
+        """
+        if self._error is not None:
+            raise self._error
+        results = list(self._results)
+        self._results.clear()
+        return results
+
+    async def drain(self) -> AsyncIterator[R]:
+        """Wait for all submitted items, yielding results in the order they
+        complete
+
+        Returns:
+            AsyncIterator[R]: Results
+        """
+        while True:
+            for result in self.get_completed():
+                yield result
+            if not self._pending:
+                return
+            self._changed.clear()
+            await self._changed.wait()
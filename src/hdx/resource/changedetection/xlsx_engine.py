@@ -0,0 +1,568 @@
+"""Engine that hashes XLSX cell values by parsing the sheet XML directly.
+
+It produces the same hash as hashing str() of each row tuple returned by
+openpyxl's read only iter_rows(values_only=True) without creating cell
+objects. Workbook level metadata (sheet order, date epoch and date styles) is
+read with openpyxl's own readers so that it is interpreted identically.
+"""
+
+import hashlib
+import re
+from typing import IO, Dict, Iterator, List, Optional, Set, Tuple, Union
+from xml.etree.ElementTree import ParseError, fromstring, iterparse
+from zipfile import ZipFile
+
+from openpyxl.formula.translate import Translator
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.utils.cell import column_index_from_string, range_boundaries
+from openpyxl.utils.datetime import from_excel, from_ISO8601
+from openpyxl.xml.constants import SHARED_STRINGS, SHEET_MAIN_NS
+
+VALUE_TAG = f"{{{SHEET_MAIN_NS}}}v"
+FORMULA_TAG = f"{{{SHEET_MAIN_NS}}}f"
+INLINE_STRING = f"{{{SHEET_MAIN_NS}}}is"
+ROW_TAG = f"{{{SHEET_MAIN_NS}}}row"
+STRING_TAG = f"{{{SHEET_MAIN_NS}}}si"
+DATA_TAG = f"{{{SHEET_MAIN_NS}}}sheetData"
+DIMENSION_TAG = f"{{{SHEET_MAIN_NS}}}dimension"
+
+DIGITS = frozenset("0123456789")
+
+# Regular expressions for parsing rows in the form written by most applications
+FAST_BLOCK_SIZE = 4194304
+MAIN_NS_DECLARATION = f'xmlns="{SHEET_MAIN_NS}"'.encode()
+DECLARATION_RE = re.compile(
+    rb"""(?:\xef\xbb\xbf)?<\?xml[^>]*?encoding\s*=\s*["']([^"']*)"""
+)
+ROOT_RE = re.compile(rb"<([\w.-]+:)?worksheet\b([^>]*)>")
+DIMENSION_RE = re.compile(rb'<dimension\b(?:[^>]*?\sref\s*=\s*"([^"]*)")?')
+SHEETDATA_RE = re.compile(rb"<sheetData\b[^>]*?(/?)>")
+ATTRIBUTES = rb'((?:\s+[\w:.-]+\s*=\s*"[^"]*")*)\s*'
+ROW_RE = re.compile(rb"<row" + ATTRIBUTES + rb"(?:/>|>(.*?)</row>)", re.DOTALL)
+CELL_RE = re.compile(
+    rb"<c"
+    + ATTRIBUTES
+    + rb"(?:/>|>\s*(?:<v\s*/>|<v>([^<]*)</v>|(<is>\s*(?:<t"
+    + rb'(?:\s+xml:space="preserve")?\s*(?:/>|>([^<]*)</t>)\s*)?</is>))?\s*</c>)'
+)
+SIMPLE_CELL_RE = re.compile(
+    rb'<c r="([A-Z]+)[0-9]+"(?: s="([0-9]+)")?(?: t="([A-Za-z]+)")?'
+    rb"(?:/>|>(?:<v>([^<]*)</v>|(<is><t>([^<]*)</t></is>))?</c>)"
+)
+ROW_NUMBER_RE = re.compile(rb'\s+r="([0-9]+)"')
+ATTRIBUTE_RE = re.compile(rb'([\w:.-]+)\s*=\s*"([^"]*)"')
+# Rows with these need the full XML parser
+SLOW_ROW_STRINGS = (b"&", b"\r", b"<!", b"<?", b"<f", b"xmlns")
+PREFIXED_TAG_RE = re.compile(rb"<[\w.-]+:")
+COORDINATE_RE = re.compile(rb"([A-Z]+)[0-9]+")
+WHITESPACE_RE = re.compile(rb"\s*")
+
+
+class UnsupportedWorkbook(Exception):
+    """Raised when a workbook has features that the engine does not handle"""
+
+
+class FastPathUnavailable(Exception):
+    """Raised when a sheet must be parsed with ElementTree"""
+
+
+def _localname(element) -> str:
+    return element.tag.rpartition("}")[2]
+
+
+def _text_content(node) -> str:
+    """Equivalent of openpyxl's Text.from_tree(node).content"""
+    plain = None
+    runs = []
+    for child in node:
+        tag = _localname(child)
+        if tag == "t":
+            plain = child.text
+        elif tag == "r":
+            text = None
+            for grandchild in child:
+                if _localname(grandchild) == "t":
+                    text = grandchild.text
+            if text is not None:
+                runs.append(text)
+    if plain is not None:
+        runs.insert(0, plain)
+    return "".join(runs)
+
+
+def read_shared_strings(src: IO) -> List[str]:
+    """Read shared strings table as plain text
+
+    Args:
+        src (IO): sharedStrings.xml file object
+
+    Returns:
+        List[str]: Shared strings
+    """
+    strings = []
+    for _, node in iterparse(src):
+        if node.tag == STRING_TAG:
+            strings.append(_text_content(node).replace("x005F_", ""))
+            node.clear()
+    return strings
+
+
+def _cast_number(value: str) -> Union[int, float]:
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def _coordinate_to_tuple(coordinate: str) -> Tuple[int, int]:
+    for idx, c in enumerate(coordinate):
+        if c in DIGITS:
+            break
+    return int(coordinate[idx:]), column_index_from_string(coordinate[:idx])
+
+
+def _find_slow(buffer: bytes, pos: int) -> int:
+    """Position of the first construct that needs ElementTree"""
+    end = len(buffer)
+    for string in SLOW_ROW_STRINGS:
+        found = buffer.find(string, pos)
+        if found != -1 and found < end:
+            end = found
+    match = PREFIXED_TAG_RE.search(buffer, pos, end)
+    return match.start() if match else end
+
+
+class SheetParser:
+    """Parse rows of cell values from a worksheet
+
+    Args:
+        shared_strings (List[str]): Shared strings of workbook
+        epoch (datetime): Date epoch of workbook
+        date_formats (Set[int]): Style ids that are dates
+        timedelta_formats (Set[int]): Style ids that are time deltas
+    """
+
+    def __init__(
+        self,
+        shared_strings: List[str],
+        epoch,
+        date_formats: Set[int],
+        timedelta_formats: Set[int],
+    ) -> None:
+        self._shared_strings = shared_strings
+        self._epoch = epoch
+        self._date_formats = date_formats
+        self._timedelta_formats = timedelta_formats
+        self._shared_formulae: Dict[str, Translator] = {}
+        self._columns: Dict[bytes, int] = {}
+        self._root_tag = b""
+        self.dimensions = None
+
+    def _parse_formula(self, formula, coordinate: Optional[str]) -> str:
+        formula_type = formula.get("t")
+        value = "="
+        if formula.text is not None:
+            value += formula.text
+        if formula_type == "shared":
+            if not coordinate:
+                raise UnsupportedWorkbook("Shared formula without coordinate!")
+            idx = formula.get("si")
+            if idx in self._shared_formulae:
+                value = self._shared_formulae[idx].translate_formula(coordinate)
+            elif value != "=":
+                self._shared_formulae[idx] = Translator(value, coordinate)
+        elif formula_type in ("array", "dataTable"):
+            # openpyxl returns objects whose str() is not stable
+            raise UnsupportedWorkbook(f"{formula_type} formula!")
+        return value
+
+    def _convert_value(self, value: str, data_type: str, style_id):
+        if data_type == "n":
+            value = _cast_number(value)
+            if style_id:
+                style_id = int(style_id)
+            if style_id in self._date_formats:
+                try:
+                    return from_excel(
+                        value,
+                        self._epoch,
+                        timedelta=style_id in self._timedelta_formats,
+                    )
+                except (OverflowError, ValueError):
+                    return "#VALUE!"
+            return value
+        if data_type == "s":
+            return self._shared_strings[int(value)]
+        if data_type == "b":
+            return bool(int(value))
+        if data_type == "d":
+            return from_ISO8601(value)
+        return value
+
+    def _parse_value(self, element, data_type: str, coordinate: Optional[str]):
+        formula = element.find(FORMULA_TAG)
+        if formula is not None:
+            return self._parse_formula(formula, coordinate)
+        if data_type == "inlineStr":
+            child = element.find(INLINE_STRING)
+            if child is None:
+                return None
+            return _text_content(child)
+        value = element.findtext(VALUE_TAG, None) or None
+        if value is None:
+            return None
+        return self._convert_value(value, data_type, element.get("s", 0))
+
+    @staticmethod
+    def _get_row_number(row: Optional[str], row_counter: int) -> int:
+        if row is None:
+            return row_counter + 1
+        try:
+            return int(row)
+        except ValueError:
+            value = float(row)
+            if not value.is_integer():
+                raise ValueError(f"{row} is not a valid row number")
+            return int(value)
+
+    def _parse_row(self, element, row_counter: int) -> Tuple[int, List[Tuple]]:
+        row_counter = self._get_row_number(element.get("r"), row_counter)
+        col_counter = 0
+        cells = []
+        for cell in element:
+            data_type = cell.get("t", "n")
+            coordinate = cell.get("r")
+            if coordinate:
+                _, col_counter = _coordinate_to_tuple(coordinate)
+            else:
+                col_counter += 1
+            cells.append((col_counter, self._parse_value(cell, data_type, coordinate)))
+        return row_counter, cells
+
+    def parse(self, src: IO) -> Iterator[Tuple[int, List[Tuple]]]:
+        """Parse rows from worksheet. Each row is returned as a tuple of row
+        number and list of (column number, value) tuples. The dimensions
+        attribute is set before the first row is returned.
+
+        Args:
+            src (IO): Worksheet file object
+
+        Returns:
+            Iterator[Tuple[int, List[Tuple]]]: Rows
+        """
+        row_counter = 0
+        dimensions_done = False
+        for _, element in iterparse(src):
+            tag = element.tag
+            if tag == ROW_TAG:
+                dimensions_done = True
+                row_counter, cells = self._parse_row(element, row_counter)
+                element.clear()
+                yield row_counter, cells
+            elif dimensions_done:
+                continue
+            elif tag == DIMENSION_TAG:
+                self.dimensions = range_boundaries(element.get("ref"))
+                dimensions_done = True
+            elif tag == DATA_TAG:
+                dimensions_done = True
+
+    def _parse_header(self, header: bytes) -> None:
+        match = DECLARATION_RE.match(header)
+        if match and match.group(1).lower() not in (b"utf-8", b"utf8"):
+            raise FastPathUnavailable("Not UTF-8!")
+        if header.startswith((b"\xff\xfe", b"\xfe\xff")) or b"\x00" in header:
+            raise FastPathUnavailable("Not UTF-8!")
+        if b"<!" in header or b"&" in header or b":dimension" in header:
+            raise FastPathUnavailable("Complex header!")
+        match = ROOT_RE.search(header)
+        if not match or match.group(1) or MAIN_NS_DECLARATION not in match.group(2):
+            raise FastPathUnavailable("Main namespace is not default!")
+        self._root_tag = match.group(0)
+        match = DIMENSION_RE.search(header)
+        if match:
+            if match.group(1) is None:
+                raise FastPathUnavailable("Complex dimension!")
+            self.dimensions = range_boundaries(match.group(1).decode())
+
+    def _parse_row_fragment(
+        self, fragment: bytes, row_counter: int
+    ) -> Tuple[int, List[Tuple]]:
+        try:
+            root = fromstring(self._root_tag + fragment + b"</worksheet>")
+        except ParseError:
+            raise FastPathUnavailable("Cannot parse row!")
+        return self._parse_row(root[0], row_counter)
+
+    def _get_column(self, coordinate: bytes) -> int:
+        column = self._columns.get(coordinate)
+        if column is not None:
+            return column
+        match = COORDINATE_RE.fullmatch(coordinate)
+        if match:
+            letters = match.group(1)
+            column = self._columns.get(letters)
+            if column is None:
+                column = column_index_from_string(letters.decode())
+                self._columns[letters] = column
+            return column
+        return _coordinate_to_tuple(coordinate.decode())[1]
+
+    def _parse_cells(self, body: bytes) -> Optional[List[Tuple]]:
+        cells = []
+        col_counter = 0
+        pos = 0
+        end = len(body)
+        while True:
+            pos = WHITESPACE_RE.match(body, pos).end()
+            if pos == end:
+                return cells
+            cell = CELL_RE.match(body, pos)
+            if cell is None:
+                # eg. cell containing elements other than a value
+                return None
+            pos = cell.end()
+            attributes = dict(ATTRIBUTE_RE.findall(cell.group(1)))
+            coordinate = attributes.get(b"r")
+            if coordinate:
+                col_counter = self._get_column(coordinate)
+            else:
+                col_counter += 1
+            value = cell.group(2)
+            data_type = attributes.get(b"t")
+            data_type = "n" if data_type is None else data_type.decode()
+            if data_type == "inlineStr":
+                if cell.group(3) is None:
+                    value = None
+                else:
+                    value = (cell.group(4) or b"").decode()
+            elif value:
+                value = self._convert_value(
+                    value.decode(), data_type, attributes.get(b"s", 0)
+                )
+            else:
+                value = None
+            cells.append((col_counter, value))
+
+    def _parse_simple_cells(self, body: bytes) -> Optional[List[Tuple]]:
+        # Cells with attributes in the usual order and no whitespace
+        cells = []
+        columns = self._columns
+        convert_value = self._convert_value
+        date_formats = self._date_formats
+        shared_strings = self._shared_strings
+        pos = 0
+        for cell in SIMPLE_CELL_RE.finditer(body):
+            start = cell.start()
+            if start != pos and not body[pos:start].isspace():
+                return self._parse_cells(body)
+            pos = cell.end()
+            letters, style_id, data_type, value, inline, text = cell.groups()
+            column = columns.get(letters)
+            if column is None:
+                column = column_index_from_string(letters.decode())
+                columns[letters] = column
+            if data_type == b"inlineStr":
+                value = None if inline is None else text.decode()
+            elif not value:
+                value = None
+            elif data_type is None or data_type == b"n":
+                if style_id is None or int(style_id) not in date_formats:
+                    value = _cast_number(value.decode())
+                else:
+                    value = convert_value(value.decode(), "n", style_id)
+            elif data_type == b"s":
+                value = shared_strings[int(value)]
+            else:
+                value = convert_value(value.decode(), data_type.decode(), style_id)
+            cells.append((column, value))
+        if pos != len(body) and not body[pos:].isspace():
+            return self._parse_cells(body)
+        return cells
+
+    def _parse_row_fast(self, match, row_counter: int) -> Tuple[int, List[Tuple]]:
+        attributes = match.group(1)
+        row = ROW_NUMBER_RE.match(attributes)
+        if row:
+            row_number = int(row.group(1))
+        else:
+            row = dict(ATTRIBUTE_RE.findall(attributes)).get(b"r")
+            row_number = self._get_row_number(
+                None if row is None else row.decode(), row_counter
+            )
+        body = match.group(2)
+        if not body:
+            return row_number, []
+        cells = self._parse_simple_cells(body)
+        if cells is None:
+            return self._parse_row_fragment(match.group(0), row_counter)
+        return row_number, cells
+
+    def parse_fast(self, src: IO) -> Iterator[Tuple[int, List[Tuple]]]:
+        """Parse rows from worksheet by matching the raw XML of each row.
+        Rows that are not in the simple form written by most applications
+        are parsed with ElementTree. Raises FastPathUnavailable if the sheet
+        cannot be parsed this way in which case parse must be used instead.
+        The output is the same as that of parse.
+
+        Args:
+            src (IO): Worksheet file object
+
+        Returns:
+            Iterator[Tuple[int, List[Tuple]]]: Rows
+        """
+        buffer = b""
+        while True:
+            block = src.read(FAST_BLOCK_SIZE)
+            if not block:
+                raise FastPathUnavailable("No sheetData!")
+            buffer += block
+            match = SHEETDATA_RE.search(buffer)
+            if match:
+                break
+        self._parse_header(buffer[: match.start()])
+        if match.group(1):
+            return
+        buffer = buffer[match.end() :]
+        row_counter = 0
+        eof = False
+        while True:
+            pos = 0
+            slow = _find_slow(buffer, 0)
+            while True:
+                pos = WHITESPACE_RE.match(buffer, pos).end()
+                match = ROW_RE.match(buffer, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                if slow < pos:
+                    row_counter, cells = self._parse_row_fragment(
+                        match.group(0), row_counter
+                    )
+                    slow = _find_slow(buffer, pos)
+                else:
+                    row_counter, cells = self._parse_row_fast(match, row_counter)
+                yield row_counter, cells
+            buffer = buffer[pos:]
+            if buffer.startswith(b"</sheetData>"):
+                return
+            if eof or (len(buffer) >= 5 and not buffer.startswith(b"<row")):
+                raise FastPathUnavailable("Unexpected content in sheetData!")
+            block = src.read(FAST_BLOCK_SIZE)
+            if not block:
+                eof = True
+            buffer += block
+
+
+def _get_row(cells: List[Tuple], max_col: Optional[int]) -> Tuple:
+    """Equivalent of openpyxl ReadOnlyWorksheet._get_row with values only"""
+    if not cells and not max_col:
+        return ()
+    max_col = max_col or cells[-1][0]
+    new_row = [None] * max_col
+    for column, value in cells:
+        if 1 <= column <= max_col:
+            new_row[column - 1] = value
+    return tuple(new_row)
+
+
+def iter_sheet_rows(
+    parser: SheetParser, rows: Iterator[Tuple[int, List[Tuple]]]
+) -> Iterator[Union[Tuple, List]]:
+    """Equivalent of openpyxl ReadOnlyWorksheet.iter_rows(values_only=True)
+
+    Args:
+        parser (SheetParser): Sheet parser
+        rows (Iterator[Tuple[int, List[Tuple]]]): Rows from parser
+
+    Returns:
+        Iterator[Union[Tuple, List]]: Rows of values
+    """
+    max_col = max_row = None
+    empty_row = []
+    counter = 1
+    idx = 1
+    first = True
+    for idx, cells in rows:
+        if first:
+            # Dimensions are known once the first row is parsed
+            first = False
+            if parser.dimensions is not None:
+                max_col = parser.dimensions[2]
+                max_row = parser.dimensions[3]
+            if max_col is not None:
+                empty_row = (None,) * max_col
+        if max_row is not None and idx > max_row:
+            break
+        for _ in range(counter, idx):
+            counter += 1
+            yield empty_row
+        if counter <= idx:
+            counter += 1
+            yield _get_row(cells, max_col)
+    if max_row is not None and max_row < idx:
+        for _ in range(counter, max_row + 1):
+            yield empty_row
+
+
+def hash_xlsx_xml(source: Union[str, IO]) -> str:
+    """Hash the cell values of all sheets in an XLSX file by parsing the sheet
+    XML directly. Raises UnsupportedWorkbook if the workbook cannot be hashed
+    identically to openpyxl.
+
+    Args:
+        source (Union[str, IO]): Path to XLSX file or file object
+
+    Returns:
+        str: MD5 hash of cell values
+    """
+    reader = ExcelReader(source, read_only=True)
+    archive: ZipFile = reader.archive
+    try:
+        reader.read_manifest()
+        shared_strings = []
+        ct = reader.package.find(SHARED_STRINGS)
+        if ct is not None:
+            with archive.open(ct.PartName[1:]) as src:
+                shared_strings = read_shared_strings(src)
+        reader.read_workbook()
+        workbook = reader.wb
+        apply_stylesheet(archive, workbook)
+        sheet_paths = {}
+        sheet_names = []
+        for sheet, rel in reader.parser.find_sheets():
+            if rel.target not in reader.valid_files:
+                continue
+            if "chartsheet" in rel.Type:
+                raise UnsupportedWorkbook("Workbook has chartsheet!")
+            sheet_names.append(sheet.name)
+            # openpyxl looks up sheets by name so the first of any duplicates is used
+            sheet_paths.setdefault(sheet.name, rel.target)
+
+        def get_parser():
+            return SheetParser(
+                shared_strings,
+                workbook.epoch,
+                workbook._date_formats,
+                workbook._timedelta_formats,
+            )
+
+        md5hash = hashlib.md5()
+        for sheet_name in sheet_names:
+            sheet_path = sheet_paths[sheet_name]
+            md5hash_before = md5hash.copy()
+            try:
+                parser = get_parser()
+                with archive.open(sheet_path) as src:
+                    for cols in iter_sheet_rows(parser, parser.parse_fast(src)):
+                        md5hash.update(bytes(str(cols), "utf-8"))
+                continue
+            except FastPathUnavailable:
+                md5hash = md5hash_before
+            parser = get_parser()
+            with archive.open(sheet_path) as src:
+                for cols in iter_sheet_rows(parser, parser.parse(src)):
+                    md5hash.update(bytes(str(cols), "utf-8"))
+        return md5hash.hexdigest()
+    finally:
+        archive.close()
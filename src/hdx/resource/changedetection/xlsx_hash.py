@@ -0,0 +1,287 @@
+"""Utilities to hash the cell values of XLSX files."""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from os import cpu_count, remove
+from tempfile import NamedTemporaryFile
+from typing import IO, Optional, Union
+
+from openpyxl import load_workbook
+
+from .xlsx_engine import UnsupportedWorkbook, hash_xlsx_xml
+
+logger = logging.getLogger(__name__)
+
+
+def hash_xlsx_openpyxl(source: Union[str, IO]) -> str:
+    """Hash the cell values of all sheets in an XLSX file using openpyxl.
+
+    Args:
+        source (Union[str, IO]): Path to XLSX file or file object
+
+    Returns:
+        str: MD5 hash of cell values
+    """
+    workbook = load_workbook(filename=source, read_only=True)
+    md5hash = hashlib.md5()
+    try:
+        for sheet_name in workbook.sheetnames:
+            sheet = workbook[sheet_name]
+            for cols in sheet.iter_rows(values_only=True):
+                md5hash.update(bytes(str(cols), "utf-8"))
+    finally:
+        workbook.close()
+    return md5hash.hexdigest()
+
+
+def hash_xlsx(source: Union[str, bytes, bytearray], engine: str = "xml") -> str:
+    """Hash the cell values of all sheets in an XLSX file. The hash does not
+    depend upon formatting or other metadata in the file. The xml engine
+    parses the sheet XML directly and falls back to openpyxl for workbooks it
+    does not support. Both engines give the same hash.
+
+    Args:
+        source (Union[str, bytes, bytearray]): Path to XLSX file or its contents
+        engine (str): Engine to use: xml or openpyxl. Defaults to "xml".
+
+    Returns:
+        str: MD5 hash of cell values
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    if engine == "xml":
+        try:
+            return hash_xlsx_xml(source)
+        except UnsupportedWorkbook as ex:
+            logger.debug(f"Using openpyxl: {ex}")
+            if not isinstance(source, str):
+                source.seek(0)
+    return hash_xlsx_openpyxl(source)
+
+
+class XlsxBuffer:
+    """Buffer for XLSX downloads. Data is held in memory until it exceeds
+    spool_threshold bytes after which it is written to a temporary file. If
+    the expected size is known and below the threshold, the memory is
+    allocated once up front rather than grown as chunks arrive.
+
+    Args:
+        spool_threshold (int): Size in bytes above which to spool to disk
+        folder (Optional[str]): Folder for temporary files. Defaults to None (system temp).
+        expected_size (Optional[int]): Expected size eg. from Content-Length. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        spool_threshold: int,
+        folder: Optional[str] = None,
+        expected_size: Optional[int] = None,
+    ) -> None:
+        self._spool_threshold = spool_threshold
+        self._folder = folder
+        if expected_size and expected_size <= spool_threshold:
+            self._buffer = bytearray(expected_size)
+        else:
+            self._buffer = bytearray()
+        self._file = None
+        self._path = None
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        """Add chunk to buffer, spooling to disk if threshold exceeded
+
+        Args:
+            chunk (bytes): Chunk of data
+
+        Returns:
+            None
+        """
+        start = self.size
+        self.size += len(chunk)
+        if self._file:
+            self._file.write(chunk)
+            return
+        if self.size <= len(self._buffer):
+            self._buffer[start : self.size] = chunk
+            return
+        # More data than expected so drop unused space and grow as needed
+        del self._buffer[start:]
+        self._buffer.extend(chunk)
+        if len(self._buffer) > self._spool_threshold:
+            self.spool()
+
+    def writes_to_disk(self, chunk: bytes) -> bool:
+        """Check if writing chunk involves file I/O ie. the buffer is spooled
+        or the chunk takes it over the threshold
+
+        Args:
+            chunk (bytes): Chunk of data
+
+        Returns:
+            bool: True if write involves file I/O
+        """
+        return self._file is not None or self.size + len(chunk) > self._spool_threshold
+
+    async def write_async(
+        self, chunk: bytes, executor: Optional[Executor] = None
+    ) -> None:
+        """Add chunk to buffer doing any file I/O in executor so as not to
+        block the event loop
+
+        Args:
+            chunk (bytes): Chunk of data
+            executor (Optional[Executor]): Executor for file I/O. Defaults to None (loop default).
+
+        Returns:
+            None
+        """
+        if self.writes_to_disk(chunk):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor, self.write, chunk)
+        else:
+            self.write(chunk)
+
+    async def spool_async(self, executor: Optional[Executor] = None) -> None:
+        """Move buffered data to a temporary file in executor so as not to
+        block the event loop
+
+        Args:
+            executor (Optional[Executor]): Executor for file I/O. Defaults to None (loop default).
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self.spool)
+
+    def spool(self) -> None:
+        """Move buffered data to a temporary file and write subsequent data
+        there
+
+        Returns:
+            None
+        """
+        if self._file or self._path:
+            return
+        self._file = NamedTemporaryFile(dir=self._folder, suffix=".xlsx", delete=False)
+        self._path = self._file.name
+        with memoryview(self._buffer) as view:
+            self._file.write(view[: self.size])
+        self._buffer = bytearray()
+
+    def is_spooled(self) -> bool:
+        return self._path is not None
+
+    def get_source(self) -> Union[str, bytearray]:
+        """Finish writing and get path of temporary file if spooled or in
+        memory buffer if not
+
+        Returns:
+            Union[str, bytearray]: Path to temporary file or buffer
+        """
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self._path:
+            return self._path
+        if self.size < len(self._buffer):
+            # Less data than expected
+            del self._buffer[self.size :]
+        return self._buffer
+
+    def close(self) -> None:
+        """Release buffer and delete any temporary file
+
+        Returns:
+            None
+        """
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self._path:
+            try:
+                remove(self._path)
+            except FileNotFoundError:
+                pass
+            self._path = None
+        self._buffer = bytearray()
+
+
+class XlsxHashPool:
+    """Bounded pool of processes for hashing XLSX files without blocking the
+    event loop. At most max_workers workbooks are submitted at a time. The
+    worker processes are replaced once they have hashed max_tasks_per_worker
+    workbooks each on average to return memory fragmented by openpyxl.
+
+    Args:
+        max_workers (Optional[int]): Number of processes. Defaults to None (number of CPUs).
+        max_tasks_per_worker (int): Workbooks per process before recycling. Defaults to 20.
+        engine (str): Engine to use: xml or openpyxl. Defaults to "xml".
+    """
+
+    # Worker processes are not forked as the parent runs hashing and resolver
+    # threads and forking a multi-threaded process can deadlock the child
+    start_method = "forkserver"
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_tasks_per_worker: int = 20,
+        engine: str = "xml",
+    ) -> None:
+        self._engine = engine
+        self._max_workers = max_workers or cpu_count() or 1
+        self._max_tasks = self._max_workers * max_tasks_per_worker
+        self._executor = None
+        self._tasks_submitted = 0
+        self._semaphore = asyncio.Semaphore(self._max_workers)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None or self._tasks_submitted >= self._max_tasks:
+            if self._executor is not None:
+                # Outstanding workbooks are still hashed by the old processes
+                self._executor.shutdown(wait=False)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._max_workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+            )
+            self._tasks_submitted = 0
+        self._tasks_submitted += 1
+        return self._executor
+
+    async def hash(self, source: Union[str, bytes, bytearray]) -> str:
+        """Hash the cell values of an XLSX file in a worker process
+
+        Args:
+            source (Union[str, bytes, bytearray]): Path to XLSX file or its contents
+
+        Returns:
+            str: MD5 hash of cell values
+        """
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            executor = self._get_executor()
+            try:
+                return await loop.run_in_executor(
+                    executor, hash_xlsx, source, self._engine
+                )
+            except BrokenProcessPool:
+                # A worker died (eg. out of memory) so start a fresh pool
+                if self._executor is executor:
+                    self._tasks_submitted = self._max_tasks
+                raise
+
+    def shutdown(self) -> None:
+        """Shut down worker processes
+
+        Returns:
+            None
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
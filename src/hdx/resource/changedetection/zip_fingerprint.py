@@ -0,0 +1,105 @@
+"""Utilities to fingerprint zip files from their central directory so that
+changes can be detected without downloading the whole file."""
+
+import hashlib
+from struct import pack, unpack_from
+from typing import Tuple
+
+END_SIGNATURE = b"PK\x05\x06"
+END_SIZE = 22
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+ZIP64_LOCATOR_SIZE = 20
+ZIP64_END_SIGNATURE = b"PK\x06\x06"
+ZIP64_END_SIZE = 56
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+CENTRAL_SIZE = 46
+ZIP64_EXTRA_ID = 1
+# Covers the end of central directory record with the longest possible comment
+# and the zip64 end of central directory record and locator
+TAIL_SIZE = 65536 + END_SIZE + ZIP64_LOCATOR_SIZE + ZIP64_END_SIZE
+# Distinguishes fingerprints from md5 hashes of the whole file
+FINGERPRINT_PREFIX = "zipcd:"
+
+
+class InvalidZip(Exception):
+    """Raised when the end of a file cannot be parsed as a zip file"""
+
+
+def find_central_directory(tail: bytes, tail_start: int) -> Tuple[int, int, int]:
+    """Find the central directory from the end of a zip file
+
+    Args:
+        tail (bytes): End of zip file
+        tail_start (int): Offset of tail in zip file
+
+    Returns:
+        Tuple[int, int, int]: Offset and size of central directory and number of entries
+    """
+    pos = len(tail)
+    while True:
+        pos = tail.rfind(END_SIGNATURE, 0, pos)
+        if pos == -1:
+            raise InvalidZip("No end of central directory record!")
+        if pos + END_SIZE <= len(tail):
+            comment_length = unpack_from("<H", tail, pos + 20)[0]
+            if pos + END_SIZE + comment_length == len(tail):
+                break
+    entries, size, offset = unpack_from("<HII", tail, pos + 10)
+    end = pos
+    locator = pos - ZIP64_LOCATOR_SIZE
+    if locator >= 0 and tail[locator : locator + 4] == ZIP64_LOCATOR_SIGNATURE:
+        record = locator - ZIP64_END_SIZE
+        if record < 0 or tail[record : record + 4] != ZIP64_END_SIGNATURE:
+            raise InvalidZip("Invalid zip64 end of central directory record!")
+        entries, size, offset = unpack_from("<QQQ", tail, record + 32)
+        end = record
+    # Use position of end record rather than stored offset in case data has
+    # been prepended to the zip file
+    start = tail_start + end - size
+    if start < 0:
+        raise InvalidZip("Invalid central directory size!")
+    return start, size, entries
+
+
+def _get_zip64_file_size(extra: bytes) -> int:
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, length = unpack_from("<HH", extra, pos)
+        if header_id == ZIP64_EXTRA_ID and length >= 8:
+            return unpack_from("<Q", extra, pos + 4)[0]
+        pos += 4 + length
+    raise InvalidZip("No zip64 file size!")
+
+
+def fingerprint_central_directory(data: bytes, entries: int) -> str:
+    """Fingerprint a zip file from the names, CRC32s and uncompressed sizes
+    of its members. The fingerprint does not change if the same files are
+    zipped again with different timestamps or compression.
+
+    Args:
+        data (bytes): Central directory
+        entries (int): Number of entries in central directory
+
+    Returns:
+        str: Fingerprint
+    """
+    md5hash = hashlib.md5()
+    pos = 0
+    for _ in range(entries):
+        if data[pos : pos + 4] != CENTRAL_SIGNATURE or pos + CENTRAL_SIZE > len(data):
+            raise InvalidZip("Invalid central directory entry!")
+        crc, _, file_size, name_length, extra_length, comment_length = unpack_from(
+            "<IIIHHH", data, pos + 16
+        )
+        name_start = pos + CENTRAL_SIZE
+        extra_start = name_start + name_length
+        if file_size == 0xFFFFFFFF:
+            file_size = _get_zip64_file_size(
+                data[extra_start : extra_start + extra_length]
+            )
+        md5hash.update(pack("<IQH", crc, file_size, name_length))
+        md5hash.update(data[name_start:extra_start])
+        pos = extra_start + extra_length + comment_length
+    if pos != len(data):
+        raise InvalidZip("Central directory size does not match entries!")
+    return f"{FINGERPRINT_PREFIX}{md5hash.hexdigest()}"
@@ -1,5 +1,9 @@
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from os.path import join
-from urllib.parse import urlsplit
+from threading import Lock, Thread
+from time import sleep
+from urllib.parse import parse_qs, urlsplit
 
 import pytest
 
@@ -95,3 +99,164 @@ def configuration():
 @pytest.fixture(scope="session")
 def folder():
     return join("tests", "fixtures")
+
+
+@pytest.fixture(scope="session")
+def xlsx_file(tmp_path_factory):
+    from datetime import date, datetime
+
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "Data"
+    sheet.append(["Country", "ISO3", "Value", "Date", "Flag"])
+    for i in range(1000):
+        sheet.append(
+            [
+                f"Country {i}",
+                f"C{i:02d}",
+                i * 1.5,
+                datetime(2020, 1, 1 + i % 28),
+                i % 2 == 0,
+            ]
+        )
+    sheet = workbook.create_sheet("Other")
+    sheet["B2"] = "sparse"
+    sheet["D5"] = 42
+    sheet["A7"] = date(2021, 6, 30)
+    path = tmp_path_factory.mktemp("xlsx") / "test.xlsx"
+    workbook.save(path)
+    return str(path)
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    """Serves files registered in server.files which maps path to a tuple of
+    data and extra headers. Single byte ranges are honoured unless the query
+    string contains norange and Content-Length is omitted if it contains
+    nolength. HEAD requests are rejected with 405 if it contains nohead.
+    If it contains fail=N, the first N requests of the path get 503 with
+    Retry-After of 0. If it contains slow=S, the response to the first
+    request of the path is delayed by S seconds. If it contains trickle=S,
+    the body is sent a byte at a time every S seconds.
+    Conditional requests are answered with 304 if If-None-Match
+    matches the ETag header or If-Modified-Since is not before the
+    Last-Modified header. HTTP/1.0 is used so that each connection is
+    closed after one request."""
+
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def respond(self, send_body):
+        path, _, query = self.path.partition("?")
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        fail = parse_qs(query).get("fail")
+        if fail:
+            with self.server.lock:
+                failures = self.server.failures.get(self.path, 0)
+                self.server.failures[self.path] = failures + 1
+            if failures < int(fail[0]):
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        slow = parse_qs(query).get("slow")
+        if slow:
+            with self.server.lock:
+                first = self.path not in self.server.slowed
+                self.server.slowed.add(self.path)
+            if first:
+                sleep(float(slow[0]))
+        if not send_body and "nohead" in query:
+            self.send_response(405)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        content = self.server.files.get(path)
+        if content is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data, headers = content
+        if self.is_not_modified(headers):
+            self.send_response(304)
+            self.end_headers()
+            return
+        status = 200
+        start = 0
+        end = len(data) - 1
+        byte_range = self.headers.get("Range")
+        if byte_range and "norange" not in query:
+            first, _, last = byte_range.removeprefix("bytes=").partition("-")
+            if first:
+                start = int(first)
+                if last:
+                    end = min(int(last), end)
+            else:
+                start = max(len(data) - int(last), 0)
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        if "nolength" not in query:
+            self.send_header("Content-Length", str(end - start + 1))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not send_body:
+            return
+        trickle = parse_qs(query).get("trickle")
+        if trickle:
+            try:
+                for i in range(start, end + 1):
+                    self.wfile.write(data[i : i + 1])
+                    sleep(float(trickle[0]))
+            except (BrokenPipeError, ConnectionResetError):
+                # Client aborted the download
+                pass
+        else:
+            self.wfile.write(data[start : end + 1])
+
+    def is_not_modified(self, headers):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            return if_none_match == headers.get("ETag")
+        if_modified_since = self.headers.get("If-Modified-Since")
+        last_modified = headers.get("Last-Modified")
+        if if_modified_since and last_modified:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(
+                if_modified_since
+            )
+        return False
+
+
+@pytest.fixture(scope="session")
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureRequestHandler)
+    server.files = {}
+    server.requests = []
+    server.failures = {}
+    server.slowed = set()
+    server.lock = Lock()
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    server.netloc = f"127.0.0.1:{server.server_port}"
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
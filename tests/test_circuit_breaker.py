@@ -0,0 +1,143 @@
+"""
+Unit tests for the circuit breaker.
+
+"""
+
+import asyncio
+from timeit import default_timer as timer
+
+import aiohttp
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.circuit_breaker import (
+    CircuitBreaker,
+    is_connect_failure,
+    is_connection_failure,
+)
+from hdx.resource.changedetection.head_results import HeadResults
+from hdx.resource.changedetection.head_retrieval import HeadRetrieval
+from hdx.resource.changedetection.retrieval import Retrieval
+from hdx.resource.changedetection.worker_pool import RetryLater
+
+
+class TestCircuitBreaker:
+    def test_is_connection_failure(self):
+        check.is_true(is_connection_failure(asyncio.TimeoutError()))
+        check.is_true(is_connection_failure(aiohttp.ServerDisconnectedError()))
+        check.is_false(is_connection_failure(ValueError()))
+        check.is_true(is_connect_failure(aiohttp.ConnectionTimeoutError()))
+        check.is_false(is_connect_failure(asyncio.TimeoutError()))
+        check.is_false(is_connect_failure(aiohttp.ServerDisconnectedError()))
+
+    def test_circuit_breaker(self):
+        circuit_breaker = CircuitBreaker("host", failure_threshold=3, reset_timeout=10)
+        check.is_true(circuit_breaker.allow(0))
+        circuit_breaker.record_failure(0)
+        circuit_breaker.record_failure(0)
+        # Success resets consecutive failures
+        circuit_breaker.record_success()
+        circuit_breaker.record_failure(0)
+        circuit_breaker.record_failure(0)
+        check.equal(circuit_breaker.state, CircuitBreaker.closed)
+        circuit_breaker.record_failure(1)
+        check.equal(circuit_breaker.state, CircuitBreaker.open)
+        check.is_true(circuit_breaker.is_open())
+        check.is_false(circuit_breaker.allow(5))
+
+        # One trial request after reset timeout
+        check.is_true(circuit_breaker.allow(11))
+        check.equal(circuit_breaker.state, CircuitBreaker.half_open)
+        check.is_false(circuit_breaker.is_open())
+        check.is_false(circuit_breaker.allow(12))
+        circuit_breaker.record_failure(12)
+        check.equal(circuit_breaker.state, CircuitBreaker.open)
+        check.is_false(circuit_breaker.allow(20))
+
+        check.is_true(circuit_breaker.allow(22))
+        # Trial that never reports back does not block for ever
+        check.is_true(circuit_breaker.allow(32))
+        circuit_breaker.record_success()
+        check.equal(circuit_breaker.state, CircuitBreaker.closed)
+        check.is_true(circuit_breaker.allow(33))
+
+    @pytest.mark.asyncio
+    async def test_hold(self):
+        circuit_breaker = CircuitBreaker("host", failure_threshold=1, reset_timeout=10)
+        circuit_breaker.record_failure(0)
+        # Held back until the trial request is due
+        with pytest.raises(RetryLater) as exc_info:
+            circuit_breaker.hold(4)
+        check.equal(exc_info.value.delay, 6)
+        released = exc_info.value.until
+        check.is_true(circuit_breaker.allow(10))
+        # and then until the trial request reports back
+        with pytest.raises(RetryLater) as exc_info:
+            circuit_breaker.hold(11)
+        check.equal(exc_info.value.delay, 10)
+        check.is_(exc_info.value.until, released)
+        check.is_false(released.done())
+        # Host is down once the trial fails
+        circuit_breaker.record_failure(12)
+        check.is_true(released.done())
+        circuit_breaker.hold(13)
+        check.is_true(circuit_breaker.allow(22))
+        circuit_breaker.record_success()
+        circuit_breaker.record_failure(23)
+        with pytest.raises(RetryLater) as exc_info:
+            circuit_breaker.hold(24)
+        check.is_false(exc_info.value.until.done())
+        circuit_breaker.record_success()
+        check.is_true(exc_info.value.until.done())
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self):
+        # Nothing listens on port 1 so connections are refused
+        resources = [(f"http://127.0.0.1:1/{i}.csv", str(i), "csv") for i in range(6)]
+        retrieval = HeadRetrieval(
+            "test",
+            {"127.0.0.1:1"},
+            host_limits={"concurrency": 1, "max_concurrency": 1},
+            circuit_breaker={"failure_threshold": 2, "reset_timeout": 0.2},
+        )
+        start = timer()
+        result = await retrieval.check_urls(resources)
+        statuses = [result[str(i)][3] for i in range(6)]
+        check.equal(statuses[:2], [-101, -101])
+        # Others are held back until a trial request fails
+        check.equal(sorted(statuses[2:]), [-101, -12, -12, -12])
+        check.greater(timer() - start, 0.2)
+
+        # Resources not checked are neither set broken nor downloaded
+        id = str(statuses.index(-12))
+        resource = (resources[int(id)][0], id, "csv", "d1", None, None, None, False)
+        head_results = HeadResults({id: result[id]}, {id: resource})
+        resource_status = {}
+        head_results.process(resource_status)
+        check.equal(resource_status[id]["Head Status"], "HOST CIRCUIT OPEN")
+        check.equal(resource_status[id]["Set Broken"], "N")
+        check.equal(head_results.get_distributed_resources_to_get(), [])
+        check.equal(head_results.get_datasets_to_revise(), {})
+
+    @pytest.mark.asyncio
+    async def test_large_file_timeout(self, http_server):
+        http_server.files["/circuit_large.csv"] = (
+            b"a" * 30000,
+            {"Content-Type": "text/csv"},
+        )
+        url = f"{http_server.url}/circuit_large.csv?slow=1"
+        retrieval = Retrieval(
+            "test",
+            {http_server.netloc},
+            large_file_threshold=20000,
+            large_file_timeout=0.3,
+            retry_budget={"ratio": 0, "min_retries": 0},
+            circuit_breaker={"failure_threshold": 1},
+        )
+        result = await retrieval.check_urls([(url, "1", "csv")], {"1": 30000})
+        check.equal(result["1"], (None, None, None, -101))
+        # Timeout of a large file after connecting does not open the circuit
+        check.equal(
+            retrieval._circuit_breakers[http_server.netloc].state,
+            CircuitBreaker.closed,
+        )
@@ -0,0 +1,94 @@
+"""
+Unit tests for conditional requests.
+
+"""
+
+import hashlib
+from datetime import datetime, timezone
+
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.head_retrieval import HeadRetrieval
+from hdx.resource.changedetection.retrieval import Retrieval
+from hdx.resource.changedetection.utilities import get_conditional_headers
+
+LAST_MODIFIED = datetime(2024, 6, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def make_resource(url, resource_id, hash, last_modified=LAST_MODIFIED):
+    return (url, resource_id, "csv", "dataset", None, last_modified, hash, False)
+
+
+class TestConditionalRequests:
+    def test_get_conditional_headers(self):
+        check.equal(get_conditional_headers(("url", "1", "csv")), {})
+        check.equal(get_conditional_headers(make_resource("url", "1", None)), {})
+        check.equal(
+            get_conditional_headers(make_resource("url", "1", 'W/"abc"')),
+            {
+                "If-None-Match": 'W/"abc"',
+                "If-Modified-Since": "Sat, 01 Jun 2024 12:00:00 GMT",
+            },
+        )
+        # Hashes calculated by downloading are not ETags
+        md5 = hashlib.md5(b"data").hexdigest()
+        check.equal(
+            get_conditional_headers(make_resource("url", "1", md5)),
+            {"If-Modified-Since": "Sat, 01 Jun 2024 12:00:00 GMT"},
+        )
+        check.equal(
+            get_conditional_headers(
+                make_resource("url", "1", '"abc"', LAST_MODIFIED.replace(tzinfo=None))
+            ),
+            {
+                "If-None-Match": '"abc"',
+                "If-Modified-Since": "Sat, 01 Jun 2024 12:00:00 GMT",
+            },
+        )
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self, http_server):
+        data = b"a,b\n1,2\n"
+        http_server.files["/conditional_etag.csv"] = (
+            data,
+            {"Content-Type": "text/csv", "ETag": '"v1"'},
+        )
+        http_server.files["/conditional_date.csv"] = (
+            data,
+            {
+                "Content-Type": "text/csv",
+                "Last-Modified": "Sat, 01 Jun 2024 11:00:00 GMT",
+            },
+        )
+        url = http_server.url
+        md5 = hashlib.md5(data).hexdigest()
+        resources = [
+            make_resource(f"{url}/conditional_etag.csv", "1", '"v1"'),
+            make_resource(f"{url}/conditional_etag.csv", "2", '"v0"'),
+            make_resource(f"{url}/conditional_date.csv", "3", md5),
+            make_resource(
+                f"{url}/conditional_date.csv",
+                "4",
+                md5,
+                datetime(2024, 5, 1, tzinfo=timezone.utc),
+            ),
+            make_resource(f"{url}/conditional_date.csv", "5", None),
+        ]
+        result = await HeadRetrieval("test", {http_server.netloc}).check_urls(resources)
+        check.equal(result["1"][3], 304)
+        check.equal(result["2"], (len(data), None, '"v1"', 200))
+        check.equal(result["3"][3], 304)
+        check.equal(result["4"][3], 200)
+        check.equal(result["5"][3], 200)
+
+        result = await Retrieval("test", {http_server.netloc}).check_urls(resources)
+        check.equal(result["1"][3], 304)
+        check.equal(result["2"], (len(data), None, '"v1"', 200))
+        check.equal(result["3"][3], 304)
+        check.equal(result["4"], (len(data), "Sat, 01 Jun 2024 11:00:00 GMT", md5, 0))
+
+        retrieval = Retrieval("test", {http_server.netloc}, conditional_requests=False)
+        result = await retrieval.check_urls(resources)
+        check.equal(result["1"][3], 200)
+        check.equal(result["3"][3], 0)
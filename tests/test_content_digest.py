@@ -0,0 +1,90 @@
+"""
+Unit tests for content digests.
+
+"""
+
+import hashlib
+from base64 import b64encode
+
+import pytest
+from multidict import CIMultiDict, CIMultiDictProxy
+from pytest_check import check
+
+from hdx.resource.changedetection.content_digest import decode_md5, get_md5_digest
+from hdx.resource.changedetection.head_retrieval import HeadRetrieval
+
+DATA = b"a,b\n1,2\n"
+MD5 = hashlib.md5(DATA).hexdigest()
+MD5_BASE64 = b64encode(hashlib.md5(DATA).digest()).decode()
+SHA256_BASE64 = b64encode(hashlib.sha256(DATA).digest()).decode()
+
+
+def get_digest(*headers):
+    return get_md5_digest(CIMultiDictProxy(CIMultiDict(headers)))
+
+
+class TestContentDigest:
+    def test_decode_md5(self):
+        check.equal(decode_md5(MD5_BASE64), MD5)
+        check.is_none(decode_md5(SHA256_BASE64))
+        check.is_none(decode_md5("not base64!"))
+
+    def test_get_md5_digest(self):
+        check.equal(get_digest(("Content-MD5", MD5_BASE64)), MD5)
+        check.equal(
+            get_digest(
+                ("x-goog-hash", "crc32c=n03x6A=="), ("x-goog-hash", f"md5={MD5_BASE64}")
+            ),
+            MD5,
+        )
+        check.equal(
+            get_digest(("x-goog-hash", f"crc32c=n03x6A==,md5={MD5_BASE64}")), MD5
+        )
+        check.equal(
+            get_digest(
+                ("Repr-Digest", f"sha-256=:{SHA256_BASE64}:, md5=:{MD5_BASE64}:")
+            ),
+            MD5,
+        )
+        check.equal(
+            get_digest(("Digest", f"SHA-256={SHA256_BASE64},MD5={MD5_BASE64}")), MD5
+        )
+        check.equal(get_digest(("ETag", f'"{MD5}"'), ("x-amz-request-id", "1")), MD5)
+        check.equal(get_digest(("ETag", f'"{MD5}"'), ("Server", "AmazonS3")), MD5)
+        # Multipart upload
+        check.is_none(get_digest(("ETag", f'"{MD5}-3"'), ("Server", "AmazonS3")))
+        # Not S3
+        check.is_none(get_digest(("ETag", f'"{MD5}"')))
+        # Not md5
+        check.is_none(get_digest(("x-amz-checksum-sha256", SHA256_BASE64)))
+        check.is_none(get_digest(("Repr-Digest", f"sha-256=:{SHA256_BASE64}:")))
+        # Digest is of encoded body
+        check.is_none(
+            get_digest(("Content-MD5", MD5_BASE64), ("Content-Encoding", "gzip"))
+        )
+
+    @pytest.mark.asyncio
+    async def test_head_retrieval(self, http_server):
+        http_server.files["/digest.csv"] = (
+            DATA,
+            {"Content-Type": "text/csv", "Content-MD5": MD5_BASE64},
+        )
+        http_server.files["/digest_etag.csv"] = (
+            DATA,
+            {"Content-Type": "text/csv", "Content-MD5": MD5_BASE64, "ETag": '"v1"'},
+        )
+        url = http_server.url
+        resources = [
+            (f"{url}/digest.csv", "1", "csv"),
+            (f"{url}/digest_etag.csv", "2", "csv"),
+            (f"{url}/digest_etag.csv", "3", "csv", "d", None, None, MD5, False),
+            (f"{url}/digest.csv", "4", "xlsx"),
+        ]
+        result = await HeadRetrieval(
+            "test", {http_server.netloc}, conditional_requests=False
+        ).check_urls(resources)
+        check.equal(result["1"], (len(DATA), None, MD5, 200))
+        # ETag is kept unless the stored hash is the md5
+        check.equal(result["2"], (len(DATA), None, '"v1"', 200))
+        check.equal(result["3"], (len(DATA), None, MD5, 200))
+        check.equal(result["4"], (len(DATA), None, None, 200))
@@ -0,0 +1,134 @@
+"""
+Unit tests for content encoding.
+
+"""
+
+import gzip
+import hashlib
+import zlib
+
+import brotli
+import pytest
+import zstandard
+from pytest_check import check
+
+from hdx.resource.changedetection.content_encoding import (
+    ContentDecoder,
+    UnsupportedEncoding,
+    get_accept_encoding,
+    get_accept_encoding_for_format,
+    get_decoder,
+    get_default_accept_encoding,
+)
+from hdx.resource.changedetection.head_retrieval import HeadRetrieval
+from hdx.resource.changedetection.retrieval import Retrieval
+
+DATA = b"".join(f"{i},Country {i},{i * 1.5}\n".encode() for i in range(20000))
+
+
+def deflate(data, wbits):
+    compressor = zlib.compressobj(wbits=wbits)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decode(content_encoding, data, chunk_size=1000):
+    decoder = ContentDecoder(content_encoding)
+    output = b"".join(
+        decoder.decompress(data[i : i + chunk_size])
+        for i in range(0, len(data), chunk_size)
+    )
+    return output + decoder.flush(), decoder.encoded_size
+
+
+class TestContentEncoding:
+    def test_accept_encoding(self):
+        accept_encoding = get_accept_encoding()
+        check.is_true(accept_encoding.startswith("gzip, deflate"))
+        check.is_true("br" in accept_encoding)
+        check.is_true(accept_encoding.endswith("zstd"))
+        check.equal(get_accept_encoding_for_format("csv"), accept_encoding)
+        default = get_default_accept_encoding()
+        check.equal(default, "gzip, deflate, br")
+        check.equal(get_accept_encoding_for_format("xlsx"), default)
+        check.equal(get_accept_encoding_for_format("csv", ["json"]), default)
+
+    def test_decoder(self):
+        for content_encoding, data in (
+            ("gzip", gzip.compress(DATA)),
+            ("x-gzip", gzip.compress(DATA)),
+            ("GZIP", gzip.compress(DATA[:1000]) + gzip.compress(DATA[1000:])),
+            ("deflate", deflate(DATA, zlib.MAX_WBITS)),
+            ("deflate", deflate(DATA, -zlib.MAX_WBITS)),
+            ("br", brotli.compress(DATA)),
+            ("gzip, br", brotli.compress(gzip.compress(DATA))),
+            ("zstd", zstandard.ZstdCompressor().compress(DATA)),
+            ("identity, gzip", gzip.compress(DATA)),
+        ):
+            output, encoded_size = decode(content_encoding, data)
+            check.equal(output, DATA)
+            check.equal(encoded_size, len(data))
+
+        check.is_none(get_decoder(None))
+        check.is_none(get_decoder("identity"))
+        with pytest.raises(UnsupportedEncoding):
+            get_decoder("compress")
+
+    @pytest.mark.asyncio
+    async def test_decode(self):
+        data = gzip.compress(DATA)
+
+        async def chunks():
+            for i in range(0, len(data), 100):
+                yield data[i : i + 100]
+
+        decoder = get_decoder("gzip")
+        output = [x async for x in decoder.decode(chunks())]
+        check.is_true(all(output))
+        check.equal(b"".join(output), DATA)
+        check.equal(decoder.encoded_size, len(data))
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self, http_server):
+        compressed = gzip.compress(DATA)
+        headers = {"Content-Type": "text/csv", "Content-Encoding": "gzip"}
+        http_server.files["/encoded.csv"] = (compressed, headers)
+        http_server.files["/encoded.xlsx"] = (
+            DATA,
+            {"Content-Type": "application/octet-stream"},
+        )
+        http_server.files["/encoded_unknown.csv"] = (
+            DATA,
+            {"Content-Type": "text/csv", "Content-Encoding": "unknown"},
+        )
+        url = http_server.url
+        retrieval = Retrieval("test", {http_server.netloc})
+        result = await retrieval.check_urls(
+            [
+                (f"{url}/encoded.csv", "1", "csv"),
+                (f"{url}/encoded.xlsx", "2", "xlsx"),
+                (f"{url}/encoded_unknown.csv", "3", "csv"),
+            ]
+        )
+        expected = hashlib.md5(DATA).hexdigest()
+        check.equal(result["1"], (len(DATA), None, expected, 0))
+        check.equal(result["3"], (len(DATA), None, expected, 0))
+        check.equal(retrieval._bytes_downloaded, 3 * len(DATA))
+        check.equal(retrieval._bytes_transferred, 2 * len(DATA) + len(compressed))
+
+        result = await HeadRetrieval("test", {http_server.netloc}).check_urls(
+            [(f"{url}/encoded.csv", "1", "csv"), (f"{url}/encoded.xlsx", "2", "xlsx")]
+        )
+        check.equal(result["2"], (len(DATA), None, None, 200))
+        accept_encodings = {
+            (method, path): headers.get("Accept-Encoding")
+            for method, path, headers in http_server.requests
+            if path.startswith("/encoded.")
+        }
+        check.equal(accept_encodings[("GET", "/encoded.csv")], get_accept_encoding())
+        check.equal(
+            accept_encodings[("GET", "/encoded.xlsx")], get_default_accept_encoding()
+        )
+        check.equal(accept_encodings[("HEAD", "/encoded.csv")], get_accept_encoding())
+        check.equal(
+            accept_encodings[("HEAD", "/encoded.xlsx")], get_default_accept_encoding()
+        )
@@ -120,6 +120,7 @@ class TestHeadResults:
                 )
             ],
         )
+        check.equal(head_results.get_sizes(), {"1a2b": 357103})
 
         result[0] = 357102
         result[1] = "Sun, 10 Nov 2019 08:04:27 GMT"
@@ -1050,3 +1051,23 @@ class TestHeadResults:
                 }
             },
         )
+
+    def test_not_modified(self):
+        resource = (
+            "https://test.com/myfile.csv",
+            "a8b51b81-1fa7-499d-a9f2-3d0bce06b5b5",
+            "csv",
+            "5eaf2ecd-0b29-46cd-bddb-9c2317c9b8e5",
+            357102,
+            datetime(2019, 11, 10, 8, 4, 26, tzinfo=timezone.utc),
+            '"1234"',
+            True,
+        )
+        results_input = {"1a2b": [None, None, None, 304]}
+        head_results = HeadResults(results_input, {"1a2b": resource})
+        resource_status = {}
+        head_results.process(resource_status)
+        check.equal(resource_status["1a2b"]["Head Status"], "NOT_MODIFIED")
+        check.equal(resource_status["1a2b"]["Set Broken"], "N")
+        check.equal(head_results.get_distributed_resources_to_get(), [])
+        check.equal(head_results.get_datasets_to_revise(), {})
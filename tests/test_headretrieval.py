@@ -3,9 +3,11 @@ Unit tests for the retrieval class.
 
 """
 
+import pytest
 from pytest_check import check
 
 from hdx.resource.changedetection.head_retrieval import HeadRetrieval
+from hdx.resource.changedetection.host_registry import HostRegistry
 
 
 class TestHeadRetrieve:
@@ -88,3 +90,107 @@ class TestHeadRetrieve:
             result["17"],
             (1787826, "Thu, 27 Jan 2022 21:30:41 GMT", None, 200),
         )
+
+    @pytest.mark.asyncio
+    async def test_probe(self, http_server):
+        data = b"x" * 1000
+        headers = {
+            "Content-Type": "text/plain",
+            "ETag": '"probe"',
+            "Last-Modified": "Sat, 01 Jun 2024 11:00:00 GMT",
+        }
+        http_server.files["/probe.txt"] = (data, headers)
+        url = http_server.url
+        result = await HeadRetrieval("test", {http_server.netloc}).check_urls(
+            [
+                (f"{url}/probe.txt?nohead", "1", "txt"),
+                (f"{url}/probe.txt?nohead&norange", "2", "txt"),
+                (f"{url}/probe.txt?nohead", "3", "txt", "d", None, None, '"probe"'),
+                (f"{url}/missing.txt?nohead", "4", "txt"),
+            ]
+        )
+        expected = (1000, "Sat, 01 Jun 2024 11:00:00 GMT", '"probe"', 200)
+        check.equal(result["1"], expected)
+        # Server ignored range
+        check.equal(result["2"], expected)
+        check.equal(result["3"][3], 304)
+        check.equal(result["4"], (None, None, None, 405))
+        ranges = [
+            headers.get("Range")
+            for method, path, headers in http_server.requests
+            if method == "GET" and path == "/probe.txt?nohead"
+        ]
+        check.equal(ranges, ["bytes=0-0", "bytes=0-0"])
+
+    @pytest.mark.asyncio
+    async def test_hedging(self, http_server):
+        http_server.files["/hedge.csv"] = (b"a,b\n", {"Content-Type": "text/csv"})
+        url = http_server.url
+        netloc = http_server.netloc
+        host_registry = HostRegistry()
+        for _ in range(20):
+            host_registry.record("head", netloc, 0.01)
+        host_registry.save()
+        check.almost_equal(host_registry.get_latency("head", netloc, 90), 0.01)
+
+        p99 = {}
+        hedging_config = {"percentile": 90, "min_delay": 0.2, "control_fraction": 0}
+        for hedging in (None, hedging_config):
+            run = "hedged" if hedging else "unhedged"
+            resources = [
+                (f"{url}/hedge.csv?{run}={i}", str(i), "csv") for i in range(20)
+            ]
+            resources.append((f"{url}/hedge.csv?{run}&slow=2", "slow", "csv"))
+            retrieval = HeadRetrieval(
+                "test",
+                {netloc},
+                host_registry=host_registry,
+                host_limits={"rate": 100, "max_rate": 100},
+                hedging=hedging,
+            )
+            result = await retrieval.check_urls(resources)
+            check.equal(result["slow"], (4, None, None, 200))
+            p99[run] = retrieval.get_completion_time(99)
+            hedges = [
+                x for x in http_server.requests if x[1] == resources[-1][0][len(url) :]
+            ]
+            if hedging:
+                check.equal(retrieval.hedged, 1)
+                check.equal(len(hedges), 2)
+                check.less(retrieval.get_latency_percentile("hedged"), 1)
+                check.is_none(retrieval.get_latency_percentile("unhedged"))
+            else:
+                check.equal(retrieval.hedged, 0)
+                check.equal(len(hedges), 1)
+                check.greater(retrieval.get_latency_percentile("unhedged"), 1.5)
+                check.is_none(retrieval.get_latency_percentile("hedged"))
+        check.greater(p99["unhedged"], 1.5)
+        check.less(p99["hedged"], 1)
+
+        # No duplicate request without a free concurrency slot
+        resources = [(f"{url}/hedge.csv?noslot&slow=1", "slow", "csv")]
+        retrieval = HeadRetrieval(
+            "test",
+            {netloc},
+            host_registry=host_registry,
+            host_limits={"concurrency": 1, "max_concurrency": 1},
+            hedging=hedging_config,
+        )
+        result = await retrieval.check_urls(resources)
+        check.equal(result["slow"], (4, None, None, 200))
+        check.equal(retrieval.hedged, 0)
+        check.greater(retrieval.get_latency_percentile("hedged"), 0.9)
+
+        # Resources in the control group are not hedged
+        resources = [(f"{url}/hedge.csv?control&slow=1", "slow", "csv")]
+        retrieval = HeadRetrieval(
+            "test",
+            {netloc},
+            host_registry=host_registry,
+            host_limits={"rate": 100, "max_rate": 100},
+            hedging={"percentile": 90, "min_delay": 0.2, "control_fraction": 1},
+        )
+        result = await retrieval.check_urls(resources)
+        check.equal(retrieval.hedged, 0)
+        check.greater(retrieval.get_latency_percentile("unhedged"), 0.9)
+        check.is_none(retrieval.get_latency_percentile("hedged"))
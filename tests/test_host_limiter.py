@@ -0,0 +1,99 @@
+"""
+Unit tests for the adaptive host limiter.
+
+"""
+
+import asyncio
+
+import aiohttp
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.head_retrieval import HeadRetrieval
+from hdx.resource.changedetection.host_limiter import (
+    HostLimiter,
+    is_overload_exception,
+    is_overload_status,
+)
+
+
+class TestHostLimiter:
+    def test_is_overload(self):
+        check.is_true(is_overload_status(429))
+        check.is_true(is_overload_status(503))
+        check.is_false(is_overload_status(404))
+        check.is_false(is_overload_status(None))
+        check.is_true(is_overload_exception(asyncio.TimeoutError()))
+        check.is_true(is_overload_exception(aiohttp.ServerDisconnectedError()))
+        check.is_false(is_overload_exception(ValueError()))
+
+    @pytest.mark.asyncio
+    async def test_aimd(self):
+        limiter = HostLimiter(rate=4, concurrency=10, max_rate=5, max_concurrency=11)
+        limiter.record_success()
+        check.almost_equal(limiter.rate, 4.25)
+        check.almost_equal(limiter.concurrency, 10.1)
+        for _ in range(100):
+            limiter.record_success()
+        check.equal(limiter.rate, 5)
+        check.equal(limiter.concurrency, 11)
+
+        limiter.record_overload()
+        check.equal(limiter.rate, 2.5)
+        check.equal(limiter.concurrency, 5.5)
+        # Requests in flight failing together only cut once
+        limiter.record_overload()
+        check.equal(limiter.rate, 2.5)
+
+        limiter = HostLimiter(decrease_interval=0, min_rate=1, min_concurrency=2)
+        for _ in range(10):
+            limiter.record_overload()
+        check.equal(limiter.rate, 1)
+        check.equal(limiter.concurrency, 2)
+
+        limiter = HostLimiter()
+        limiter.record_success(0.1)
+        rate = limiter.rate
+        # Slow response is not healthy so limits are held
+        limiter.record_success(1)
+        check.equal(limiter.rate, rate)
+        limiter.record_success(0.1)
+        check.greater(limiter.rate, rate)
+
+    @pytest.mark.asyncio
+    async def test_limits(self):
+        limiter = HostLimiter(rate=20, concurrency=2, max_rate=20)
+        running = 0
+        max_running = 0
+        starts = []
+
+        async def request():
+            nonlocal running, max_running
+            async with limiter:
+                starts.append(asyncio.get_running_loop().time())
+                running += 1
+                max_running = max(max_running, running)
+                await asyncio.sleep(0.2)
+                running -= 1
+
+        await asyncio.gather(*(request() for _ in range(6)))
+        check.equal(max_running, 2)
+        check.greater_equal(starts[-1] - starts[0], 0.24)
+
+        # Slot is only taken without waiting if free
+        check.is_true(limiter.try_acquire())
+        check.is_true(limiter.try_acquire())
+        check.is_false(limiter.try_acquire())
+        await limiter.release()
+        check.is_true(limiter.try_acquire())
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self):
+        # Nothing listens on port 1 so the connection is refused
+        url = "http://127.0.0.1:1/file.csv"
+        retrieval = HeadRetrieval("test", {"127.0.0.1:1"})
+        limiter = retrieval._host_limiters["127.0.0.1:1"]
+        result = await retrieval.check_urls([(url, "1", "csv")])
+        check.equal(result["1"], (None, None, None, -101))
+        check.equal(limiter.rate, 2)
+        check.equal(limiter.concurrency, 5)
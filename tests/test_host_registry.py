@@ -0,0 +1,102 @@
+"""
+Unit tests for the host registry.
+
+"""
+
+from os.path import join
+
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.head_retrieval import HeadRetrieval
+from hdx.resource.changedetection.host_registry import HostRegistry
+
+
+class TestHostRegistry:
+    def test_host_registry(self, tmp_path):
+        path = join(tmp_path, "hosts.sqlite")
+        host_registry = HostRegistry(path)
+        check.is_none(host_registry.get_host("head", "a"))
+        check.equal(host_registry.get_limits("head", "a"), {})
+        check.is_none(host_registry.is_head_supported("a"))
+        check.equal(host_registry.get_timeout("head", "a", 300), 300)
+        for duration in range(1, 101):
+            host_registry.record("head", "a", duration / 100)
+        for _ in range(10):
+            host_registry.record_error("head", "a")
+        host_registry.record_error("head", "a", rate_limited=True)
+        host_registry.record_head_supported("a", False)
+        host_registry.record_limits("head", "a", 8, 12)
+        host_registry.record("get", "a", 5)
+        # Percentile from this run once there are enough samples
+        check.almost_equal(host_registry.get_latency("head", "a", 90), 0.901)
+        check.is_none(host_registry.get_latency("get", "a", 90))
+        host_registry.save()
+
+        host_registry = HostRegistry(path)
+        host = host_registry.get_host("head", "a")
+        check.almost_equal(host["latency_p50"], 0.505)
+        check.almost_equal(host["latency_p99"], 0.9901)
+        check.equal(host["requests"], 100)
+        check.equal(host["errors"], 11)
+        check.equal(host["rate_limited"], 1)
+        check.almost_equal(host["error_rate"], 0.11)
+        check.is_false(host_registry.is_head_supported("a"))
+        check.equal(
+            host_registry.get_limits("head", "a"), {"rate": 8, "concurrency": 12}
+        )
+        check.is_not_none(host_registry.get_duration("head", "a"))
+        check.equal(host_registry.get_duration("get", "a"), 5)
+        check.equal(host_registry.get_timeout("head", "a", 300), 30)
+        check.almost_equal(host_registry.get_timeout("head", "a", 300, 1, 10), 9.901)
+
+        # Next run is merged into stored values
+        host_registry.record("head", "a", 2)
+        host_registry.record_head_supported("a", True)
+        host_registry.save()
+        host = HostRegistry(path).get_host("head", "a")
+        check.almost_equal(host["latency_p50"], 1.2525)
+        check.equal(host["requests"], 101)
+        check.almost_equal(host["error_rate"], 0.055)
+        check.equal(host["head_supported"], 1)
+        check.equal(host["rate"], 8)
+
+        with open(path, "w") as file:
+            file.write("not a database")
+        check.is_none(HostRegistry(path).get_host("head", "a"))
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self, http_server, tmp_path):
+        http_server.files["/registry.csv"] = (b"a,b\n", {"Content-Type": "text/csv"})
+        path = join(tmp_path, "hosts.sqlite")
+        netloc = http_server.netloc
+        url = f"{http_server.url}/registry.csv?nohead"
+        host_registry = HostRegistry(path)
+        retrieval = HeadRetrieval("test", {netloc}, host_registry=host_registry)
+        result = await retrieval.check_urls([(url, "1", "csv")])
+        check.equal(result["1"], (4, None, None, 200))
+        host_registry.save()
+
+        host_registry = HostRegistry(path)
+        check.is_false(host_registry.is_head_supported(netloc))
+        check.is_not_none(host_registry.get_duration("head", netloc))
+        retrieval = HeadRetrieval(
+            "test", {netloc}, host_registry=host_registry, host_limits={"rate": 2}
+        )
+        rate = host_registry.get_limits("head", netloc)["rate"]
+        check.equal(rate, 4)
+        # Limiter starts from rate reached in previous run
+        check.equal(retrieval._host_limiters[netloc].rate, rate)
+        check.equal(retrieval.get_timeout(netloc).total, 30)
+        requests = len(http_server.requests)
+        result = await retrieval.check_urls([(url, "1", "csv")])
+        check.equal(result["1"], (4, None, None, 200))
+        # HEAD is not tried again
+        check.equal(
+            [
+                x[0]
+                for x in http_server.requests[requests:]
+                if x[1] == "/registry.csv?nohead"
+            ],
+            ["GET"],
+        )
@@ -0,0 +1,86 @@
+"""
+Unit tests for the host scheduler.
+
+"""
+
+from os.path import join
+
+from pytest_check import check
+
+from hdx.resource.changedetection.host_registry import HostRegistry
+from hdx.resource.changedetection.host_scheduler import (
+    HostTimings,
+    estimate_host_time,
+    order_by_host_time,
+)
+
+
+def get_resources(host, count):
+    return [(f"http://{host}/{i}", f"{host}{i}", "csv") for i in range(count)]
+
+
+class TestHostScheduler:
+    def test_estimate_host_time(self):
+        check.equal(estimate_host_time(8, None), 2)
+        # Rate limit is the bottleneck
+        check.equal(estimate_host_time(8, 1), 3)
+        # Connections are the bottleneck
+        check.equal(estimate_host_time(10, 5), 10)
+
+    def test_order_by_host_time(self):
+        resources = (
+            get_resources("a", 2) + get_resources("b", 6) + get_resources("c", 2)
+        )
+        ordered = order_by_host_time(resources, "head")
+        check.equal(sorted(ordered), sorted(resources))
+        hosts = "".join(x[1][0] for x in ordered)
+        # Host with most resources starts first and hosts are interleaved
+        # at the pace they can be processed
+        check.equal(hosts, "bacbacbbbb")
+        # Order within each host is kept
+        check.equal([x for x in ordered if x[1][0] == "b"], resources[2:8])
+
+        host_timings = HostTimings()
+        host_timings.record("head", "a", 30)
+        ordered = order_by_host_time(resources, "head", host_timings)
+        hosts = "".join(x[1][0] for x in ordered)
+        # Slow host starts first despite having fewer resources, but its next
+        # resource is not expected to start until its connections are in use
+        check.equal(hosts, "abcbcbbbba")
+        check.equal(order_by_host_time(resources, "get", host_timings)[0][1], "b0")
+        check.equal(order_by_host_time([], "head"), [])
+
+    def test_order_by_host_limits(self, tmp_path):
+        resources = (
+            get_resources("a", 2) + get_resources("b", 6) + get_resources("c", 2)
+        )
+        host_registry = HostRegistry(join(tmp_path, "hosts.sqlite"))
+        host_registry.record_limits("head", "a", 0.1, 1)
+        host_registry.save()
+        host_registry = HostRegistry(join(tmp_path, "hosts.sqlite"))
+        ordered = order_by_host_time(resources, "head", host_registry)
+        hosts = "".join(x[1][0] for x in ordered)
+        # Host limited to a low rate in previous runs starts first while
+        # others use the default rate and concurrency
+        check.equal(hosts, "abcbcbbbba")
+
+    def test_order_window(self):
+        resources = (
+            get_resources("a", 10) + get_resources("b", 100) + get_resources("c", 20)
+        )
+        ordered = order_by_host_time(resources, "head")
+        # A read ahead of a few resources holds every host
+        for start in range(0, 12, 3):
+            hosts = {x[1][0] for x in ordered[start : start + 3]}
+            check.equal(hosts, {"a", "b", "c"})
+        check.equal(ordered[0][1], "b0")
+
+    def test_host_timings(self):
+        host_timings = HostTimings()
+        check.is_none(host_timings.get_duration("head", "a"))
+        host_timings.record("head", "a", 1)
+        host_timings.record("head", "a", 2)
+        check.almost_equal(host_timings.get_duration("head", "a"), 1.2)
+        host_timings.record("get", "a", 5)
+        check.equal(host_timings.get_duration("get", "a"), 5)
+        check.is_none(host_timings.get_duration("get", "b"))
@@ -0,0 +1,111 @@
+"""
+Unit tests for the large file lane of the retrieval class.
+
+"""
+
+import hashlib
+
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.retrieval import Retrieval
+
+
+class TestLargeFileLane:
+    @pytest.mark.asyncio
+    async def test_large_file_lane(self, http_server):
+        small = b"a" * 1000
+        large = b"b" * 30000
+        huge = b"c" * 60000
+        headers = {"Content-Type": "text/csv"}
+        http_server.files["/lane_small.csv"] = (small, headers)
+        http_server.files["/lane_large.csv"] = (large, headers)
+        http_server.files["/lane_huge.csv"] = (huge, headers)
+        url = http_server.url
+        retrieval = Retrieval(
+            "test",
+            {http_server.netloc},
+            large_file_threshold=20000,
+            large_file_concurrency=1,
+            large_file_max_size=50000,
+        )
+        check.equal(retrieval.get_known_size(("url", "1", "csv"), None), None)
+        check.equal(retrieval.get_known_size(("url", "1", "csv"), {"1": 5}), 5)
+        metadata = ("url", "1", "csv", "dataset", "30000", None, None, False)
+        check.equal(retrieval.get_known_size(metadata, {}), 30000)
+        result = await retrieval.check_urls(
+            [
+                (f"{url}/lane_small.csv", "1", "csv"),
+                # size known from HEAD request
+                (f"{url}/lane_large.csv", "2", "csv"),
+                # size known from HDX metadata
+                (f"{url}/lane_large.csv", "3", "csv", "d", 30000, None, None, False),
+                # size not known in advance
+                (f"{url}/lane_large.csv", "4", "csv"),
+                (f"{url}/lane_huge.csv", "5", "csv"),
+            ],
+            {"2": 30000},
+        )
+        check.equal(result["1"], (1000, None, hashlib.md5(small).hexdigest(), 0))
+        expected = (30000, None, hashlib.md5(large).hexdigest(), 0)
+        check.equal(result["2"], expected)
+        check.equal(result["3"], expected)
+        check.equal(result["4"], expected)
+        check.equal(result["5"], (60000, None, None, -11))
+
+    @pytest.mark.asyncio
+    async def test_large_files_do_not_hold_workers(self, http_server):
+        small = b"a" * 1000
+        large = b"b" * 30000
+        headers = {"Content-Type": "text/csv", "Accept-Ranges": "bytes"}
+        http_server.files["/lane2_small.csv"] = (small, headers)
+        http_server.files["/lane2_large.csv"] = (large, headers)
+        url = http_server.url
+        retrieval = Retrieval(
+            "test",
+            {http_server.netloc},
+            segmented_threshold=20000,
+            segments=4,
+            large_file_threshold=20000,
+            large_file_concurrency=1,
+            max_workers=2,
+            host_limits={"rate": 100, "max_rate": 100},
+        )
+        resources = [
+            (f"{url}/lane2_large.csv?slow=0.5&id={i}", f"l{i}", "csv") for i in range(4)
+        ]
+        resources += [
+            (f"{url}/lane2_small.csv?id={i}", f"s{i}", "csv") for i in range(4)
+        ]
+        order = [
+            x[0]
+            async for x in retrieval.stream(
+                resources, {f"l{i}": 30000 for i in range(3)}
+            )
+        ]
+        # Small files are not held up by large files waiting for the lane
+        check.equal(sorted(order[:4]), [f"s{i}" for i in range(4)])
+        check.equal(sorted(order[4:]), [f"l{i}" for i in range(4)])
+
+        # Size not known in advance so headers from the small file lane are
+        # used without another request before the segments
+        requests = len(http_server.requests)
+        result = await retrieval.check_urls(
+            [(f"{url}/lane2_large.csv?id=unknown", "1", "csv")]
+        )
+        check.equal(result["1"], (30000, None, hashlib.md5(large).hexdigest(), 0))
+        ranges = [
+            x[2].get("Range")
+            for x in http_server.requests[requests:]
+            if x[1] == "/lane2_large.csv?id=unknown"
+        ]
+        check.equal(
+            ranges,
+            [
+                None,
+                "bytes=0-7499",
+                "bytes=7500-14999",
+                "bytes=15000-22499",
+                "bytes=22500-29999",
+            ],
+        )
@@ -0,0 +1,118 @@
+"""
+Unit tests for the memory budget for buffered downloads.
+
+"""
+
+import asyncio
+
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection import memory_budget
+from hdx.resource.changedetection.memory_budget import (
+    MemoryBudget,
+    get_default_memory_budget,
+    read_cgroup_memory_limit,
+)
+from hdx.resource.changedetection.retrieval import Retrieval
+from hdx.resource.changedetection.xlsx_hash import XlsxHashPool, hash_xlsx
+
+
+class TestMemoryBudget:
+    def test_read_cgroup_memory_limit(self, monkeypatch, tmp_path):
+        v2 = tmp_path / "memory.max"
+        v1 = tmp_path / "memory.limit_in_bytes"
+        monkeypatch.setattr(memory_budget, "CGROUP_LIMIT_FILES", (str(v2), str(v1)))
+        check.is_none(read_cgroup_memory_limit())
+        v1.write_text("9223372036854771712\n")
+        check.is_none(read_cgroup_memory_limit())
+        v1.write_text("2147483648\n")
+        check.equal(read_cgroup_memory_limit(), 2147483648)
+        v2.write_text("max\n")
+        check.is_none(read_cgroup_memory_limit())
+        v2.write_text("1073741824\n")
+        check.equal(read_cgroup_memory_limit(), 1073741824)
+        check.equal(get_default_memory_budget(0.5), 536870912)
+
+    @pytest.mark.asyncio
+    async def test_memory_budget(self):
+        budget = MemoryBudget(100)
+        await budget.acquire(60)
+        check.is_false(budget.try_acquire(50))
+        check.is_true(budget.try_acquire(40))
+        order = []
+
+        async def acquire(name, size):
+            await budget.acquire(size)
+            order.append(name)
+
+        first = asyncio.create_task(acquire("first", 50))
+        second = asyncio.create_task(acquire("second", 10))
+        await asyncio.sleep(0)
+        check.equal(order, [])
+        budget.release(40)
+        await asyncio.sleep(0)
+        # Waiters are admitted in order
+        check.equal(order, [])
+        budget.release(60)
+        await asyncio.gather(first, second)
+        check.equal(order, ["first", "second"])
+        check.equal(budget.in_use, 60)
+        budget.release(60)
+        # Larger than budget is admitted when nothing else is using it
+        await budget.acquire(1000)
+        check.equal(budget.in_use, 1000)
+        waiter = asyncio.create_task(budget.acquire(10))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        budget.release(1000)
+        check.equal(budget.in_use, 0)
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self, http_server, xlsx_file):
+        with open(xlsx_file, "rb") as file:
+            xlsx = file.read()
+        http_server.files["/budget.xlsx"] = (
+            xlsx,
+            {"Content-Type": Retrieval.mimetypes["xlsx"][0]},
+        )
+        url = f"{http_server.url}/budget.xlsx"
+        retrieval = Retrieval("test", {http_server.netloc}, memory_budget=10000)
+        retrieval.memory_increment = 1000
+        result = await retrieval.check_urls(
+            [(url, str(i), "xlsx") for i in range(4)]
+            + [(f"{url}?nolength", "unknown size", "xlsx")]
+        )
+        expected = (len(xlsx), None, hash_xlsx(xlsx_file), 0)
+        for value in result.values():
+            check.equal(value, expected)
+        check.equal(retrieval._memory_budget.in_use, 0)
+
+    @pytest.mark.asyncio
+    async def test_pickled_copy(self, http_server, xlsx_file, monkeypatch):
+        with open(xlsx_file, "rb") as file:
+            xlsx = file.read()
+        http_server.files["/pickled.xlsx"] = (
+            xlsx,
+            {"Content-Type": Retrieval.mimetypes["xlsx"][0]},
+        )
+        url = f"{http_server.url}/pickled.xlsx"
+        sources = []
+        hash = XlsxHashPool.hash
+
+        async def record_source(self, source):
+            sources.append(type(source))
+            return await hash(self, source)
+
+        monkeypatch.setattr(XlsxHashPool, "hash", record_source)
+        # Budget has room for the buffer and the copy sent to the hashing
+        # process and then only for the buffer
+        for budget, source in ((len(xlsx) * 3, bytearray), (len(xlsx) * 3 // 2, str)):
+            sources.clear()
+            retrieval = Retrieval("test", {http_server.netloc}, memory_budget=budget)
+            result = await retrieval.check_urls([(url, "1", "xlsx")])
+            check.equal(result["1"], (len(xlsx), None, hash_xlsx(xlsx_file), 0))
+            check.equal(sources, [source])
+            check.equal(retrieval._memory_budget.in_use, 0)
@@ -0,0 +1,52 @@
+"""
+Unit tests for range fingerprinting.
+
+"""
+
+import hashlib
+
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.range_fingerprint import (
+    FINGERPRINT_PREFIX,
+    fingerprint_ranges,
+)
+from hdx.resource.changedetection.retrieval import Retrieval
+
+
+class TestRangeFingerprint:
+    def test_fingerprint_ranges(self):
+        expected = fingerprint_ranges(1000, b"head", b"tail")
+        check.is_true(expected.startswith(FINGERPRINT_PREFIX))
+        check.equal(fingerprint_ranges(1000, b"head", b"tail"), expected)
+        check.not_equal(fingerprint_ranges(1001, b"head", b"tail"), expected)
+        check.not_equal(fingerprint_ranges(1000, b"head", b"tale"), expected)
+        check.not_equal(fingerprint_ranges(1000, b"headt", b"ail"), expected)
+        check.not_equal(expected[len(FINGERPRINT_PREFIX) :], hashlib.md5().hexdigest())
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self, http_server):
+        data = bytes(range(256)) * 1000
+        http_server.files["/large.csv"] = (data, {"Content-Type": "text/csv"})
+        http_server.files["/small.csv"] = (data[:5000], {"Content-Type": "text/csv"})
+        url = http_server.url
+        retrieval = Retrieval(
+            "test",
+            {http_server.netloc},
+            range_fingerprint_threshold=100000,
+            range_fingerprint_window=1000,
+        )
+        result = await retrieval.check_urls(
+            [
+                (f"{url}/large.csv", "1", "csv"),
+                (f"{url}/large.csv?norange", "2", "csv"),
+                (f"{url}/small.csv", "3", "csv"),
+                (f"{url}/large.csv", "4", "xlsx"),
+            ]
+        )
+        fingerprint = fingerprint_ranges(len(data), data[:1000], data[-1000:])
+        check.equal(result["1"], (len(data), None, fingerprint, -5))
+        check.equal(result["2"], (len(data), None, hashlib.md5(data).hexdigest(), 0))
+        check.equal(result["3"], (5000, None, hashlib.md5(data[:5000]).hexdigest(), 0))
+        check.equal(result["4"], (len(data), None, fingerprint, -1))
@@ -1009,3 +1009,111 @@ class TestResults:
                 }
             },
         )
+
+    def test_not_modified(self):
+        today = datetime(2019, 11, 10, 8, 4, 27, tzinfo=timezone.utc)
+        resource = (
+            "https://test.com/myfile.csv",
+            "a8b51b81-1fa7-499d-a9f2-3d0bce06b5b5",
+            "csv",
+            "5eaf2ecd-0b29-46cd-bddb-9c2317c9b8e5",
+            357102,
+            datetime(2019, 11, 10, 8, 4, 26, tzinfo=timezone.utc),
+            "1234",
+            False,
+        )
+        results_input = {"1a2b": [None, None, None, 304]}
+        results = Results(today, results_input, {"1a2b": resource})
+        resource_status = {"1a2b": {}}
+        results.process(resource_status)
+        check.equal(resource_status, {"1a2b": {"Get Status": "NOT_MODIFIED"}})
+        check.equal(results.get_datasets_to_revise(), {})
+
+    def test_fingerprint_baseline(self):
+        today = datetime(2019, 11, 10, 8, 4, 27, tzinfo=timezone.utc)
+        resource = (
+            "https://test.com/myfile.zip",
+            "a8b51b81-1fa7-499d-a9f2-3d0bce06b5b5",
+            "shp",
+            "5eaf2ecd-0b29-46cd-bddb-9c2317c9b8e5",
+            357102,
+            datetime(2019, 11, 9, 8, 4, 26, tzinfo=timezone.utc),
+            "d41d8cd98f00b204e9800998ecf8427e",
+            False,
+        )
+        # First zip fingerprint of a resource with an md5 is stored as a
+        # baseline without changing last modified
+        results_input = {"1a2b": [357102, None, "zipcd:1234", -4]}
+        results = Results(today, results_input, {"1a2b": resource})
+        resource_status = {"1a2b": {}}
+        results.process(resource_status)
+        check.equal(resource_status["1a2b"]["Hash Changed"], "N")
+        check.equal(resource_status["1a2b"]["Update"], "Y")
+        check.equal(
+            results.get_datasets_to_revise(),
+            {
+                "5eaf2ecd-0b29-46cd-bddb-9c2317c9b8e5": {
+                    "match": {"id": "5eaf2ecd-0b29-46cd-bddb-9c2317c9b8e5"},
+                    "update__resources__1a2b": {"hash": "zipcd:1234"},
+                }
+            },
+        )
+
+        # Later fingerprints are compared
+        resource = resource[:6] + ("zipcd:1234", False)
+        for hash, changed in (("zipcd:1234", False), ("zipcd:1235", True)):
+            results_input = {"1a2b": [357102, None, hash, -4]}
+            results = Results(today, results_input, {"1a2b": resource})
+            resource_status = {"1a2b": {}}
+            results.process(resource_status)
+            datasets_to_revise = results.get_datasets_to_revise()
+            if changed:
+                check.equal(resource_status["1a2b"]["Hash Changed"], "Y")
+                check.equal(
+                    datasets_to_revise,
+                    {
+                        "5eaf2ecd-0b29-46cd-bddb-9c2317c9b8e5": {
+                            "match": {"id": "5eaf2ecd-0b29-46cd-bddb-9c2317c9b8e5"},
+                            "update__resources__1a2b": {
+                                "hash": "zipcd:1235",
+                                "last_modified": "2019-11-10T08:04:27",
+                            },
+                        }
+                    },
+                )
+            else:
+                check.equal(resource_status["1a2b"]["Hash Changed"], "N")
+                check.equal(datasets_to_revise, {})
+
+    def test_range_fingerprint_baseline(self):
+        today = datetime(2019, 11, 10, 8, 4, 27, tzinfo=timezone.utc)
+        resource = (
+            "https://test.com/myfile.csv",
+            "a8b51b81-1fa7-499d-a9f2-3d0bce06b5b5",
+            "csv",
+            "5eaf2ecd-0b29-46cd-bddb-9c2317c9b8e5",
+            357102,
+            datetime(2019, 11, 9, 8, 4, 26, tzinfo=timezone.utc),
+            "d41d8cd98f00b204e9800998ecf8427e",
+            False,
+        )
+        # Resource crossed range fingerprint threshold and later fell below it
+        for existing_hash, hash, status in (
+            ("d41d8cd98f00b204e9800998ecf8427e", "range:1234", -5),
+            ("range:1234", "d41d8cd98f00b204e9800998ecf8427f", 0),
+        ):
+            resource = resource[:6] + (existing_hash, False)
+            results_input = {"1a2b": [357102, None, hash, status]}
+            results = Results(today, results_input, {"1a2b": resource})
+            resource_status = {"1a2b": {}}
+            results.process(resource_status)
+            check.equal(resource_status["1a2b"]["Hash Changed"], "N")
+            check.equal(
+                results.get_datasets_to_revise(),
+                {
+                    "5eaf2ecd-0b29-46cd-bddb-9c2317c9b8e5": {
+                        "match": {"id": "5eaf2ecd-0b29-46cd-bddb-9c2317c9b8e5"},
+                        "update__resources__1a2b": {"hash": hash},
+                    }
+                },
+            )
@@ -0,0 +1,73 @@
+"""
+Unit tests for the retry tracker.
+
+"""
+
+import pytest
+from aiohttp import ClientResponseError, RequestInfo
+from multidict import CIMultiDict, CIMultiDictProxy
+from pytest_check import check
+from yarl import URL
+
+from hdx.resource.changedetection.head_retrieval import HeadRetrieval
+from hdx.resource.changedetection.retry_tracker import RetryBudget, RetryTracker
+from hdx.resource.changedetection.tenacity_custom_wait import custom_wait
+from hdx.resource.changedetection.worker_pool import RetryLater
+
+
+def get_exception(status):
+    url = URL("http://host/file.csv")
+    request_info = RequestInfo(url, "GET", CIMultiDictProxy(CIMultiDict()), url)
+    return ClientResponseError(request_info, (), status=status)
+
+
+class TestRetryTracker:
+    def test_retry_budget(self):
+        budget = RetryBudget(ratio=0.5, min_retries=1, window=10)
+        check.is_true(budget.try_retry(0))
+        check.is_false(budget.try_retry(1))
+        for now in range(2, 6):
+            budget.record_success(now)
+        # 1 + 0.5 * 4 allows 3 retries of which 1 is used
+        check.is_true(budget.try_retry(6))
+        check.is_true(budget.try_retry(6))
+        check.is_false(budget.try_retry(6))
+        # Successes and retries expire after the window
+        check.is_true(budget.try_retry(17))
+        check.is_false(budget.try_retry(17))
+
+    def test_retry_later(self):
+        tracker = RetryTracker(
+            custom_wait(min=1, max=1), 3, {"ratio": 0, "min_retries": 3}
+        )
+        # Not transient
+        tracker.retry_later("1", "host", get_exception(404))
+        with pytest.raises(RetryLater) as exc_info:
+            tracker.retry_later("1", "host", get_exception(503))
+        check.equal(exc_info.value.delay, 1)
+        check.equal(tracker.get_attempts("1"), 2)
+        with pytest.raises(RetryLater):
+            tracker.retry_later("1", "host", get_exception(503))
+        # No attempts left
+        tracker.retry_later("1", "host", get_exception(503))
+        with pytest.raises(RetryLater):
+            tracker.retry_later("2", "host", get_exception(503))
+        # No budget left for host
+        tracker.retry_later("3", "host", get_exception(503))
+        with pytest.raises(RetryLater):
+            tracker.retry_later("3", "other", get_exception(503))
+        tracker.record_success("host")
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self, http_server):
+        http_server.files["/budget.csv"] = (b"a,b\n", {"Content-Type": "text/csv"})
+        url = http_server.url
+        retrieval = HeadRetrieval(
+            "test", {http_server.netloc}, retry_budget={"min_retries": 1, "ratio": 0}
+        )
+        resources = [
+            (f"{url}/budget.csv?fail=1&id={i}", str(i), "csv") for i in range(3)
+        ]
+        results = {x[0]: x[4] async for x in retrieval.stream(resources)}
+        # Only one failure is retried
+        check.equal(sorted(results.values()), [200, 503, 503])
@@ -0,0 +1,113 @@
+"""
+Unit tests for segmented downloads.
+
+"""
+
+import hashlib
+from os.path import exists
+
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.retrieval import Retrieval
+from hdx.resource.changedetection.segmented_download import (
+    SegmentFile,
+    get_segments,
+    hash_file,
+)
+from hdx.resource.changedetection.xlsx_hash import hash_xlsx
+
+
+class TestSegmentedDownload:
+    def test_get_segments(self):
+        check.equal(get_segments(10, 3), [(0, 3), (4, 7), (8, 9)])
+        check.equal(get_segments(12, 3), [(0, 3), (4, 7), (8, 11)])
+        check.equal(get_segments(2, 4), [(0, 0), (1, 1)])
+
+    def test_segment_file(self, tmp_path):
+        data = bytes(range(256)) * 100
+        segment_file = SegmentFile(len(data), str(tmp_path))
+        for start, end in reversed(get_segments(len(data), 7)):
+            segment_file.write(start, data[start : end + 1])
+        check.equal(segment_file.read(4), data[:4])
+        check.equal(hash_file(segment_file.path, 1000), hashlib.md5(data).hexdigest())
+        segment_file.close()
+        check.is_false(exists(segment_file.path))
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self, http_server, xlsx_file):
+        data = bytes(range(256)) * 1000
+        headers = {"Content-Type": "text/csv", "Accept-Ranges": "bytes"}
+        http_server.files["/segmented.csv"] = (data, headers)
+        with open(xlsx_file, "rb") as file:
+            xlsx = file.read()
+        http_server.files["/segmented.xlsx"] = (
+            xlsx,
+            {
+                "Content-Type": Retrieval.mimetypes["xlsx"][0],
+                "Accept-Ranges": "bytes",
+            },
+        )
+        url = http_server.url
+        retrieval = Retrieval(
+            "test", {http_server.netloc}, segmented_threshold=10000, segments=4
+        )
+        http_server.requests.clear()
+        result = await retrieval.check_urls(
+            [
+                (f"{url}/segmented.csv", "1", "csv"),
+                (f"{url}/segmented.csv?norange", "2", "csv"),
+                (f"{url}/segmented.xlsx", "3", "xlsx"),
+            ]
+        )
+        expected = (len(data), None, hashlib.md5(data).hexdigest(), 0)
+        check.equal(result["1"], expected)
+        check.equal(result["2"], expected)
+        check.equal(result["3"], (len(xlsx), None, hash_xlsx(xlsx_file), 0))
+        ranges = [
+            request[2]["Range"]
+            for request in http_server.requests
+            if request[1] == "/segmented.csv" and "Range" in request[2]
+        ]
+        check.equal(
+            sorted(ranges),
+            [
+                "bytes=0-63999",
+                "bytes=128000-191999",
+                "bytes=192000-255999",
+                "bytes=64000-127999",
+            ],
+        )
+
+    @pytest.mark.asyncio
+    async def test_segments_take_slots(self, http_server):
+        data = bytes(range(256)) * 1000
+        headers = {"Content-Type": "text/csv", "Accept-Ranges": "bytes"}
+        http_server.files["/slots.csv"] = (data, headers)
+        retrieval = Retrieval(
+            "test",
+            {http_server.netloc},
+            segmented_threshold=10000,
+            segments=4,
+            host_limits={
+                "rate": 100,
+                "max_rate": 100,
+                "concurrency": 2,
+                "max_concurrency": 2,
+            },
+        )
+        http_server.requests.clear()
+        result = await retrieval.check_urls(
+            [(f"{http_server.url}/slots.csv", "1", "csv")]
+        )
+        check.equal(result["1"], (len(data), None, hashlib.md5(data).hexdigest(), 0))
+        # Only one other slot is free so the resource is downloaded in two
+        # segments
+        ranges = [
+            request[2]["Range"]
+            for request in http_server.requests
+            if request[1] == "/slots.csv" and "Range" in request[2]
+        ]
+        check.equal(sorted(ranges), ["bytes=0-127999", "bytes=128000-255999"])
+        limiter = retrieval._host_limiters[http_server.netloc]
+        check.equal(limiter._active, 0)
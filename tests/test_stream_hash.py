@@ -0,0 +1,57 @@
+"""
+Unit tests for stream hashing.
+
+"""
+
+import hashlib
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from os import urandom
+
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.stream_hash import StreamHasher
+
+
+class TestStreamHash:
+    @pytest.mark.asyncio
+    async def test_stream_hasher(self):
+        data = urandom(3 * 1048576 + 12345)
+        expected = hashlib.md5(data).hexdigest()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for chunk_size, block_size in (
+                (1000, 1048576),
+                (65536, 100000),
+                (1048576, 65536),
+                (len(data), 1048576),
+            ):
+                hasher = StreamHasher(executor, block_size)
+                for i in range(0, len(data), chunk_size):
+                    await hasher.update(data[i : i + chunk_size])
+                check.equal(await hasher.hexdigest(), expected)
+
+            hasher = StreamHasher(executor)
+            await hasher.update(b"small")
+            check.equal(await hasher.hexdigest(), hashlib.md5(b"small").hexdigest())
+            hasher = StreamHasher(executor)
+            check.equal(await hasher.hexdigest(), hashlib.md5().hexdigest())
+
+    @pytest.mark.asyncio
+    async def test_stream_hasher_memory(self):
+        # Memory used per stream should not grow with the size of the stream
+        block_size = 1048576
+        data = urandom(16 * block_size)
+        chunks = [data[i : i + 16384] for i in range(0, len(data), 16384)]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            tracemalloc.start()
+            try:
+                hasher = StreamHasher(executor, block_size)
+                for chunk in chunks:
+                    await hasher.update(chunk)
+                digest = await hasher.hexdigest()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        check.equal(digest, hashlib.md5(data).hexdigest())
+        check.less(peak, 2.5 * block_size)
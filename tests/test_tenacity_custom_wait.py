@@ -0,0 +1,68 @@
+"""
+Unit tests for the custom tenacity wait strategy.
+
+"""
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from aiohttp import ClientResponseError
+from multidict import CIMultiDict
+from pytest_check import check
+from tenacity import RetryCallState
+
+from hdx.resource.changedetection.tenacity_custom_wait import (
+    custom_wait,
+    parse_retry_after,
+)
+
+
+def get_retry_state(status, headers=None, attempt_number=1, upcoming_sleep=0.0):
+    retry_state = RetryCallState(None, None, (), {})
+    retry_state.attempt_number = attempt_number
+    retry_state.upcoming_sleep = upcoming_sleep
+    exception = ClientResponseError(
+        None, (), status=status, headers=CIMultiDict(headers or {})
+    )
+    retry_state.set_exception((ClientResponseError, exception, None))
+    return retry_state
+
+
+class TestCustomWait:
+    def test_parse_retry_after(self):
+        check.equal(parse_retry_after("120"), 120)
+        check.equal(parse_retry_after(" 5 "), 5)
+        date = datetime.now(timezone.utc) + timedelta(seconds=60)
+        check.between(parse_retry_after(format_datetime(date, usegmt=True)), 55, 61)
+        date = datetime.now(timezone.utc) - timedelta(seconds=60)
+        check.equal(parse_retry_after(format_datetime(date, usegmt=True)), 0)
+        check.is_none(parse_retry_after(None))
+        check.is_none(parse_retry_after("soon"))
+        check.is_none(parse_retry_after("-1"))
+
+    def test_retry_after(self):
+        wait = custom_wait(multiplier=2, min=4, max=60)
+        check.equal(wait(get_retry_state(429, {"Retry-After": "7"})), 7)
+        check.equal(wait(get_retry_state(503, {"Retry-After": "0"})), 0)
+        # Capped
+        check.equal(wait(get_retry_state(429, {"Retry-After": "3600"})), 120)
+        # Only for 429 and 503
+        check.greater_equal(wait(get_retry_state(500, {"Retry-After": "1"})), 4)
+
+    def test_jitter(self):
+        wait = custom_wait(multiplier=2, min=4, max=60)
+        waits = [wait(get_retry_state(500)) for _ in range(100)]
+        check.is_true(all(4 <= x <= 12 for x in waits))
+        check.greater(len(set(waits)), 1)
+        waits = [wait(get_retry_state(500, upcoming_sleep=30)) for _ in range(100)]
+        check.is_true(all(4 <= x <= 60 for x in waits))
+        check.greater(max(waits), 12)
+        # Min is multiplied for 429 without Retry-After
+        waits = [wait(get_retry_state(429)) for _ in range(100)]
+        check.is_true(all(32 <= x <= 60 for x in waits))
+
+    def test_no_jitter(self):
+        wait = custom_wait(multiplier=2, min=4, jitter=False)
+        check.equal(wait(get_retry_state(500)), 4)
+        check.equal(wait(get_retry_state(500, attempt_number=3)), 8)
+        check.equal(wait(get_retry_state(429)), 32)
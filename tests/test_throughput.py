@@ -0,0 +1,80 @@
+"""
+Unit tests for the minimum throughput of downloads.
+
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.results import Results
+from hdx.resource.changedetection.retrieval import Retrieval
+from hdx.resource.changedetection.throughput import SlowTransfer, ThroughputMonitor
+from hdx.resource.changedetection.utilities import get_blank_log_status
+
+
+class TestThroughput:
+    def test_throughput_monitor(self):
+        monitor = ThroughputMonitor(100, grace_period=6, window=2, now=0)
+        # Not enforced in grace period
+        monitor.record(10, 1)
+        monitor.record(10, 4)
+        monitor.record(300, 5)
+        monitor.record(300, 6)
+        # 350 bytes in last 2 seconds
+        monitor.record(50, 7)
+        with pytest.raises(SlowTransfer) as exc_info:
+            monitor.record(10, 9)
+        check.equal(exc_info.value.throughput, 5)
+        monitor = ThroughputMonitor(100, grace_period=0, window=2, now=0)
+        monitor.record(1000, 1)
+        # Gap with no data is measured from last chunk before window
+        with pytest.raises(SlowTransfer) as exc_info:
+            monitor.record(10, 20)
+        check.almost_equal(exc_info.value.throughput, 10 / 19)
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self, http_server):
+        http_server.files["/slow.csv"] = (b"a,b\n" * 50, {"Content-Type": "text/csv"})
+        url = http_server.url
+        retrieval = Retrieval(
+            "test",
+            {http_server.netloc},
+            min_throughput=100,
+            throughput_grace_period=0.2,
+            throughput_window=0.2,
+            sock_read_timeout=1,
+        )
+        result = await retrieval.check_urls(
+            [
+                (f"{url}/slow.csv", "1", "csv"),
+                (f"{url}/slow.csv?trickle=0.02", "2", "csv"),
+            ]
+        )
+        check.equal(result["1"][0], 200)
+        slow_result = result["2"]
+        check.equal(slow_result, (None, None, None, -13))
+
+        # Server that stops sending fails on read timeout
+        retrieval = Retrieval(
+            "test",
+            {http_server.netloc},
+            retry_budget={"ratio": 0, "min_retries": 0},
+            sock_read_timeout=0.1,
+        )
+        result = await retrieval.check_urls(
+            [(f"{url}/slow.csv?trickle=0.5", "3", "csv")]
+        )
+        check.equal(result["3"], (None, None, None, -101))
+
+        # Slow download does not set resource broken
+        resource = (f"{url}/slow.csv", "2", "csv", "d1", None, None, None, False)
+        results = Results(
+            datetime.now(timezone.utc), {"2": slow_result}, {"2": resource}
+        )
+        resource_status = {"2": get_blank_log_status()}
+        results.process(resource_status)
+        check.equal(resource_status["2"]["Get Status"], "TRANSFER TOO SLOW")
+        check.equal(resource_status["2"]["Set Broken"], "N")
+        check.equal(results.get_datasets_to_revise(), {})
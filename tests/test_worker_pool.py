@@ -0,0 +1,230 @@
+"""
+Unit tests for the worker pool.
+
+"""
+
+import asyncio
+
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.head_retrieval import HeadRetrieval
+from hdx.resource.changedetection.retrieval import Retrieval
+from hdx.resource.changedetection.worker_pool import (
+    RetryLater,
+    WorkerLane,
+    stream_results,
+    stream_results_by_key,
+)
+
+
+class TestWorkerPool:
+    @pytest.mark.asyncio
+    async def test_stream_results(self):
+        running = 0
+        max_running = 0
+        pulled = 0
+
+        def items():
+            nonlocal pulled
+            for i in range(50):
+                pulled += 1
+                yield i
+
+        async def worker(item):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.001 * (item % 3))
+            running -= 1
+            return item * 2
+
+        results = []
+        async for result in stream_results(items(), worker, 5):
+            # Items are pulled lazily
+            check.less_equal(pulled, len(results) + 5 + 5 + 1)
+            results.append(result)
+        check.equal(sorted(results), [i * 2 for i in range(50)])
+        check.equal(max_running, 5)
+
+        results = [x async for x in stream_results([], worker, 5)]
+        check.equal(results, [])
+
+    @pytest.mark.asyncio
+    async def test_stream_results_by_key(self):
+        running = {}
+        max_running = {}
+        max_tasks = 0
+        order = []
+        # Busy host a has most of the resources and they come first
+        items = [("a", i) for i in range(100)] + [("b", i) for i in range(5)]
+        items += [("c", i) for i in range(5)]
+
+        async def worker(item):
+            nonlocal max_tasks
+            key = item[0]
+            running[key] = running.get(key, 0) + 1
+            max_running[key] = max(max_running.get(key, 0), running[key])
+            max_tasks = max(max_tasks, len(asyncio.all_tasks()))
+            await asyncio.sleep(0.001)
+            running[key] -= 1
+            order.append(item)
+            return item
+
+        results = [
+            x
+            async for x in stream_results_by_key(
+                iter(items), worker, lambda x: x[0], 6, 2, 50
+            )
+        ]
+        check.equal(sorted(results), sorted(items))
+        check.equal(max_running, {"a": 2, "b": 2, "c": 2})
+        # Only tasks for items being processed plus the test itself
+        check.less_equal(max_tasks, 6 + 1)
+        # Other hosts are served before host a is finished
+        check.less(order.index(("b", 4)), order.index(("a", 99)))
+
+    @pytest.mark.asyncio
+    async def test_stream_results_error(self):
+        cancelled = []
+
+        async def worker(item):
+            if item == 3:
+                raise ValueError("bad item")
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(item)
+                raise
+            return item
+
+        with pytest.raises(ValueError):
+            async for _ in stream_results(range(10), worker, 4):
+                pass
+        check.equal(sorted(cancelled), [0, 1, 2])
+
+    @pytest.mark.asyncio
+    async def test_retry_later(self):
+        attempts = {}
+        order = []
+
+        async def worker(item):
+            attempts[item] = attempts.get(item, 0) + 1
+            if item < 2 and attempts[item] < 3:
+                raise RetryLater(0.05)
+            order.append(item)
+            return item
+
+        results = [x async for x in stream_results(range(6), worker, 2)]
+        check.equal(sorted(results), list(range(6)))
+        check.equal(attempts, {0: 3, 1: 3, 2: 1, 3: 1, 4: 1, 5: 1})
+        # Other items are processed while retries wait
+        check.equal(order[:4], [2, 3, 4, 5])
+
+    @pytest.mark.asyncio
+    async def test_retry_later_until(self):
+        loop = asyncio.get_running_loop()
+        released = loop.create_future()
+        attempts = {}
+
+        async def worker(item):
+            attempts[item] = attempts.get(item, 0) + 1
+            if item < 4 and not released.done():
+                # Parked until released rather than retried after delay
+                raise RetryLater(10, released)
+            if item == 4:
+                await asyncio.sleep(0.05)
+                released.set_result(None)
+            return item
+
+        start = loop.time()
+        results = [x async for x in stream_results(range(5), worker, 5)]
+        check.equal(sorted(results), list(range(5)))
+        check.equal(attempts, {0: 2, 1: 2, 2: 2, 3: 2, 4: 1})
+        check.less(loop.time() - start, 1)
+
+        # Parked items are retried after the delay if the future is not done
+        attempts = {}
+
+        async def worker(item):
+            attempts[item] = attempts.get(item, 0) + 1
+            if attempts[item] == 1:
+                raise RetryLater(0.05, loop.create_future())
+            return item
+
+        results = [x async for x in stream_results(range(3), worker, 3)]
+        check.equal(sorted(results), list(range(3)))
+
+    @pytest.mark.asyncio
+    async def test_worker_lane(self):
+        running = 0
+        max_running = 0
+        attempts = {}
+
+        async def worker(item):
+            nonlocal running, max_running
+            attempts[item] = attempts.get(item, 0) + 1
+            if item == 0 and attempts[item] < 2:
+                raise RetryLater(0.01)
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return item
+
+        async with WorkerLane(worker, 2) as lane:
+            check.equal([x async for x in lane.drain()], [])
+            for i in range(6):
+                lane.submit(i)
+            check.equal(lane.get_completed(), [])
+            results = [x async for x in lane.drain()]
+        check.equal(sorted(results), list(range(6)))
+        check.equal(max_running, 2)
+        check.equal(attempts[0], 2)
+
+        async def fail(item):
+            raise ValueError(item)
+
+        async with WorkerLane(fail, 2) as lane:
+            lane.submit(1)
+            with pytest.raises(ValueError):
+                async for _ in lane.drain():
+                    pass
+
+    @pytest.mark.asyncio
+    async def test_stream(self, http_server):
+        http_server.files["/stream.csv"] = (b"a,b\n", {"Content-Type": "text/csv"})
+        url = http_server.url
+        resources = ((f"{url}/stream.csv", str(i), "csv") for i in range(8))
+        retrieval = HeadRetrieval("test", {http_server.netloc}, max_workers=3)
+        results = [x async for x in retrieval.stream(resources)]
+        check.equal(sorted(x[0] for x in results), sorted(str(i) for i in range(8)))
+        check.is_true(all(x[1:] == (4, None, None, 200) for x in results))
+
+        resources = ((f"{url}/stream.csv", str(i), "csv") for i in range(8))
+        retrieval = Retrieval("test", {http_server.netloc}, max_workers=3)
+        results = [x async for x in retrieval.stream(resources)]
+        check.equal(len(results), 8)
+        check.is_true(all(x[1] == 4 and x[4] == 0 for x in results))
+
+    @pytest.mark.asyncio
+    async def test_stream_retry(self, http_server):
+        http_server.files["/retry.csv"] = (b"a,b\n", {"Content-Type": "text/csv"})
+        url = http_server.url
+        resources = [
+            (f"{url}/retry.csv?fail=1", "1", "csv"),
+            (f"{url}/retry.csv?fail=5", "2", "csv"),
+        ]
+        retrieval = HeadRetrieval("test", {http_server.netloc})
+        results = {x[0]: x[1:] async for x in retrieval.stream(resources)}
+        check.equal(results["1"], (4, None, None, 200))
+        # Gives up after 3 attempts
+        check.equal(results["2"], (None, None, None, 503))
+        check.equal(http_server.failures["/retry.csv?fail=5"], 3)
+
+        retrieval = Retrieval("test", {http_server.netloc})
+        resources = [(f"{url}/retry.csv?fail=2&get", "1", "csv")]
+        results = [x async for x in retrieval.stream(resources)]
+        check.equal(results[0][1], 4)
+        check.equal(results[0][4], 0)
+        check.equal(http_server.failures["/retry.csv?fail=2&get"], 3)
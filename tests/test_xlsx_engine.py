@@ -0,0 +1,361 @@
+"""
+Unit tests for the xlsx XML hashing engine. Checks that it gives the same
+hashes as openpyxl over a varied corpus of workbooks.
+
+"""
+
+from datetime import datetime, time, timedelta
+from io import BytesIO
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import pytest
+from openpyxl import Workbook
+from pytest_check import check
+
+from hdx.resource.changedetection import xlsx_engine
+from hdx.resource.changedetection.xlsx_engine import (
+    UnsupportedWorkbook,
+    hash_xlsx_xml,
+    read_shared_strings,
+)
+from hdx.resource.changedetection.xlsx_hash import hash_xlsx, hash_xlsx_openpyxl
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+STYLES = f"""<?xml version="1.0" encoding="UTF-8"?>
+<styleSheet xmlns="{MAIN_NS}">
+<numFmts count="2">
+<numFmt numFmtId="164" formatCode="yyyy\\-mm\\-dd"/>
+<numFmt numFmtId="165" formatCode="[h]:mm:ss"/>
+</numFmts>
+<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="1"><fill><patternFill patternType="none"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="5">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="10" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+</cellXfs>
+</styleSheet>"""
+
+
+def make_xlsx(sheets, shared_strings=None, date1904=False, styles=True):
+    """Create an xlsx file from raw sheet data XML"""
+    content_types = [
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>',
+        '<Default Extension="xml" ContentType="application/xml"/>',
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>',
+    ]
+    workbook_rels = []
+    workbook_sheets = []
+    output = BytesIO()
+    with ZipFile(output, "w", ZIP_DEFLATED) as archive:
+        for i, (name, sheet_xml) in enumerate(sheets, start=1):
+            path = f"xl/worksheets/sheet{i}.xml"
+            if isinstance(sheet_xml, str):
+                sheet_xml = f'<?xml version="1.0" encoding="UTF-8"?><worksheet xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">{sheet_xml}</worksheet>'
+            archive.writestr(path, sheet_xml)
+            content_types.append(
+                f'<Override PartName="/{path}" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            )
+            workbook_rels.append(
+                f'<Relationship Id="rId{i}" Type="{REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+            )
+            workbook_sheets.append(
+                f'<sheet name="{name}" sheetId="{i}" r:id="rId{i}"/>'
+            )
+        extra_id = len(sheets) + 1
+        if shared_strings is not None:
+            archive.writestr(
+                "xl/sharedStrings.xml",
+                f'<?xml version="1.0" encoding="UTF-8"?><sst xmlns="{MAIN_NS}">{shared_strings}</sst>',
+            )
+            content_types.append(
+                '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            )
+            workbook_rels.append(
+                f'<Relationship Id="rId{extra_id}" Type="{REL_NS}/sharedStrings" Target="sharedStrings.xml"/>'
+            )
+            extra_id += 1
+        if styles:
+            archive.writestr("xl/styles.xml", STYLES)
+            content_types.append(
+                '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            )
+            workbook_rels.append(
+                f'<Relationship Id="rId{extra_id}" Type="{REL_NS}/styles" Target="styles.xml"/>'
+            )
+        archive.writestr(
+            "[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            + "".join(content_types)
+            + "</Types>",
+        )
+        archive.writestr(
+            "_rels/.rels",
+            f'<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="{PKG_REL_NS}"><Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+        )
+        archive.writestr(
+            "xl/_rels/workbook.xml.rels",
+            f'<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="{PKG_REL_NS}">'
+            + "".join(workbook_rels)
+            + "</Relationships>",
+        )
+        workbook_pr = '<workbookPr date1904="1"/>' if date1904 else "<workbookPr/>"
+        archive.writestr(
+            "xl/workbook.xml",
+            f'<?xml version="1.0" encoding="UTF-8"?><workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">{workbook_pr}<sheets>'
+            + "".join(workbook_sheets)
+            + "</sheets></workbook>",
+        )
+    return output.getvalue()
+
+
+SHARED_STRINGS = """
+<si><t>plain</t></si>
+<si><r><t>rich </t></r><r><rPr><b/></rPr><t>text</t></r></si>
+<si><t xml:space="preserve">  spaced  </t></si>
+<si><t>escaped_x005F_x0041_</t></si>
+<si><t/></si>
+<si><t>with phonetic</t><rPh sb="0" eb="1"><t>ignored</t></rPh></si>
+<si><t>unicode é中文 'quote' "double"</t></si>
+"""
+
+RAW_SHEETS = {
+    "types": """<dimension ref="A1:H3"/><sheetData>
+<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="s"><v>2</v></c><c r="D1" t="s"><v>3</v></c><c r="E1" t="s"><v>4</v></c><c r="F1" t="s"><v>5</v></c><c r="G1" t="s"><v>6</v></c></row>
+<row r="2"><c r="A2"><v>42</v></c><c r="B2"><v>-3.5</v></c><c r="C2"><v>1.5E-7</v></c><c r="D2" t="b"><v>1</v></c><c r="E2" t="b"><v>0</v></c><c r="F2" t="e"><v>#N/A</v></c><c r="G2" t="str"><v>formula text</v></c><c r="H2"><v></v></c></row>
+<row r="3"><c r="A3" t="inlineStr"><is><t>inline</t></is></c><c r="B3" t="inlineStr"><is><r><t>in</t></r><r><t>line rich</t></r></is></c><c r="C3" t="inlineStr"/><c r="D3" t="d"><v>2020-02-29T13:45:00</v></c><c r="E3" t="n"><v>12345678901234567890</v></c></row>
+</sheetData>""",
+    "dates": """<dimension ref="A1:E2"/><sheetData>
+<row r="1"><c r="A1" s="1"><v>43831</v></c><c r="B1" s="2"><v>44000.5</v></c><c r="C1" s="3"><v>1.25</v></c><c r="D1" s="4"><v>0.25</v></c><c r="E1" s="1"><v>99999999</v></c></row>
+<row r="2"><c r="A2" s="0"><v>43831</v></c><c r="B2" s="2" t="s"><v>0</v></c><c r="C2" s="1"><v>-1</v></c></row>
+</sheetData>""",
+    "formulas": """<dimension ref="A1:C4"/><sheetData>
+<row r="1"><c r="A1"><v>1</v></c><c r="B1"><f>A1*2</f><v>2</v></c><c r="C1"><f t="shared" ref="C1:C4" si="0">A1+B1</f><v>3</v></c></row>
+<row r="2"><c r="A2"><v>2</v></c><c r="B2"><f>SUM(A1:A2)</f><v>3</v></c><c r="C2"><f t="shared" si="0"/><v>5</v></c></row>
+<row r="3"><c r="C3"><f t="shared" si="0"/><v>0</v></c></row>
+<row r="4"><c r="A4" t="str"><f>"a"&amp;"b"</f><v>ab</v></c><c r="C4"><f t="shared" si="0"/><v>0</v></c></row>
+</sheetData>""",
+    "sparse": """<dimension ref="B2:F9"/><sheetData>
+<row r="2"><c r="C2"><v>1</v></c></row>
+<row r="5"><c r="F5"><v>2</v></c><c r="B5"><v>3</v></c></row>
+<row r="9"><c r="B9" t="s"><v>0</v></c></row>
+</sheetData>""",
+    "nodimension": """<sheetData>
+<row r="1"><c r="A1"><v>1</v></c><c r="C1"><v>2</v></c></row>
+<row r="3"><c r="B3"><v>3</v></c></row>
+<row r="4"/>
+<row r="6"><c r="E6"><v>4</v></c></row>
+</sheetData>""",
+    "smalldimension": """<dimension ref="A1:B2"/><sheetData>
+<row r="1"><c r="A1"><v>1</v></c><c r="B1"><v>2</v></c><c r="C1"><v>3</v></c></row>
+<row r="2"><c r="A2"><v>4</v></c></row>
+<row r="3"><c r="A3"><v>5</v></c></row>
+<row r="4"><c r="A4"><v>6</v></c></row>
+</sheetData>""",
+    "largedimension": """<dimension ref="A1:J20"/><sheetData>
+<row r="1"><c r="A1"><v>1</v></c></row>
+<row r="2"><c r="B2"><v>2</v></c></row>
+</sheetData>""",
+    "singlecell": """<dimension ref="A1"/><sheetData>
+<row r="1"><c r="A1" t="s"><v>1</v></c></row>
+</sheetData>""",
+    "norefs": """<sheetData>
+<row><c><v>1</v></c><c t="s"><v>0</v></c><c/><c><v>2</v></c></row>
+<row><c><v>3</v></c></row>
+<row r="5"><c><v>4</v></c><c r="D5"><v>5</v></c><c><v>6</v></c></row>
+<row spans="1:2" ht="20" customHeight="1"><c><v>7</v></c></row>
+</sheetData>""",
+    "empty": """<dimension ref="A1"/><sheetData/>""",
+    "emptynodimension": """<sheetData/>""",
+    "extras": """<sheetPr><tabColor rgb="FFFF0000"/></sheetPr><dimension ref="A1:B2"/><sheetViews><sheetView workbookViewId="0"/></sheetViews><sheetFormatPr defaultRowHeight="15"/><cols><col min="1" max="2" width="12" customWidth="1"/></cols><sheetData>
+<row r="1"><c r="A1"><v>1</v></c><c r="B1"><v>2</v></c></row>
+<row r="2"><c r="A2" t="s"><v>2</v></c></row>
+</sheetData><mergeCells count="1"><mergeCell ref="A2:B2"/></mergeCells><pageMargins left="0.7" right="0.7" top="0.75" bottom="0.75" header="0.3" footer="0.3"/>""",
+    "outoforder": """<dimension ref="A1:C5"/><sheetData>
+<row r="3"><c r="A3"><v>3</v></c></row>
+<row r="1"><c r="A1"><v>1</v></c></row>
+<row r="5"><c r="C5"><v>5</v></c></row>
+<row r="5"><c r="B5"><v>6</v></c></row>
+</sheetData>""",
+}
+
+
+# Complete worksheets which exercise the fallbacks from the regex fast path
+RAW_DOCUMENTS = {
+    "prefixed": f"""<?xml version="1.0" encoding="UTF-8"?>
+<x:worksheet xmlns:x="{MAIN_NS}"><x:dimension ref="A1:B2"/><x:sheetData>
+<x:row r="1"><x:c r="A1"><x:v>1</x:v></x:c><x:c r="B1" t="s"><x:v>0</x:v></x:c></x:row>
+<x:row r="2"><x:c r="A2"><x:v>2</x:v></x:c></x:row>
+</x:sheetData></x:worksheet>""".encode(),
+    "escaped": f"""<?xml version="1.0" encoding="UTF-8"?>
+<worksheet xmlns="{MAIN_NS}"><dimension ref="A1:C3"/><sheetData>
+<row r="1"><c r="A1" t="str"><v>a &amp; b &lt;c&gt; &#233;</v></c><c r="B1" t="str"><v><![CDATA[<cdata>]]></v></c></row>
+<!-- comment -->
+<row r='2'><c r='A2' t='s'><v>1</v></c><c r="B2"><!-- comment --><v>3</v></c></row>
+<row r="3"><c r="A3" t="str"><v>it's "quoted"</v></c><c t="str" r="B3" s="0"><v>\r\n</v></c><c r="C3" t="inlineStr"><v>ignored</v></c></row>
+</sheetData></worksheet>""".encode(),
+    "pretty": f"""\ufeff<?xml version="1.0" encoding="utf-8"?>\r
+<worksheet xmlns:r="{REL_NS}" xmlns="{MAIN_NS}">\r
+  <dimension ref="A1:C2" />\r
+  <sheetData >\r
+    <row r = "1" spans="1:3">\r
+      <c r="A1" >\r
+        <v>1</v>\r
+      </c>\r
+      <c r="B1" t="s"><v>2</v></c>\r
+      <c r="C1"><v /></c>\r
+    </row>\r
+    <row r="2">\r
+      <c r="B2"><v>2.5</v></c>\r
+      <c r="C2" t="n"/>\r
+    </row>\r
+  </sheetData>\r
+</worksheet>""".encode(),
+    "latin1": f"""<?xml version="1.0" encoding="ISO-8859-1"?>
+<worksheet xmlns="{MAIN_NS}"><sheetData>
+<row r="1"><c r="A1" t="str"><v>caf\xe9</v></c></row>
+</sheetData></worksheet>""".encode("latin-1"),
+    "inline": f"""<?xml version="1.0" encoding="UTF-8"?>
+<worksheet xmlns="{MAIN_NS}"><sheetData>
+<row r="1"><c r="A1" t="inlineStr"><is><t>plain</t></is></c><c r="B1" t="inlineStr"><is><t xml:space="preserve"> spaced </t></is></c><c r="C1" t="inlineStr"><is><t/></is></c><c r="D1" t="inlineStr"><is></is></c><c r="E1" t="inlineStr"><v>ignored</v></c></row>
+<row r="2"><c r="A2" t="inlineStr"><is>
+<t>pretty</t>
+</is></c><c r="B2" t="inlineStr"><is><t>a</t><r><t>b</t></r></is></c><c r="C2"><is><t>not inline</t></is></c><c r="D2" t="inlineStr"><is><t>x_x005F_y</t></is></c></row>
+</sheetData></worksheet>""".encode(),
+    "extension": f"""<?xml version="1.0" encoding="UTF-8"?>
+<worksheet xmlns="{MAIN_NS}" xmlns:x14ac="http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac"><dimension ref="A1:B2"/><sheetData>
+<row r="1" x14ac:dyDescent="0.25"><c r="A1"><v>1</v></c></row>
+<row r="2"><c r="a2"><v>2</v></c><c r="B2"><x14ac:unknown/><v>3</v></c></row>
+</sheetData></worksheet>""".encode(),
+}
+
+
+def openpyxl_workbooks():
+    """Workbooks written by openpyxl"""
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "Data"
+    sheet.append(["Country", "ISO3", "Value", "Date", "Flag", "Time", "Delta"])
+    for i in range(500):
+        sheet.append(
+            [
+                f"Country {i} é",
+                f"C{i:02d}",
+                i * 1.5 if i % 3 else i,
+                datetime(2020, 1, 1 + i % 28, i % 24),
+                i % 2 == 0,
+                time(i % 24, i % 60),
+                timedelta(hours=i),
+            ]
+        )
+    sheet["J3"] = "=SUM(C2:C10)"
+    sheet = workbook.create_sheet("Sparse")
+    sheet["C3"] = "x"
+    sheet["H20"] = 1e100
+    sheet["A1"] = None
+    workbook.create_sheet("Empty")
+    sheet = workbook.create_sheet("Hidden")
+    sheet.sheet_state = "hidden"
+    sheet["A1"] = "hidden"
+    output = BytesIO()
+    workbook.save(output)
+    yield "openpyxl", output.getvalue()
+
+    workbook = Workbook()
+    sheet = workbook.active
+    for i in range(1, 200):
+        sheet.cell(row=i * 3, column=(i % 30) + 1, value=i * 7.25)
+    workbook.epoch = datetime(1904, 1, 1)
+    sheet["A1"] = datetime(2000, 1, 1)
+    output = BytesIO()
+    workbook.save(output)
+    yield "openpyxl1904", output.getvalue()
+
+
+def raw_workbooks():
+    """Workbooks written directly from XML"""
+    for name, sheet_xml in RAW_SHEETS.items():
+        yield (
+            name,
+            make_xlsx([(name, sheet_xml)], SHARED_STRINGS),
+        )
+    for name, sheet_xml in RAW_DOCUMENTS.items():
+        yield (
+            name,
+            make_xlsx([(name, sheet_xml)], SHARED_STRINGS),
+        )
+    yield (
+        "multisheet",
+        make_xlsx(list(RAW_SHEETS.items()), SHARED_STRINGS),
+    )
+    yield (
+        "date1904",
+        make_xlsx([("dates", RAW_SHEETS["dates"])], SHARED_STRINGS, date1904=True),
+    )
+    yield (
+        "nostyles",
+        make_xlsx([("dates", RAW_SHEETS["dates"])], SHARED_STRINGS, styles=False),
+    )
+    yield (
+        "nosharedstrings",
+        make_xlsx([("sparse", RAW_SHEETS["sparse"].replace(' t="s"', ""))]),
+    )
+
+
+CORPUS = list(openpyxl_workbooks()) + list(raw_workbooks())
+
+
+class TestXlsxEngine:
+    @pytest.mark.parametrize("name,data", CORPUS, ids=[x[0] for x in CORPUS])
+    def test_compatibility(self, name, data):
+        expected = hash_xlsx_openpyxl(BytesIO(data))
+        check.equal(hash_xlsx_xml(BytesIO(data)), expected)
+        check.equal(hash_xlsx(data), expected)
+
+    @pytest.mark.parametrize("name,data", CORPUS, ids=[x[0] for x in CORPUS])
+    def test_block_boundaries(self, monkeypatch, name, data):
+        # Rows and sheetData split across blocks
+        monkeypatch.setattr(xlsx_engine, "FAST_BLOCK_SIZE", 7)
+        check.equal(hash_xlsx_xml(BytesIO(data)), hash_xlsx_openpyxl(BytesIO(data)))
+
+    def test_compatibility_file(self, xlsx_file):
+        check.equal(hash_xlsx_xml(xlsx_file), hash_xlsx_openpyxl(xlsx_file))
+
+    def test_read_shared_strings(self):
+        data = make_xlsx([], SHARED_STRINGS)
+        with ZipFile(BytesIO(data)) as archive:
+            with archive.open("xl/sharedStrings.xml") as src:
+                strings = read_shared_strings(src)
+        check.equal(
+            strings,
+            [
+                "plain",
+                "rich text",
+                "  spaced  ",
+                "escaped_x0041_",
+                "",
+                "with phonetic",
+                "unicode é中文 'quote' \"double\"",
+            ],
+        )
+
+    def test_unsupported(self):
+        data = make_xlsx(
+            [
+                (
+                    "array",
+                    """<sheetData><row r="1"><c r="A1"><f t="array" ref="A1:A2">B1:B2*2</f><v>1</v></c></row></sheetData>""",
+                )
+            ]
+        )
+        with pytest.raises(UnsupportedWorkbook):
+            hash_xlsx_xml(BytesIO(data))
+        # Falls back to openpyxl
+        check.is_true(len(hash_xlsx(data)) == 32)
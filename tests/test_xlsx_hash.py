@@ -0,0 +1,143 @@
+"""
+Unit tests for xlsx hashing.
+
+"""
+
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists
+
+import pytest
+from openpyxl import load_workbook
+from pytest_check import check
+
+from hdx.resource.changedetection.xlsx_hash import (
+    XlsxBuffer,
+    XlsxHashPool,
+    hash_xlsx,
+)
+
+
+class TestXlsxHash:
+    @staticmethod
+    def expected_hash(path):
+        workbook = load_workbook(filename=path, read_only=True)
+        md5hash = hashlib.md5()
+        for sheet_name in workbook.sheetnames:
+            for cols in workbook[sheet_name].iter_rows(values_only=True):
+                md5hash.update(bytes(str(cols), "utf-8"))
+        workbook.close()
+        return md5hash.hexdigest()
+
+    def test_hash_xlsx(self, xlsx_file):
+        expected = self.expected_hash(xlsx_file)
+        check.equal(hash_xlsx(xlsx_file), expected)
+        with open(xlsx_file, "rb") as f:
+            data = f.read()
+        check.equal(hash_xlsx(data), expected)
+        check.equal(hash_xlsx(bytearray(data)), expected)
+
+    def test_xlsx_buffer(self, xlsx_file, tmp_path):
+        expected = self.expected_hash(xlsx_file)
+        with open(xlsx_file, "rb") as f:
+            data = f.read()
+        chunks = [data[i : i + 1000] for i in range(0, len(data), 1000)]
+
+        xlsxbuffer = XlsxBuffer(len(data) + 1, str(tmp_path))
+        for chunk in chunks:
+            xlsxbuffer.write(chunk)
+        check.is_false(xlsxbuffer.is_spooled())
+        check.equal(xlsxbuffer.size, len(data))
+        check.equal(hash_xlsx(xlsxbuffer.get_source()), expected)
+        xlsxbuffer.close()
+
+        xlsxbuffer = XlsxBuffer(5000, str(tmp_path))
+        for chunk in chunks:
+            xlsxbuffer.write(chunk)
+        check.is_true(xlsxbuffer.is_spooled())
+        check.equal(xlsxbuffer.size, len(data))
+        path = xlsxbuffer.get_source()
+        check.is_true(exists(path))
+        check.equal(hash_xlsx(path), expected)
+        xlsxbuffer.close()
+        check.is_false(exists(path))
+
+        # Preallocated from expected size which may be wrong
+        for expected_size in (len(data), len(data) - 1500, len(data) + 1500):
+            xlsxbuffer = XlsxBuffer(len(data) * 2, str(tmp_path), expected_size)
+            for chunk in chunks:
+                xlsxbuffer.write(chunk)
+            check.is_false(xlsxbuffer.is_spooled())
+            check.equal(xlsxbuffer.get_source(), data)
+            xlsxbuffer.close()
+        xlsxbuffer = XlsxBuffer(5000, str(tmp_path), 4000)
+        for chunk in chunks:
+            xlsxbuffer.write(chunk)
+        check.equal(hash_xlsx(xlsxbuffer.get_source()), expected)
+        xlsxbuffer.close()
+
+        # Spooled early eg. when memory budget is exhausted
+        xlsxbuffer = XlsxBuffer(len(data) + 1, str(tmp_path))
+        xlsxbuffer.write(chunks[0])
+        xlsxbuffer.spool()
+        for chunk in chunks[1:]:
+            xlsxbuffer.write(chunk)
+        check.is_true(xlsxbuffer.is_spooled())
+        check.equal(hash_xlsx(xlsxbuffer.get_source()), expected)
+        xlsxbuffer.close()
+
+    @pytest.mark.asyncio
+    async def test_xlsx_buffer_async(self, xlsx_file, tmp_path):
+        expected = self.expected_hash(xlsx_file)
+        with open(xlsx_file, "rb") as f:
+            data = f.read()
+        chunks = [data[i : i + 1000] for i in range(0, len(data), 1000)]
+        submitted = 0
+
+        class CountingExecutor(ThreadPoolExecutor):
+            def submit(self, *args, **kwargs):
+                nonlocal submitted
+                submitted += 1
+                return super().submit(*args, **kwargs)
+
+        with CountingExecutor(1) as executor:
+            xlsxbuffer = XlsxBuffer(5000, str(tmp_path))
+            check.is_false(xlsxbuffer.writes_to_disk(chunks[0]))
+            for chunk in chunks[:5]:
+                await xlsxbuffer.write_async(chunk, executor)
+            # Only writes to the file are done in the executor
+            check.equal(submitted, 0)
+            check.is_true(xlsxbuffer.writes_to_disk(chunks[5]))
+            for chunk in chunks[5:]:
+                await xlsxbuffer.write_async(chunk, executor)
+            check.equal(submitted, len(chunks) - 5)
+            check.is_true(xlsxbuffer.is_spooled())
+            check.equal(hash_xlsx(xlsxbuffer.get_source()), expected)
+            xlsxbuffer.close()
+
+            xlsxbuffer = XlsxBuffer(len(data) + 1, str(tmp_path))
+            await xlsxbuffer.write_async(chunks[0], executor)
+            await xlsxbuffer.spool_async(executor)
+            check.is_true(xlsxbuffer.is_spooled())
+            for chunk in chunks[1:]:
+                await xlsxbuffer.write_async(chunk, executor)
+            check.equal(hash_xlsx(xlsxbuffer.get_source()), expected)
+            xlsxbuffer.close()
+
+    @pytest.mark.asyncio
+    async def test_xlsx_hash_pool(self, xlsx_file):
+        expected = self.expected_hash(xlsx_file)
+        with open(xlsx_file, "rb") as f:
+            data = f.read()
+        pool = XlsxHashPool(max_workers=2, max_tasks_per_worker=1)
+        try:
+            hashes = await asyncio.gather(
+                *(pool.hash(source) for source in (xlsx_file, data, xlsx_file, data))
+            )
+            # Worker processes are not forked from the threaded parent
+            start_method = pool._executor._mp_context.get_start_method()
+            check.equal(start_method, "forkserver")
+        finally:
+            pool.shutdown()
+        check.equal(hashes, [expected] * 4)
@@ -0,0 +1,119 @@
+"""
+Unit tests for zip fingerprinting.
+
+"""
+
+import hashlib
+import zipfile
+from io import BytesIO
+
+import pytest
+from pytest_check import check
+
+from hdx.resource.changedetection.retrieval import Retrieval
+from hdx.resource.changedetection.zip_fingerprint import (
+    FINGERPRINT_PREFIX,
+    TAIL_SIZE,
+    InvalidZip,
+    find_central_directory,
+    fingerprint_central_directory,
+)
+
+
+def make_zip(files, compression=zipfile.ZIP_DEFLATED, date_time=(2020, 1, 1, 0, 0, 0)):
+    output = BytesIO()
+    with zipfile.ZipFile(output, "w", compression) as archive:
+        for name, data in files:
+            archive.writestr(zipfile.ZipInfo(name, date_time), data)
+        archive.comment = b"comment"
+    return output.getvalue()
+
+
+def fingerprint(data):
+    tail_start = max(len(data) - TAIL_SIZE, 0)
+    start, size, entries = find_central_directory(data[tail_start:], tail_start)
+    return fingerprint_central_directory(data[start : start + size], entries)
+
+
+FILES = [("a.shp", b"shape" * 100), ("a.dbf", b"table" * 50), ("a.prj", b"")]
+
+
+class TestZipFingerprint:
+    def test_find_central_directory(self):
+        data = make_zip(FILES)
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            expected = archive.start_dir
+        tail_start = len(data) - 100
+        start, size, entries = find_central_directory(data[-100:], tail_start)
+        check.equal(start, expected)
+        check.equal(entries, 3)
+        # Data prepended to the zip file
+        start, size, entries = find_central_directory(b"x" * 10 + data, 0)
+        check.equal(start, expected + 10)
+
+    def test_fingerprint(self):
+        expected = fingerprint(make_zip(FILES))
+        check.is_true(expected.startswith(FINGERPRINT_PREFIX))
+        # Same contents zipped differently
+        data = make_zip(FILES, zipfile.ZIP_STORED, (2024, 6, 1, 12, 0, 0))
+        check.equal(fingerprint(data), expected)
+        # Changed contents
+        data = make_zip(FILES[:2] + [("a.prj", b"GEOGCS")])
+        check.not_equal(fingerprint(data), expected)
+        data = make_zip(FILES[:2])
+        check.not_equal(fingerprint(data), expected)
+
+    def test_zip64(self, monkeypatch):
+        expected = fingerprint(make_zip(FILES))
+        monkeypatch.setattr(zipfile, "ZIP_FILECOUNT_LIMIT", 1)
+        monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 10)
+        data = make_zip(FILES)
+        check.is_true(b"PK\x06\x06" in data)
+        check.equal(fingerprint(data), expected)
+
+    def test_invalid(self):
+        with pytest.raises(InvalidZip):
+            fingerprint(b"not a zip file" * 100)
+        data = make_zip(FILES)
+        tail_start = len(data) - 100
+        start, size, entries = find_central_directory(data[tail_start:], tail_start)
+        with pytest.raises(InvalidZip):
+            fingerprint_central_directory(data[start : start + size - 1], entries)
+        with pytest.raises(InvalidZip):
+            fingerprint_central_directory(data[start : start + size], entries + 1)
+
+    @pytest.mark.asyncio
+    async def test_retrieval(self, http_server):
+        data = make_zip(FILES)
+        http_server.files["/small.zip"] = (data, {"Content-Type": "application/zip"})
+        files = [(f"{i:040d}.csv", str(i).encode()) for i in range(2000)]
+        large_directory = make_zip(files)
+        http_server.files["/large.zip"] = (
+            large_directory,
+            {"Content-Type": "application/zip"},
+        )
+        http_server.files["/notzip.zip"] = (
+            b"not a zip file",
+            {"Content-Type": "application/zip"},
+        )
+        url = http_server.url
+        retrieval = Retrieval(
+            "test", {http_server.netloc}, zip_fingerprint_formats=["shp"]
+        )
+        result = await retrieval.check_urls(
+            [
+                (f"{url}/small.zip", "1", "shp"),
+                (f"{url}/small.zip?norange", "2", "shp"),
+                (f"{url}/large.zip", "3", "shp"),
+                (f"{url}/notzip.zip", "4", "shp"),
+                (f"{url}/small.zip", "5", "xls"),
+            ]
+        )
+        check.equal(result["1"], (len(data), None, fingerprint(data), -4))
+        check.equal(result["2"], (len(data), None, hashlib.md5(data).hexdigest(), 0))
+        check.equal(
+            result["3"],
+            (len(large_directory), None, fingerprint(large_directory), -4),
+        )
+        check.equal(result["4"][3], -2)
+        check.equal(result["5"], (len(data), None, hashlib.md5(data).hexdigest(), -1))